@@ -0,0 +1,218 @@
+"""This module contains a compact container for the train rides of a search. Instead of one
+TrainRideRecord per train, every field is stored in its own typed array, and the records are only
+built when somebody asks for them, which is usually just for the rides that will be shown.
+
+The values of a batch come from the scraper, which already converted them to the right types, so
+the records asked for are validated together in strict mode, without any coercion, by a single
+call to pydantic."""
+
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, overload
+
+from pydantic import TypeAdapter
+
+from models import TrainRideRecord
+
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+
+records_adapter = TypeAdapter(List[TrainRideRecord])
+
+# origin, destination, departure, arrival, duration, price, available, train type
+RideRow = Tuple[str, str, int, int, int, float, bool, str]
+
+
+def to_minutes(date: datetime) -> int:
+    """Convert a naive datetime to minutes since the epoch, dropping the seconds"""
+    return (date - EPOCH) // MINUTE
+
+
+def from_minutes(minutes: int) -> datetime:
+    """Convert minutes since the epoch to a naive datetime"""
+    return EPOCH + MINUTE * minutes
+
+
+class TrainRideBatch(Sequence[TrainRideRecord]):
+    """Columnar list of train rides.
+
+    Departure and arrival times are stored as minutes since the epoch, durations and prices in
+    typed arrays and the availability in a bitmap. Station names and train types are stored once
+    in a table of strings, and the rides only keep their position in it. Indexing the batch builds
+    the TrainRideRecord of that ride.
+
+    The batch is meant to be filled once by whoever creates it and not modified after that.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.string_ids: Dict[str, int] = {}
+
+        self.origins = array("H")
+        self.destinations = array("H")
+        self.train_types = array("H")
+        self.departures = array("q")
+        self.arrivals = array("q")
+        self.durations = array("l")
+        self.prices = array("d")
+        self.available = bytearray()
+
+    @classmethod
+    def from_records(cls, records: Iterable[TrainRideRecord]) -> "TrainRideBatch":
+        """Create a batch from train ride records"""
+        batch = cls()
+        for record in records:
+            batch.append(record.origin, record.destination, to_minutes(record.departure_time),
+                         to_minutes(record.arrival_time), record.duration, record.price,
+                         record.available, record.train_type)
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[RideRow]) -> "TrainRideBatch":
+        """Create a batch from the rows of another one, see :meth:`rows`"""
+        batch = cls()
+        for row in rows:
+            batch.append(*row)
+        return batch
+
+    def intern(self, string: str) -> int:
+        """Return the position of a string in the table of strings, adding it if needed"""
+        if (string_id := self.string_ids.get(string)) is None:
+            string_id = self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def append(self, origin: str, destination: str, departure: int, arrival: int, duration: int,
+               price: float, available: bool, train_type: str) -> None:
+        """Add a ride to the batch, with its times as minutes since the epoch"""
+        idx = len(self.departures)
+        self.origins.append(self.intern(origin))
+        self.destinations.append(self.intern(destination))
+        self.train_types.append(self.intern(train_type))
+        self.departures.append(departure)
+        self.arrivals.append(arrival)
+        self.durations.append(duration)
+        self.prices.append(price)
+        if idx % 8 == 0:
+            self.available.append(0)
+        if available:
+            self.available[idx // 8] |= 1 << (idx % 8)
+
+    def extend(self, origin: str, destination: str, departures: Sequence[int],
+               arrivals: Sequence[int], durations: Sequence[int], prices: Sequence[float],
+               available: Sequence[bool], train_types: Sequence[str]) -> None:
+        """Add many rides with the same origin and destination to the batch, one column at a time,
+        which is faster than appending them one by one"""
+        start = len(self.departures)
+        count = len(departures)
+        self.origins.extend([self.intern(origin)] * count)
+        self.destinations.extend([self.intern(destination)] * count)
+        self.train_types.extend([self.intern(train_type) for train_type in train_types])
+        self.departures.extend(departures)
+        self.arrivals.extend(arrivals)
+        self.durations.extend(durations)
+        self.prices.extend(prices)
+
+        mask = self.available_mask
+        for idx, is_available in enumerate(available, start):
+            if is_available:
+                mask |= 1 << idx
+        self.available = bytearray(mask.to_bytes((start + count + 7) // 8, "little"))
+
+    def is_available(self, idx: int) -> bool:
+        """Return whether the ride at a position is available"""
+        return bool(self.available[idx // 8] >> (idx % 8) & 1)
+
+    @property
+    def available_mask(self) -> int:
+        """Availability bitmap as an integer, where bit i is set if ride i is available"""
+        return int.from_bytes(self.available, "little")
+
+    def any_available(self) -> bool:
+        """Return whether any ride of the batch is available"""
+        return any(self.available)
+
+    def row(self, idx: int) -> RideRow:
+        """Return the fields of the ride at a position, without building its record"""
+        return (
+            self.strings[self.origins[idx]],
+            self.strings[self.destinations[idx]],
+            self.departures[idx],
+            self.arrivals[idx],
+            self.durations[idx],
+            self.prices[idx],
+            self.is_available(idx),
+            self.strings[self.train_types[idx]],
+        )
+
+    def rows(self) -> Iterator[RideRow]:
+        """Yield the fields of every ride, without building their records"""
+        return (self.row(idx) for idx in range(len(self)))
+
+    def fields(self, indexes: Iterable[int]) -> List[Dict[str, object]]:
+        """Return the fields of the records of the rides at some positions, in the given order"""
+        strings, available = self.strings, self.available
+        origins, destinations, train_types = self.origins, self.destinations, self.train_types
+        departures, arrivals = self.departures, self.arrivals
+        durations, prices = self.durations, self.prices
+        return [
+            {
+                "origin": strings[origins[idx]],
+                "destination": strings[destinations[idx]],
+                "departure_time": EPOCH + MINUTE * departures[idx],
+                "arrival_time": EPOCH + MINUTE * arrivals[idx],
+                "duration": durations[idx],
+                "price": prices[idx],
+                "available": available[idx >> 3] >> (idx & 7) & 1 == 1,
+                "train_type": strings[train_types[idx]],
+            }
+            for idx in indexes
+        ]
+
+    def record(self, idx: int) -> TrainRideRecord:
+        """Build the record of the ride at a position"""
+        return self.records((idx,))[0]
+
+    def records(self, indexes: Iterable[int]) -> List[TrainRideRecord]:
+        """Build the records of the rides at some positions, in the given order"""
+        return records_adapter.validate_python(self.fields(indexes), strict=True)
+
+    def __len__(self) -> int:
+        return len(self.departures)
+
+    def __iter__(self) -> Iterator[TrainRideRecord]:
+        return iter(self.records(range(len(self))))
+
+    @overload
+    def __getitem__(self, idx: int) -> TrainRideRecord: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> List[TrainRideRecord]: ...
+
+    def __getitem__(self, idx: int | slice) -> TrainRideRecord | List[TrainRideRecord]:
+        if isinstance(idx, slice):
+            return self.records(range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("TrainRideBatch index out of range")
+        return self.record(idx)
+
+    def __eq__(self, other: object) -> bool:
+        if other is self:
+            return True
+        if isinstance(other, TrainRideBatch):
+            return list(self.rows()) == list(other.rows())
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"<TrainRideBatch({len(self)} rides, {len(self.strings)} strings)>"
+
+
+def as_batch(rides: Sequence[TrainRideRecord]) -> TrainRideBatch:
+    """Return the rides as a batch, converting them only if they are not one already"""
+    return rides if isinstance(rides, TrainRideBatch) else TrainRideBatch.from_records(rides)
@@ -1,23 +1,36 @@
 """This module contains the main logic of the bot. The search process is a finite state machine."""
 
 import asyncio
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
 
-from pydantic import BaseModel
 from telebot import async_telebot, asyncio_filters
-from telebot.asyncio_storage import StateMemoryStorage
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.asyncio_storage import StateStorageBase
 from telebot.states import State, StatesGroup
 from telebot.states.asyncio.context import StateContext
 from telebot.states.asyncio.middleware import StateMiddleware
-from telebot.types import Message
+from telebot.types import (InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
+                           Message)
 
+from cache import CACHE_FILE, TrainRidesCache
 from config import get_bot_token
-from errors import InvalidDWRToken, InvalidTrainRideFilter
-from messages import user_messages as msg, get_tickets_message
-from models import TrainRideFilter, StationRecord
-from scraper import Scraper
-from validators import validate_station, validate_date, validate_float
+from digest import ChatDigests
+from errors import InvalidDWRToken, InvalidTrainRideFilter, RenfeBotException
+from executor import WorkerPool
+from jobs import JOB_WORKERS, JOBS_FILE, JobQueue, RemoteWatchRegistry
+from messages import user_messages as msg
+from journal import WATCHES_FILE, StoredWatch, WatchJournal
+from models import SearchContext, TrainRideFilter, TrainRideRecord
+from outbox import PRIORITY_ALERT, Outbox
+from states import STATES_FILE, SQLiteStateStorage
+from storage import StationsStorage
+from validators import validate_station, validate_date, validate_float, validate_time_window
+from watches import UserSearches, Watch, WatchRegistry
+from webhook import WEBHOOK_URL, WebhookServer
+from worker import run_worker
 
 
 class SearchStates(StatesGroup):
@@ -30,251 +43,482 @@ class SearchStates(StatesGroup):
     needs_filter = State()
     max_price = State()
     max_duration_minutes = State()
+    departure_hours = State()
+    return_hours = State()
     searching = State()
 
 
-class SearchContext(BaseModel):
-    """SearchContext is a class that holds the context of the search process."""
-    user_id: int
-    origin: StationRecord | None = None
-    destination: StationRecord | None = None
-    departure_date: datetime | None = None
-    return_date: datetime | None = None
-    max_price: float | None = None
-    max_duration_minutes: float | None = None
-
-
-TOKEN = get_bot_token()
-state_storage = StateMemoryStorage()  # TODO: Don't use this in production, (idk why, but use redis)
-bot = async_telebot.AsyncTeleBot(TOKEN, state_storage=state_storage)
-print("Ya estoy corriendo! Corre a Telegram e interactúa conmigo con los comandos /start o /help")
-
-
-@bot.message_handler(commands=["start"])
-async def send_welcome(message: Message, state: StateContext):
-    """Sends a welcome message to the user who initiated the conversation."""
-    assert message.from_user is not None
-    username = message.from_user.first_name
-    await bot.send_message(message.chat.id, msg["welcome"].format(username))
-
-
-@bot.message_handler(commands=["ayuda"])
-async def send_help(message: Message):
-    """Sends a help message to the user who requested it."""
-    await bot.send_message(message.chat.id, msg["help"])
-
-@bot.message_handler(commands=["cancelar"], state=SearchStates.searching)
-async def send_cancel(message: Message, state: StateContext):
-    """Cancels the ongoing search and resets the state."""
-    await bot.send_message(message.chat.id, msg["cancel"])
-    # TODO: cancel the search process
-    await state.delete()
-
-
-@bot.message_handler(commands=["cancelar"])
-async def send_cancel_no_search(message: Message, state: StateContext):
-    """Cancels the parameter inputs and resets the state."""
-    await bot.send_message(message.chat.id, msg["cancel_params"])
-    await state.delete()
-
-
-@bot.message_handler(commands=["buscar"], state=SearchStates.searching)
-async def start_search_unavailable(message: Message, state: StateContext):
-    """Starts the search process by asking the user for the origin station."""
-    await bot.send_message(message.chat.id, msg["search_already_running"])
-
-
-@bot.message_handler(commands=["debug"])
-async def debug(message: Message, state: StateContext):
-    """Debug the current state and data."""
-    st = await state.get()
-    await bot.send_message(message.chat.id, st)
-
-
-@bot.message_handler(commands=["buscar"])
-async def start_search(message: Message, state: StateContext):
-    """Starts the search process by asking the user for the origin station."""
-    assert message.from_user is not None
-    await state.set(SearchStates.origin)
-    await bot.send_message(message.chat.id, msg["start"])
-
-
-@bot.message_handler(state=SearchStates.origin)
-async def origin_get(message: Message, state: StateContext):
-    """Gets the origin station from the user and asks for the destination station."""
-    origin = validate_station(message.text)
-
-    if not origin:
-        await bot.send_message(message.chat.id, origin.error_message)
-    else:
-        await state.set(SearchStates.destination)
-        await state.add_data(origin=origin.station)
-        await bot.send_message(message.chat.id, msg["destination"])
-
-
-@bot.message_handler(state=SearchStates.destination)
-async def destination_get(message: Message, state: StateContext):
-    """Gets the destination station from the user and asks for the departure date."""
-    destination = validate_station(message.text)
-
-    if not destination:
-        await bot.send_message(message.chat.id, destination.error_message)
-    else:
-        await state.set(SearchStates.departure_date)
-        await state.add_data(destination=destination.station)
-        await bot.send_message(message.chat.id, msg["destination_date"])
-
+# Seconds Telegram can reuse the completions of an inline query, as stations rarely change
+INLINE_CACHE_TIME = 3600
+# Seconds between the first polls of the searches resumed after a restart
+RESUME_STAGGER = 2.0
+
+
+@dataclass
+class BotApp:
+    """The bot created by :func:`create_bot`, with the searches that must be resumed when it
+    starts."""
+
+    bot: async_telebot.AsyncTeleBot
+    resume_searches: Callable[[], Awaitable[int]]
+
+    async def run(self, webhook_url: str = WEBHOOK_URL) -> None:
+        """Resume the stored searches and receive the updates until the bot is stopped, from the
+        webhook if there's a public URL for it, or polling Telegram otherwise
+
+        :param webhook_url: Public URL of the webhook, defaults to WEBHOOK_URL
+        :type webhook_url: str, optional
+        """
+        resumed = await self.resume_searches()
+        if resumed:
+            print(f"He retomado {resumed} búsquedas que estaban en curso")
+        if webhook_url:
+            print(f"Recibiendo las actualizaciones en {webhook_url}")
+            await WebhookServer(self.bot, webhook_url).serve_forever()
+        else:
+            # Telegram doesn't answer the polls while a webhook from a previous run is set
+            await self.bot.delete_webhook()
+            await self.bot.infinity_polling()
+
+
+def create_bot(token: str, state_storage: Optional[StateStorageBase] = None,
+               watch_registry: Optional[Union[WatchRegistry, RemoteWatchRegistry]] = None,
+               executor: Optional[WorkerPool] = None,
+               watch_journal: Optional[WatchJournal] = None) -> BotApp:
+    """Create the bot and register its handlers. Nothing is sent to Telegram until it's started
+    with :meth:`BotApp.run`.
+
+    :param token: The Telegram bot token
+    :type token: str
+    :param state_storage: Where the conversations are stored, defaults to None (a
+        SQLiteStateStorage at STATES_FILE)
+    :type state_storage: Optional[StateStorageBase], optional
+    :param watch_registry: The registry that polls the searches, or the one that sends them to
+        the worker processes, defaults to None (a new one with the cache at CACHE_FILE)
+    :type watch_registry: Optional[Union[WatchRegistry, RemoteWatchRegistry]], optional
+    :param executor: Pool for the CPU-bound work, the validation of the stations and dates and
+        the parsing of the responses, defaults to None (a new one configured by the environment)
+    :type executor: Optional[WorkerPool], optional
+    :param watch_journal: Where the searches running are stored to resume them, defaults to None
+        (a WatchJournal at WATCHES_FILE)
+    :type watch_journal: Optional[WatchJournal], optional
+    :return: The bot
+    :rtype: BotApp
+    """
+    if state_storage is None:
+        state_storage = SQLiteStateStorage(STATES_FILE)
+    if executor is None:
+        executor = WorkerPool()
+    if watch_registry is None:
+        watch_registry = WatchRegistry(cache=TrainRidesCache(path=CACHE_FILE), executor=executor)
+    if watch_journal is None:
+        watch_journal = WatchJournal(WATCHES_FILE)
+    searches = UserSearches()
+    bot = async_telebot.AsyncTeleBot(token, state_storage=state_storage)
+    outbox = Outbox(bot)
+    digests = ChatDigests(outbox)
+    # Messages about the resumed searches still being sent
+    notices: Set[asyncio.Task] = set()
+
+    @bot.message_handler(commands=["start"])
+    async def send_welcome(message: Message, state: StateContext):
+        """Sends a welcome message to the user who initiated the conversation."""
+        assert message.from_user is not None
+        username = message.from_user.first_name
+        await outbox.send(message.chat.id, msg["welcome"].format(username))
+
+    @bot.message_handler(commands=["ayuda"])
+    async def send_help(message: Message):
+        """Sends a help message to the user who requested it."""
+        await outbox.send(message.chat.id, msg["help"])
+
+    @bot.message_handler(commands=["cancelar"], state=SearchStates.searching)
+    async def send_cancel(message: Message, state: StateContext):
+        """Cancels the ongoing search and resets the state."""
+        assert message.from_user is not None
+        searches.cancel(message.from_user.id)
+        watch_journal.finish(message.from_user.id)
+        await outbox.send(message.chat.id, msg["cancel"])
+        await state.delete()
 
-@bot.message_handler(state=SearchStates.departure_date)
-async def departure_date_get(message: Message, state: StateContext):
-    """Gets the departure date from the user and asks if they need a return ticket."""
-    departure_datetime = validate_date(message.text)
+    @bot.message_handler(commands=["cancelar"])
+    async def send_cancel_no_search(message: Message, state: StateContext):
+        """Cancels the parameter inputs and resets the state."""
+        await outbox.send(message.chat.id, msg["cancel_params"])
+        await state.delete()
 
-    if not departure_datetime:
-        await bot.send_message(message.chat.id, departure_datetime.error_message)
-    else:
-        assert departure_datetime.date is not None
-        await bot.send_message(
-            message.chat.id,
-            msg["confirm_date"].format(departure_datetime.date.strftime("%d/%m/%Y %H:%M")),
-        )
-        await state.set(SearchStates.needs_return)
-        await state.add_data(departure_date=departure_datetime.date)
-        await bot.send_message(message.chat.id, msg["needs_return"])
-
-
-@bot.message_handler(state=SearchStates.needs_return)
-async def return_get(message: Message, state: StateContext):
-    """Gets the user's choice about needing a return ticket and asks for the date if he needs."""
-    if message.text is not None and message.text.lower() in ["si", "s", "y", "yes"]:
-        await state.set(SearchStates.return_date)
-        await bot.send_message(message.chat.id, msg["return_date"])
-    else:
-        await state.set(SearchStates.needs_filter)
-        await bot.send_message(message.chat.id, msg["needs_filter"])
-
-
-@bot.message_handler(state=SearchStates.return_date)
-async def return_date_get(message: Message, state: StateContext):
-    """Gets the return date from the user and asks if they want to filter the results."""
-    return_datetime = validate_date(message.text)
-
-    if not return_datetime:
-        await bot.send_message(message.chat.id, return_datetime.error_message)
-    else:
-        assert return_datetime.date is not None
-        await bot.send_message(
+    @bot.message_handler(commands=["buscar"], state=SearchStates.searching)
+    async def start_search_unavailable(message: Message, state: StateContext):
+        """Starts the search process by asking the user for the origin station."""
+        await outbox.send(message.chat.id, msg["search_already_running"])
+
+    @bot.message_handler(commands=["debug"])
+    async def debug(message: Message, state: StateContext):
+        """Debug the current state and data."""
+        assert message.from_user is not None
+        st = await state.get()
+        yours = "running" if message.from_user.id in searches else "not running"
+        await outbox.send(
             message.chat.id,
-            msg["confirm_date"].format(return_datetime.date.strftime("%d/%m/%Y %H:%M")),
+            f"{st}\n"
+            f"Searches: {len(searches)} running, yours is {yours}\n"
+            f"{watch_registry.describe()}\n"
+            f"{executor.describe()}\n"
+            f"{outbox.describe()}\n"
+            f"{digests.describe()}",
         )
-        await state.set(SearchStates.needs_filter)
-        await state.add_data(return_date=return_datetime.date)
-        await bot.send_message(message.chat.id, msg["needs_filter"])
-
-
-@bot.message_handler(state=SearchStates.needs_filter)
-async def ask_for_filter(message: Message, state: StateContext):
-    """Asks the user if they want to filter the results and starts the search process if not."""
-    if message.text is not None and message.text.lower() in ["si", "s", "y", "yes"]:
-        await state.set(SearchStates.max_price)
-        await bot.send_message(message.chat.id, msg["max_price"])
-    else:
-        await state.set(SearchStates.searching)
-        await bot.send_message(message.chat.id, msg["searching"])
-        async with state.data() as data: # type: ignore
-            await search_trains(message, state, data)
-
-
-@bot.message_handler(state=SearchStates.max_price)
-async def ask_for_max_price(message: Message, state: StateContext):
-    """Asks the user for the maximum price and starts the search process."""
-    parsed = validate_float(message.text)
-
-    if not parsed:
-        await bot.send_message(message.chat.id, parsed.error_message)
-    else:
-        await state.set(SearchStates.max_duration_minutes)
-        await state.add_data(max_price=None if parsed.number == 0 else parsed.number)
-        await bot.send_message(message.chat.id, msg["max_duration"])
-
 
-@bot.message_handler(state=SearchStates.max_duration_minutes)
-async def get_max_duration(message: Message, state: StateContext):
-    """Gets the maximum duration of the trip and starts the search process."""
-    parsed = validate_float(message.text)
-
-    if not parsed:
-        await bot.send_message(message.chat.id, parsed.error_message)
-    else:
+    @bot.inline_handler(func=lambda query: True)
+    async def complete_station(query: InlineQuery):
+        """Completes the station the user is typing in inline mode (@bot atocha), so choosing one
+        sends its exact name to the chat."""
+        results = [
+            InlineQueryResultArticle(
+                id=str(idx),
+                title=name,
+                input_message_content=InputTextMessageContent(name),
+            )
+            for idx, name in enumerate(StationsStorage.complete_station(query.query))
+        ]
+        await bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME)
+
+    @bot.message_handler(commands=["buscar"])
+    async def start_search(message: Message, state: StateContext):
+        """Starts the search process by asking the user for the origin station."""
+        assert message.from_user is not None
+        await state.set(SearchStates.origin)
+        await outbox.send(message.chat.id, msg["start"])
+
+    @bot.message_handler(state=SearchStates.origin)
+    async def origin_get(message: Message, state: StateContext):
+        """Gets the origin station from the user and asks for the destination station."""
+        origin = await executor.run(validate_station, message.text)
+
+        if not origin:
+            await outbox.send(message.chat.id, origin.error_message)
+        else:
+            await state.set(SearchStates.destination)
+            await state.add_data(origin=origin.station)
+            await outbox.send(message.chat.id, msg["destination"])
+
+    @bot.message_handler(state=SearchStates.destination)
+    async def destination_get(message: Message, state: StateContext):
+        """Gets the destination station from the user and asks for the departure date."""
+        destination = await executor.run(validate_station, message.text)
+
+        if not destination:
+            await outbox.send(message.chat.id, destination.error_message)
+        else:
+            await state.set(SearchStates.departure_date)
+            await state.add_data(destination=destination.station)
+            await outbox.send(message.chat.id, msg["destination_date"])
+
+    @bot.message_handler(state=SearchStates.departure_date)
+    async def departure_date_get(message: Message, state: StateContext):
+        """Gets the departure date from the user and asks if they need a return ticket."""
+        departure_datetime = await executor.run(validate_date, message.text)
+
+        if not departure_datetime:
+            await outbox.send(message.chat.id, departure_datetime.error_message)
+        else:
+            assert departure_datetime.date is not None
+            await outbox.send(
+                message.chat.id,
+                msg["confirm_date"].format(departure_datetime.date.strftime("%d/%m/%Y %H:%M")),
+            )
+            await state.set(SearchStates.needs_return)
+            await state.add_data(departure_date=departure_datetime.date)
+            await outbox.send(message.chat.id, msg["needs_return"])
+
+    @bot.message_handler(state=SearchStates.needs_return)
+    async def return_get(message: Message, state: StateContext):
+        """Gets the user's choice about needing a return ticket and asks for the date if he
+        needs."""
+        if message.text is not None and message.text.lower() in ["si", "s", "y", "yes"]:
+            await state.set(SearchStates.return_date)
+            await outbox.send(message.chat.id, msg["return_date"])
+        else:
+            await state.set(SearchStates.needs_filter)
+            await outbox.send(message.chat.id, msg["needs_filter"])
+
+    @bot.message_handler(state=SearchStates.return_date)
+    async def return_date_get(message: Message, state: StateContext):
+        """Gets the return date from the user and asks if they want to filter the results."""
+        return_datetime = await executor.run(validate_date, message.text)
+
+        if not return_datetime:
+            await outbox.send(message.chat.id, return_datetime.error_message)
+        else:
+            assert return_datetime.date is not None
+            await outbox.send(
+                message.chat.id,
+                msg["confirm_date"].format(return_datetime.date.strftime("%d/%m/%Y %H:%M")),
+            )
+            await state.set(SearchStates.needs_filter)
+            await state.add_data(return_date=return_datetime.date)
+            await outbox.send(message.chat.id, msg["needs_filter"])
+
+    @bot.message_handler(state=SearchStates.needs_filter)
+    async def ask_for_filter(message: Message, state: StateContext):
+        """Asks the user if they want to filter the results and starts the search process if not."""
+        if message.text is not None and message.text.lower() in ["si", "s", "y", "yes"]:
+            await state.set(SearchStates.max_price)
+            await outbox.send(message.chat.id, msg["max_price"])
+        else:
+            await start_searching(message, state)
+
+    @bot.message_handler(state=SearchStates.max_price)
+    async def ask_for_max_price(message: Message, state: StateContext):
+        """Asks the user for the maximum price and starts the search process."""
+        parsed = validate_float(message.text)
+
+        if not parsed:
+            await outbox.send(message.chat.id, parsed.error_message)
+        else:
+            await state.set(SearchStates.max_duration_minutes)
+            await state.add_data(max_price=None if parsed.number == 0 else parsed.number)
+            await outbox.send(message.chat.id, msg["max_duration"])
+
+    @bot.message_handler(state=SearchStates.max_duration_minutes)
+    async def get_max_duration(message: Message, state: StateContext):
+        """Gets the maximum duration of the trip and asks for the departure hours."""
+        parsed = validate_float(message.text)
+
+        if not parsed:
+            await outbox.send(message.chat.id, parsed.error_message)
+        else:
+            await state.set(SearchStates.departure_hours)
+            await state.add_data(max_duration=None if parsed.number == 0 else parsed.number)
+            await outbox.send(message.chat.id, msg["departure_hours"])
+
+    @bot.message_handler(state=SearchStates.departure_hours)
+    async def get_departure_hours(message: Message, state: StateContext):
+        """Gets the hours between which the user wants to leave, and asks for the ones to come
+        back if there's a return ticket or starts the search process otherwise."""
+        parsed = validate_time_window(message.text)
+
+        if not parsed:
+            await outbox.send(message.chat.id, parsed.error_message)
+            return
+        if parsed.window is not None:
+            await state.add_data(min_departure_hour=parsed.window[0],
+                                 max_departure_hour=parsed.window[1])
+        async with state.data() as data: # type: ignore
+            needs_return = data.get("return_date") is not None
+        if needs_return:
+            await state.set(SearchStates.return_hours)
+            await outbox.send(message.chat.id, msg["return_hours"])
+        else:
+            await start_searching(message, state)
+
+    @bot.message_handler(state=SearchStates.return_hours)
+    async def get_return_hours(message: Message, state: StateContext):
+        """Gets the hours between which the user wants to come back and starts the search
+        process."""
+        parsed = validate_time_window(message.text)
+
+        if not parsed:
+            await outbox.send(message.chat.id, parsed.error_message)
+            return
+        if parsed.window is not None:
+            await state.add_data(min_return_hour=parsed.window[0], max_return_hour=parsed.window[1])
+        await start_searching(message, state)
+
+    async def start_searching(message: Message, state: StateContext):
+        """Tells the user the search is starting and starts it with their answers"""
         await state.set(SearchStates.searching)
-        await state.add_data(max_duration=None if parsed.number == 0 else parsed.number)
-        await bot.send_message(message.chat.id, msg["searching"])
+        await outbox.send(message.chat.id, msg["searching"])
         async with state.data() as data: # type: ignore
             await search_trains(message, state, data)
 
 
-async def search_trains(message: Message, state: StateContext, ctx: Dict[str, Any]):
-    departure_done = False
-    return_done = ctx.get("return_date", None) is None
-
-    scraper = Scraper(ctx["origin"],
-                      ctx["destination"],
-                      ctx["departure_date"],
-                      ctx.get("return_date"))
-
-    departure_filter = TrainRideFilter(origin=ctx["origin"].name,
-                                       destination=ctx["destination"].name,
-                                       departure_date=ctx["departure_date"],
-                                       min_departure_hour=ctx.get("min_departure_hour"),
-                                       max_departure_hour=ctx.get("max_departure_hour"),
-                                       max_duration_minutes=ctx.get("max_duration_minutes"),
-                                       max_price=ctx.get("max_price"))
-
-    if not return_done:
-        return_filter = TrainRideFilter(origin=ctx["destination"].name,
-                                        destination=ctx["origin"].name,
-                                        departure_date=ctx["return_date"],
-                                        min_departure_hour=ctx.get("min_return_hour"),
-                                        max_departure_hour=ctx.get("max_return_hour"),
-                                        max_duration_minutes=ctx.get("max_duration_minutes"),
-                                        max_price=ctx.get("max_price"))
-
+    async def search_trains(message: Message, state: StateContext, ctx: Dict[str, Any]):
+        """Starts the search with the answers of the user, storing it in the journal"""
+        assert message.from_user is not None
+        context = SearchContext(user_id=message.from_user.id,
+                                origin=ctx["origin"],
+                                destination=ctx["destination"],
+                                departure_date=ctx["departure_date"],
+                                return_date=ctx.get("return_date"),
+                                max_price=ctx.get("max_price"),
+                                max_duration_minutes=ctx.get("max_duration_minutes"))
+        filters = [TrainRideFilter(origin=ctx["origin"].name,
+                                   destination=ctx["destination"].name,
+                                   departure_date=ctx["departure_date"],
+                                   min_departure_hour=ctx.get("min_departure_hour"),
+                                   max_departure_hour=ctx.get("max_departure_hour"),
+                                   max_duration_minutes=ctx.get("max_duration_minutes"),
+                                   max_price=ctx.get("max_price"))]
+
+        if ctx.get("return_date", None) is not None:
+            filters.append(TrainRideFilter(origin=ctx["destination"].name,
+                                           destination=ctx["origin"].name,
+                                           departure_date=ctx["return_date"],
+                                           min_departure_hour=ctx.get("min_return_hour"),
+                                           max_departure_hour=ctx.get("max_return_hour"),
+                                           max_duration_minutes=ctx.get("max_duration_minutes"),
+                                           max_price=ctx.get("max_price")))
+
+        stored = StoredWatch(user_id=message.from_user.id, chat_id=message.chat.id,
+                             context=context, filters=filters)
+        watch_journal.start(stored)
+        searches.start(stored.user_id, run_search(stored))
+
+    async def run_search(stored: StoredWatch, delay: float = 0.0):
+        """Polls Renfe until the pending filters of the search find train rides, sending them to
+        the user. The search is removed from the journal when it finishes, but not when it's
+        cancelled, as the bot stopping cancels it too."""
+        context = stored.context
+        assert context.origin is not None and context.destination is not None
+        assert context.departure_date is not None
+        departure_filter = stored.filters[0]
+        return_hours = stored.filters[1].departure_hours if len(stored.filters) > 1 else None
+
+        async def send_tickets(ride_filter: TrainRideFilter, trains: List[TrainRideRecord]):
+            if ride_filter is departure_filter:
+                origin, destination = context.origin, context.destination
+            else:
+                origin, destination = context.destination, context.origin
+            assert origin is not None and destination is not None
+            filter_idx = stored.filters.index(ride_filter)
+            # Sent with the rest of train rides found for the chat, and stored once it's sent
+            digests.add(stored.chat_id, trains, origin, destination,
+                        on_sent=lambda: watch_journal.found(stored.user_id, filter_idx))
+
+        try:
+            await watch_registry.watch(Watch(stored.pending_filters, send_tickets,
+                                             on_poll=lambda: watch_journal.polled(stored.user_id)),
+                                       context.origin,
+                                       context.destination,
+                                       context.departure_date,
+                                       context.return_date,
+                                       departure_filter.departure_hours,
+                                       return_hours,
+                                       delay=delay)
+            error_message = None
+
+        except InvalidTrainRideFilter:
+            error_message = msg["invalid_filter"]
+
+        except InvalidDWRToken:
+            error_message = msg["invalid_dwr_token"]
+
+        except Exception as e:
+            error_message = msg["undefined_exception"].format(str(e))
+
+        watch_journal.finish(stored.user_id)
+        await bot.delete_state(stored.user_id, stored.chat_id)
+        if error_message is not None:
+            # The train rides found before the error go first
+            await digests.flush(stored.chat_id)
+            await outbox.send(stored.chat_id, error_message, priority=PRIORITY_ALERT)
+
+    async def send_search_notice(stored: StoredWatch, message_key: str) -> None:
+        """Tell a user that their search was resumed or dropped after a restart. If the user
+        blocked the bot, the search is dropped, as nobody would get the train rides found."""
+        assert stored.context.origin is not None and stored.context.destination is not None
+        text = msg[message_key].format(stored.context.origin.name.capitalize(),
+                                       stored.context.destination.name.capitalize())
+        try:
+            await outbox.send(stored.chat_id, text, priority=PRIORITY_ALERT)
+        except ApiTelegramException as e:
+            print(f"Error avisando al chat {stored.chat_id} de su búsqueda: {e!r}")
+            if e.error_code == 403:
+                searches.cancel(stored.user_id)
+                watch_journal.finish(stored.user_id)
+                await bot.delete_state(stored.user_id, stored.chat_id)
+        except (RenfeBotException, Exception) as e:
+            print(f"Error avisando al chat {stored.chat_id} de su búsqueda: {e!r}")
+
+    def notify_search(stored: StoredWatch, message_key: str) -> None:
+        """Send a notice of :func:`send_search_notice` without waiting for it"""
+        task = asyncio.create_task(send_search_notice(stored, message_key))
+        notices.add(task)
+        task.add_done_callback(notices.discard)
+
+    async def resume_searches() -> int:
+        """Resumes the searches stored in the journal, the ones leaving sooner first, spreading
+        their first polls RESUME_STAGGER seconds apart. Searches whose trains already left are
+        dropped, telling their users, and the ones that had already finished are just removed.
+        The users are told in the background, so the bot doesn't wait for the messages to start.
+
+        :return: The number of searches resumed
+        :rtype: int
+        """
+        today = datetime.now().date()
+        resumed = []
+        for stored in watch_journal.load():
+            pending = stored.pending_filters
+            if pending and any(f.departure_date.date() >= today for f in pending):
+                resumed.append(stored)
+                continue
+
+            try:
+                # The conversation is stored too, the user would be stuck in the searching state
+                watch_journal.finish(stored.user_id)
+                await bot.delete_state(stored.user_id, stored.chat_id)
+                if pending:
+                    notify_search(stored, "search_expired")
+            except (RenfeBotException, Exception) as e:
+                print(f"Error quitando la búsqueda de {stored.user_id}: {e!r}")
+
+        resumed.sort(key=lambda stored: min(f.departure_date for f in stored.pending_filters))
+        for idx, stored in enumerate(resumed):
+            try:
+                searches.start(stored.user_id, run_search(stored, delay=idx * RESUME_STAGGER))
+                notify_search(stored, "search_resumed")
+            except (RenfeBotException, Exception) as e:
+                print(f"Error retomando la búsqueda de {stored.user_id}: {e!r}")
+        return len(resumed)
+
+    bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+    bot.setup_middleware(StateMiddleware(bot))
+    return BotApp(bot=bot, resume_searches=resume_searches)
+
+
+def start_workers(workers: int) -> List[multiprocessing.Process]:
+    """Start the processes that poll Renfe for the searches, stopped with the bot
+
+    :param workers: Number of processes
+    :type workers: int
+    :return: The processes
+    :rtype: List[multiprocessing.Process]
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for idx in range(workers):
+        process = context.Process(target=run_worker, args=(idx, workers, JOBS_FILE),
+                                  name=f"renfe-bot-worker-{idx}", daemon=True)
+        process.start()
+        processes.append(process)
+    print(f"He arrancado {workers} procesos para buscar los billetes")
+    return processes
+
+
+def main() -> None:
+    """Create the bot with the token from the config and poll Telegram until it's stopped"""
+    state_storage = SQLiteStateStorage(STATES_FILE)
+    watch_journal = WatchJournal(WATCHES_FILE)
+    watch_registry = None
+    job_queue = None
+    if JOB_WORKERS > 0:
+        # The searches are resumed from the journal, the jobs of the last run are stale
+        job_queue = JobQueue(JOBS_FILE)
+        job_queue.clear()
+        watch_registry = RemoteWatchRegistry(job_queue, JOB_WORKERS)
+        start_workers(JOB_WORKERS)
+    app = create_bot(get_bot_token(), state_storage=state_storage, watch_registry=watch_registry,
+                     watch_journal=watch_journal)
+    print("Ya estoy corriendo! Corre a Telegram e interactúa conmigo con los comandos /start o "
+          "/help")
     try:
-        while not departure_done or not return_done:
-            trains = scraper.get_trainrides()
-            if not departure_done:
-                departure_trains = departure_filter.filter_rides(trains)
-                departure_done = len(departure_trains) > 0
-                if departure_done:
-                    await bot.send_message(message.chat.id,
-                                           get_tickets_message(departure_trains,
-                                                               ctx["origin"],
-                                                               ctx["destination"]))
-            if not return_done:
-                return_trains = return_filter.filter_rides(trains)
-                return_done = len(return_trains) > 0
-                if return_done:
-                    await bot.send_message(message.chat.id,
-                                           get_tickets_message(return_trains,
-                                                               ctx["destination"],
-                                                               ctx["origin"]))
-            if not return_done or not departure_done:
-                await asyncio.sleep(60)
-        await state.delete()
-
-    except InvalidTrainRideFilter:
-        await state.delete()
-        await bot.send_message(message.chat.id, msg["invalid_filter"])
-
-    except InvalidDWRToken:
-        await state.delete()
-        await bot.send_message(message.chat.id, msg["invalid_dwr_token"])
-
-    except Exception as e:
-        await state.delete()
-        await bot.send_message(message.chat.id, msg["undefined_exception"].format(str(e)))
+        asyncio.run(app.run())
+    finally:
+        watch_journal.close()
+        state_storage.close()
+        if job_queue is not None:
+            job_queue.close()
 
-bot.add_custom_filter(asyncio_filters.StateFilter(bot))
-bot.setup_middleware(StateMiddleware(bot))
 
-asyncio.run(bot.infinity_polling())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""This module contains the cache of train lists, so searches for the same route and dates done
+shortly after another one reuse its results instead of calling Renfe again. Results can also be
+stored in a SQLite file, shared by the bot, the CLI and the worker processes and kept between
+restarts. The file is only an optimization, if it can't be read or written the search just calls
+Renfe. The writes are done by a thread, so waiting for another process to release the file never
+blocks the event loop."""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+import json
+from pathlib import Path
+import sqlite3
+import time
+from typing import Optional, Sequence, Tuple
+
+from batch import TrainRideBatch, as_batch
+from models import StationRecord, TimeWindow, TrainRideRecord, format_time_window
+
+CACHE_FILE = Path("cache.db")
+CACHE_TTL = 30
+CACHE_MAX_SIZE = 256
+# Seconds a process waits for the others to release the SQLite file
+CACHE_DB_TIMEOUT = 30.0
+
+
+@dataclass
+class CacheStats:
+    """Counters of the cache lookups
+
+    :param hits: Lookups answered by the cache, from memory or disk
+    :type hits: int
+    :param disk_hits: Hits that were only found in the SQLite file
+    :type disk_hits: int
+    :param misses: Lookups not found or expired
+    :type misses: int
+    :param evictions: Entries removed from memory to keep its size limit
+    :type evictions: int
+    :param disk_errors: Reads or writes of the SQLite file that failed, e.g. because another
+        process kept it locked for too long
+    :type disk_errors: int
+    :param disk_writes: Train lists written to the SQLite file, not counting the ones that were
+        the same as the list already stored and only got a new expiration
+    :type disk_writes: int
+    """
+
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_errors: int = 0
+    disk_writes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of the lookups answered by the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def cache_key(
+    origin: StationRecord,
+    destination: StationRecord,
+    departure_date: datetime,
+    return_date: Optional[datetime] = None,
+    adults: int = 1,
+    children: int = 0,
+    departure_hours: Optional[TimeWindow] = None,
+    return_hours: Optional[TimeWindow] = None,
+) -> str:
+    """Create the cache key of a search. Only the dates are used, as Renfe returns all the trains
+    of the day anyway, unless a time window is given.
+
+    :return: The cache key
+    :rtype: str
+    """
+    date_format = "%Y-%m-%d"
+    return "|".join([
+        origin.code,
+        destination.code,
+        departure_date.strftime(date_format),
+        "" if return_date is None else return_date.strftime(date_format),
+        str(adults),
+        str(children),
+        format_time_window(departure_hours),
+        format_time_window(return_hours),
+    ])
+
+
+class TrainRidesCache:
+    """LRU cache of train lists whose entries expire after a TTL.
+
+    :param ttl: Seconds a train list is considered fresh, defaults to CACHE_TTL
+    :type ttl: float, optional
+    :param max_size: Maximum number of train lists kept in memory, defaults to CACHE_MAX_SIZE
+    :type max_size: int, optional
+    :param path: SQLite file where the train lists are also stored, defaults to None (memory only)
+    :type path: Optional[Path], optional
+    :param prune: Remove the expired train lists from the file on start, only one of the processes
+        sharing the file needs to, defaults to True
+    :type prune: bool, optional
+    """
+
+    def __init__(
+        self,
+        ttl: float = CACHE_TTL,
+        max_size: int = CACHE_MAX_SIZE,
+        path: Optional[Path] = None,
+        prune: bool = True,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self.entries: OrderedDict[str, Tuple[float, TrainRideBatch]] = OrderedDict()
+
+        self.path = path
+        self.db_timeout = CACHE_DB_TIMEOUT
+        self.db: Optional[sqlite3.Connection] = None
+        self._write_db: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=self.db_timeout, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS train_ride_batches "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, rides TEXT NOT NULL)"
+            )
+            self.db.commit()
+            if prune:
+                try:
+                    with self.db:
+                        self.db.execute("DELETE FROM train_ride_batches WHERE expires_at <= ?",
+                                        (time.time(),))
+                except sqlite3.OperationalError:
+                    self.stats.disk_errors += 1
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+    def get(self, key: str) -> Optional[TrainRideBatch]:
+        """Return the train list stored for a key, if it's still fresh. The batch is shared with
+        the other lookups of the key, so it must not be modified.
+
+        :param key: The search key, see :func:`cache_key`
+        :type key: str
+        :return: The train list, or None if it's not cached or it expired
+        :rtype: Optional[TrainRideBatch]
+        """
+        now = time.time()
+        if (entry := self.entries.get(key)) is not None:
+            expires_at, rides = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.stats.hits += 1
+                return rides
+            del self.entries[key]
+
+        if self.db is not None:
+            try:
+                row = self.db.execute(
+                    "SELECT expires_at, rides FROM train_ride_batches "
+                    "WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Another process has the file locked, calling Renfe is better than waiting
+                self.stats.disk_errors += 1
+                row = None
+            if row is not None:
+                rides = TrainRideBatch.from_rows(json.loads(row[1]))
+                self._store(key, row[0], rides)
+                self.stats.hits += 1
+                self.stats.disk_hits += 1
+                return rides
+
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, rides: Sequence[TrainRideRecord]) -> None:
+        """Store the train list of a key. It's written to the SQLite file in the background, see
+        :meth:`flush`
+
+        :param key: The search key, see :func:`cache_key`
+        :type key: str
+        :param rides: The train list, converted to a batch if it's not one
+        :type rides: Sequence[TrainRideRecord]
+        """
+        expires_at = time.time() + self.ttl
+        batch = as_batch(rides)
+        # The scrapers return the same batch when the train list didn't change
+        entry = self.entries.get(key)
+        unchanged = entry is not None and entry[1] is batch
+        self._store(key, expires_at, batch)
+
+        if self._writer is not None:
+            self._writer.submit(self._write, key, expires_at, batch, unchanged)
+
+    def flush(self) -> None:
+        """Wait until the train lists stored are written to the SQLite file"""
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+
+    def clear(self) -> None:
+        """Remove every entry, from memory and disk"""
+        self.entries.clear()
+        self.flush()
+        if self.db is not None:
+            self.db.execute("DELETE FROM train_ride_batches")
+            self.db.commit()
+
+    def close(self) -> None:
+        """Close the SQLite file, if any, once the pending writes are done"""
+        if self._writer is not None:
+            self._writer.shutdown()
+            self._writer = None
+        if self._write_db is not None:
+            self._write_db.close()
+            self._write_db = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _write(self, key: str, expires_at: float, rides: TrainRideBatch, unchanged: bool) -> None:
+        """Write a train list to the SQLite file, or only its expiration if it's unchanged and
+        still there. It runs in the writer thread, with its own connection."""
+        assert self.path is not None
+        try:
+            if self._write_db is None:
+                self._write_db = sqlite3.connect(self.path, timeout=self.db_timeout,
+                                                 check_same_thread=False)
+            with self._write_db:
+                if unchanged and self._write_db.execute(
+                    "UPDATE train_ride_batches SET expires_at = ? WHERE key = ?",
+                    (expires_at, key),
+                ).rowcount:
+                    return
+                self._write_db.execute(
+                    "INSERT OR REPLACE INTO train_ride_batches (key, expires_at, rides) "
+                    "VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(list(rides.rows()))),
+                )
+            self.stats.disk_writes += 1
+        except sqlite3.Error:
+            self.stats.disk_errors += 1
+
+    def _store(self, key: str, expires_at: float, rides: TrainRideBatch) -> None:
+        """Store an entry in memory, evicting the least recently used ones over the size limit"""
+        self.entries[key] = (expires_at, rides)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
@@ -1,24 +1,32 @@
-"""This module contains the logic to find trains from the CLI."""
+"""This module contains the logic to find trains from the CLI.
 
-import argparse
-
-from rich.box import HEAVY
-from rich.console import Console
-from rich.table import Table
+Only argparse is imported at the top, the scraper, the validators and rich are imported once the
+arguments are parsed, so `--help` or a wrong argument don't pay for them. Keep it that way, the
+CLI is meant to be called from scripts in loops (tests/test_cli.py checks it).
+"""
 
-from scraper import Scraper
-from validators import validate_station, validate_date
+import argparse
+from typing import List, Optional
 
 
-def main(origin: str, destination: str, departure_date: str):
+def main(origin: str, destination: str, departure_date: str, no_cache: bool = False):
     """Searches for available train rides between the specified origin and destination stations
     on the given departure date, and displays the results in a formatted table.
 
     The function validates the input parameters, scrapes train ride data, and prints a table
     with train type, departure and arrival times, duration, and price. If no trains are found,
-    a message is displayed.
+    a message is displayed. Results fetched recently by the CLI or the bot are reused from the
+    cache, unless no_cache is set.
     """
 
+    from rich.box import HEAVY
+    from rich.console import Console
+    from rich.table import Table
+
+    from cache import CACHE_FILE, TrainRidesCache
+    from scraper import Scraper
+    from validators import validate_station, validate_date
+
     print("\n")  # Padding line
 
     console = Console()
@@ -34,9 +42,12 @@ def main(origin: str, destination: str, departure_date: str):
             console.print(f"[i][red]{validations.error_message}[/i]")
             return
 
-    scraper = Scraper(ctx["origin"].station, ctx["destination"].station, ctx["departure_date"].date)
+    cache = TrainRidesCache(path=CACHE_FILE)
+    scraper = Scraper(ctx["origin"].station, ctx["destination"].station, ctx["departure_date"].date,
+                      cache=cache)
 
-    trains = scraper.get_trainrides()
+    trains = scraper.get_trainrides(bypass_cache=no_cache)
+    cache.close()
 
     if not trains:
         console.print("[i][red]No trains found for the given filter[/i]")
@@ -75,7 +86,14 @@ def main(origin: str, destination: str, departure_date: str):
     console.print(table)
 
 
-if __name__ == "__main__":
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse the CLI arguments
+
+    :param argv: The arguments, defaults to None (sys.argv)
+    :type argv: Optional[List[str]], optional
+    :return: The parsed arguments
+    :rtype: argparse.Namespace
+    """
     parser = argparse.ArgumentParser(prog="renfe-bot", description="Find trains from the CLI")
 
     parser.add_argument(
@@ -87,6 +105,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--departure_date", required=True, help="Departure date in DD/MM/YYYY format (required)"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Always ask Renfe, ignoring recent results"
+    )
+    return parser.parse_args(argv)
+
 
-    main(args.origin, args.destination, args.departure_date)
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.origin, args.destination, args.departure_date, args.no_cache)
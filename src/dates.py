@@ -0,0 +1,112 @@
+"""This module contains the parser of the dates written by the users. The formats they usually
+type are parsed by hand, and only the rest go through dateparser, which is much slower and only
+imported the first time it's needed."""
+
+from datetime import datetime, timedelta
+import re
+from typing import Optional
+import unicodedata
+
+# Day, optionally followed by a time: "mañana", "viernes 18:30", "21/06/2025 a las 8"
+DATE_PATTERN = re.compile(
+    r"^(?P<day>.+?)(?:\s+(?:a\s+las?\s+|at\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*h?)?$"
+)
+NUMERIC_DAY_PATTERN = re.compile(r"^(?P<day>\d{1,2})[/.-](?P<month>\d{1,2})[/.-](?P<year>\d{4})$")
+
+RELATIVE_DAYS = {
+    "hoy": 0,
+    "today": 0,
+    "manana": 1,
+    "tomorrow": 1,
+    "pasado manana": 2,
+    "day after tomorrow": 2,
+}
+WEEKDAYS = {
+    name: weekday
+    for weekday, names in enumerate([
+        ("lunes", "monday"),
+        ("martes", "tuesday"),
+        ("miercoles", "wednesday"),
+        ("jueves", "thursday"),
+        ("viernes", "friday"),
+        ("sabado", "saturday"),
+        ("domingo", "sunday"),
+    ])
+    for name in names
+}
+WEEKDAY_PREFIXES = ("el ", "next ", "on ")
+
+
+def normalize_date_text(text: str) -> str:
+    """Return the text in lowercase, without accents and with single spaces"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(without_accents.split())
+
+
+def fast_parse_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Parse the date formats most users type, without dateparser:
+
+    - DD/MM/YYYY, with "/", "-" or "." as separator
+    - hoy, mañana and pasado mañana, or today, tomorrow and day after tomorrow
+    - Spanish and English weekday names, which mean the next one after today
+
+    Any of them can be followed by a time (HH:MM, or just the hour), with or without "a las"
+    or "at" before it. "Hoy" without a time is now, the rest of the days start at midnight.
+
+    :param text: The date written by the user
+    :type text: str
+    :param now: The current date and time, defaults to None (datetime.now())
+    :type now: Optional[datetime], optional
+    :raises ValueError: If the format is known but the date or the time don't exist
+    :return: The date, or None if the format isn't one of the above
+    :rtype: Optional[datetime]
+    """
+    match = DATE_PATTERN.match(normalize_date_text(text))
+    if match is None:
+        return None
+
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_text = match["day"]
+    if (numeric_day := NUMERIC_DAY_PATTERN.match(day_text)) is not None:
+        day = datetime(int(numeric_day["year"]), int(numeric_day["month"]),
+                       int(numeric_day["day"]))
+    elif (days := RELATIVE_DAYS.get(day_text)) is not None:
+        day = today + timedelta(days=days)
+    else:
+        for prefix in WEEKDAY_PREFIXES:
+            day_text = day_text.removeprefix(prefix)
+        if (weekday := WEEKDAYS.get(day_text)) is None:
+            return None
+        day = today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+
+    if match["hour"] is None:
+        # Today means from now on, any other day from its start
+        return now if match["day"] in ("hoy", "today") else day
+    return day.replace(hour=int(match["hour"]), minute=int(match["minute"] or 0))
+
+
+def parse_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Parse a date written by the user, in Spanish or English. The usual formats are parsed by
+    :func:`fast_parse_date`, and the rest by dateparser.
+
+    :param text: The date written by the user
+    :type text: str
+    :param now: The current date and time, defaults to None (datetime.now())
+    :type now: Optional[datetime], optional
+    :return: The date, or None if it couldn't be parsed
+    :rtype: Optional[datetime]
+    """
+    try:
+        if (date := fast_parse_date(text, now)) is not None:
+            return date
+    except ValueError:
+        return None
+
+    import dateparser
+
+    settings = {"STRICT_PARSING": True}
+    if now is not None:
+        settings["RELATIVE_BASE"] = now
+    return dateparser.parse(text, languages=["es", "en"], settings=settings)
@@ -0,0 +1,116 @@
+"""This module contains the digests of the bot: the train rides found for the same chat in a short
+window, usually the same round of polls, are sent together in a single message (or as few as
+possible) instead of one message for each search."""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+
+from errors import RenfeBotException
+from messages import TicketsSection, get_digest_messages
+from models import StationRecord, TrainRideRecord
+from outbox import PRIORITY_ALERT, Outbox
+
+# Seconds the train rides found for a chat wait for more before being sent
+DIGEST_WINDOW = 1.0
+
+
+@dataclass
+class DigestStats:
+    """Counters of the digests sent
+
+    :param digests: Digests sent
+    :type digests: int
+    :param sections: Train rides found that went in the digests
+    :type sections: int
+    :param messages: Messages sent for the digests, more than one if a digest was too long
+    :type messages: int
+    """
+
+    digests: int = 0
+    sections: int = 0
+    messages: int = 0
+
+
+@dataclass(eq=False)
+class PendingDigest:
+    """The train rides found for a chat that were not sent yet"""
+
+    sections: List[TicketsSection] = field(default_factory=list)
+    callbacks: List[Callable[[], None]] = field(default_factory=list)
+
+
+class ChatDigests:
+    """Collects the train rides found for each chat and sends them together once the window is
+    over.
+
+    :param outbox: Where the digests are sent
+    :type outbox: Outbox
+    :param window: Seconds the train rides wait for more, defaults to DIGEST_WINDOW
+    :type window: float, optional
+    """
+
+    def __init__(self, outbox: Outbox, window: float = DIGEST_WINDOW):
+        self.outbox = outbox
+        self.window = window
+        self.stats = DigestStats()
+        self.pending: Dict[int, PendingDigest] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, chat_id: int, trains: List[TrainRideRecord], origin: StationRecord,
+            destination: StationRecord, on_sent: Optional[Callable[[], None]] = None) -> None:
+        """Add train rides to the next digest of a chat
+
+        :param chat_id: The chat
+        :type chat_id: int
+        :param trains: The train rides found
+        :type trains: List[TrainRideRecord]
+        :param origin: The station they leave from
+        :type origin: StationRecord
+        :param destination: The station they go to
+        :type destination: StationRecord
+        :param on_sent: Function called once the digest is sent, defaults to None
+        :type on_sent: Optional[Callable[[], None]], optional
+        """
+        digest = self.pending.get(chat_id)
+        if digest is None:
+            digest = self.pending[chat_id] = PendingDigest()
+            task = asyncio.create_task(self._flush_later(chat_id, digest))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        digest.sections.append((trains, origin, destination))
+        if on_sent is not None:
+            digest.callbacks.append(on_sent)
+
+    async def flush(self, chat_id: int) -> None:
+        """Send the digest of a chat now, if it has one
+
+        :raises ApiTelegramException: If Telegram rejected the digest
+        """
+        digest = self.pending.pop(chat_id, None)
+        if digest is None:
+            return
+
+        messages = get_digest_messages(digest.sections)
+        for text in messages:
+            await self.outbox.send(chat_id, text, priority=PRIORITY_ALERT)
+        self.stats.digests += 1
+        self.stats.sections += len(digest.sections)
+        self.stats.messages += len(messages)
+        for callback in digest.callbacks:
+            callback()
+
+    def describe(self) -> str:
+        """Return a line with the digests sent, for /debug"""
+        return (f"Digests: {len(self.pending)} pending, {self.stats.digests} sent with "
+                f"{self.stats.sections} results in {self.stats.messages} messages")
+
+    async def _flush_later(self, chat_id: int, digest: PendingDigest) -> None:
+        """Send a digest once the window is over, unless it was already sent"""
+        await asyncio.sleep(self.window)
+        if self.pending.get(chat_id) is not digest:
+            return
+        try:
+            await self.flush(chat_id)
+        except (RenfeBotException, Exception) as e:
+            print(f"Error enviando los billetes al chat {chat_id}: {e!r}")
@@ -13,6 +13,11 @@ class InvalidDWRToken(RenfeBotException):
     """Raise when the DWR token provided is invalid"""
     pass
 
+class SessionExpired(InvalidDWRToken):
+    """Raise when Renfe answers a DWR call with an exception instead of its callback, usually
+    because the DWR session is no longer valid"""
+    pass
+
 class InvalidTrainRideFilter(RenfeBotException):
     """Raise when the filter input by the user didn't return any result, available or not"""
     pass
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""This module contains the pool that runs the CPU-bound work of the bot (parsing the Renfe
+responses, the dates and the fuzzy station searches) out of the event loop, so a slow call doesn't
+delay the updates of other chats.
+
+The pool is configured with environment variables:
+
+- RENFE_BOT_EXECUTOR: "thread" (the default), "process", or "inline" to run the calls in the
+  event loop as before
+- RENFE_BOT_EXECUTOR_WORKERS: Threads or processes of the pool, defaults to min(4, CPUs)
+- RENFE_BOT_EXECUTOR_QUEUE: Calls that can wait for a free worker, the rest wait in the event loop
+  until there is room, defaults to 64
+"""
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+EXECUTOR_KINDS = ("thread", "process", "inline")
+EXECUTOR_KIND = os.environ.get("RENFE_BOT_EXECUTOR", "thread")
+EXECUTOR_WORKERS = int(os.environ.get("RENFE_BOT_EXECUTOR_WORKERS", min(4, os.cpu_count() or 1)))
+EXECUTOR_QUEUE_SIZE = int(os.environ.get("RENFE_BOT_EXECUTOR_QUEUE", 64))
+
+T = TypeVar("T")
+
+
+@dataclass
+class ExecutorStats:
+    """Counters of the calls that went through the pool
+
+    :param calls: Calls finished, successfully or not
+    :type calls: int
+    :param failed: Calls that raised an exception
+    :type failed: int
+    :param pending: Calls submitted to the pool and not finished yet, running or queued
+    :type pending: int
+    :param waiting: Calls waiting in the event loop because the queue of the pool is full
+    :type waiting: int
+    :param max_pending: Most calls pending at the same time
+    :type max_pending: int
+    :param total_time: Seconds from the submission to the result of all the calls
+    :type total_time: float
+    """
+
+    calls: int = 0
+    failed: int = 0
+    pending: int = 0
+    waiting: int = 0
+    max_pending: int = 0
+    total_time: float = 0.0
+
+    @property
+    def mean_time(self) -> float:
+        """Mean seconds per call, including the time queued"""
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class WorkerPool:
+    """Thread or process pool for the CPU-bound calls made from the event loop.
+
+    The pool is created on the first call. Threads are enough to keep the event loop responsive,
+    processes also run the calls in parallel, but the functions, their arguments and results must
+    be picklable, so they must be defined at module level.
+
+    :param kind: "thread", "process" or "inline", defaults to EXECUTOR_KIND
+    :type kind: str, optional
+    :param workers: Threads or processes of the pool, defaults to EXECUTOR_WORKERS
+    :type workers: int, optional
+    :param queue_size: Calls that can wait for a free worker, defaults to EXECUTOR_QUEUE_SIZE
+    :type queue_size: int, optional
+    :raises ValueError: If the kind is not one of EXECUTOR_KINDS
+    """
+
+    def __init__(self, kind: str = EXECUTOR_KIND, workers: int = EXECUTOR_WORKERS,
+                 queue_size: int = EXECUTOR_QUEUE_SIZE):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor kind {kind!r}, use one of {EXECUTOR_KINDS}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.stats = ExecutorStats()
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+    @property
+    def queued(self) -> int:
+        """Calls submitted to the pool that are waiting for a free worker"""
+        return max(0, self.stats.pending - self.workers)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run the function in the pool and wait for its result, without blocking the event loop
+
+        :param func: The function, defined at module level for the process pools
+        :type func: Callable[..., T]
+        :return: The result of the function
+        :rtype: T
+        """
+        if self.kind == "inline":
+            return self._run_inline(func, *args)
+
+        if self._slots.locked():
+            self.stats.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.stats.waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        start = time.perf_counter()
+        self.stats.pending += 1
+        self.stats.max_pending = max(self.stats.max_pending, self.stats.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func,
+                                                                    *args)
+        except (Exception, asyncio.CancelledError):
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.pending -= 1
+            self.stats.calls += 1
+            self.stats.total_time += time.perf_counter() - start
+            self._slots.release()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers. The pool is created again if it's used after this"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def describe(self) -> str:
+        """Return a line with the size of the pool and its queue, for the logs and /debug"""
+        return (f"{self.kind} pool: {self.workers} workers, {self.queued}/{self.queue_size} "
+                f"queued, {self.stats.waiting} waiting, {self.stats.calls} calls "
+                f"({self.stats.mean_time * 1000:.1f} ms mean)")
+
+    def _get_executor(self) -> Executor:
+        """Return the executor, creating it if needed"""
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="renfe-bot-cpu")
+        return self._executor
+
+    def _run_inline(self, func: Callable[..., T], *args: Any) -> T:
+        """Run the function in the event loop, counting it in the stats"""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.calls += 1
+            self.stats.total_time += time.perf_counter() - start
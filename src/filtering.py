@@ -0,0 +1,155 @@
+"""This module contains the index used to run many filters over the same list of train rides.
+
+Every ride is a bit of an integer, and the index keeps, for the rides sorted by departure time,
+price and duration, the masks of the rides up to (or from) each position. Running a filter is
+then a few binary searches and bitwise ANDs, no matter how many rides there are."""
+
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+import math
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from batch import as_batch, to_minutes
+from errors import InvalidTrainRideFilter
+from models import TrainRideFilter, TrainRideRecord
+
+MINUTES_PER_DAY = 24 * 60
+
+# The rides of a filter, or the error if it didn't return any result, available or not
+FilterResult = List[TrainRideRecord] | InvalidTrainRideFilter
+
+
+def prefix_masks(bits: Sequence[int]) -> List[int]:
+    """Return the masks of the first 0, 1, ..., n bits of the sequence"""
+    masks = [0]
+    for bit in bits:
+        masks.append(masks[-1] | bit)
+    return masks
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Yield the positions of the bits set in a mask, from the lowest one"""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+@dataclass
+class RideGroup:
+    """Rides with the same origin, destination and departure day, sorted by departure time."""
+
+    departures: List[int] = field(default_factory=list)
+    bits: List[int] = field(default_factory=list)
+    from_masks: List[int] = field(default_factory=list)
+    until_masks: List[int] = field(default_factory=list)
+
+
+class RideIndex:
+    """Index of a batch of train rides, to run many TrainRideFilters over it.
+
+    The results are the same, and in the same order, as the ones of
+    :meth:`TrainRideFilter.filter_rides`, with the times compared to the minute as they are
+    stored in the batch. Only the records of the rides returned are built.
+
+    :param rides: The train rides to index, converted to a batch if they are not one
+    :type rides: Sequence[TrainRideRecord]
+    """
+
+    def __init__(self, rides: Sequence[TrainRideRecord]):
+        self.rides = batch = as_batch(rides)
+        self.available_mask = batch.available_mask
+        self.groups: Dict[Tuple[int, int, int], RideGroup] = {}
+
+        departures = batch.departures
+        for idx in sorted(range(len(batch)), key=departures.__getitem__):
+            key = (batch.origins[idx], batch.destinations[idx], departures[idx] // MINUTES_PER_DAY)
+            group = self.groups.setdefault(key, RideGroup())
+            group.departures.append(departures[idx])
+            group.bits.append(1 << idx)
+
+        for group in self.groups.values():
+            group.until_masks = prefix_masks(group.bits)
+            group.from_masks = prefix_masks(group.bits[::-1])[::-1]
+
+        priced = sorted((price, idx) for idx, price in enumerate(batch.prices)
+                        if not math.isnan(price))
+        self.prices = [price for price, _ in priced]
+        self.price_masks = prefix_masks([1 << idx for _, idx in priced])
+        # Rides without price are never discarded by the price, as in TrainRideFilter
+        self.unpriced_mask = sum(1 << idx for idx, price in enumerate(batch.prices)
+                                 if math.isnan(price))
+
+        by_duration = sorted((duration, idx) for idx, duration in enumerate(batch.durations))
+        self.durations = [duration for duration, _ in by_duration]
+        self.duration_masks = prefix_masks([1 << idx for _, idx in by_duration])
+
+    def filter_rides(self, ride_filter: TrainRideFilter) -> List[TrainRideRecord]:
+        """Return the available rides that pass the filter
+
+        :param ride_filter: The filter
+        :type ride_filter: TrainRideFilter
+        :raises InvalidTrainRideFilter: If no ride passes the filter, available or not.
+        :return: The available rides, in the same order as the indexed list
+        :rtype: List[TrainRideRecord]
+        """
+        mask = self._match(ride_filter)
+        if not mask:
+            raise InvalidTrainRideFilter(
+                f"The filter {ride_filter} didn't return any result, available or not."
+            )
+        return self.rides.records(iter_bits(mask & self.available_mask))
+
+    def filter_many(self, filters: Sequence[TrainRideFilter]) -> List[FilterResult]:
+        """Run many filters, returning the exception instead of raising it for the filters that
+        didn't return any result
+
+        :param filters: The filters
+        :type filters: Sequence[TrainRideFilter]
+        :return: The result of each filter, in the same order
+        :rtype: List[FilterResult]
+        """
+        results: List[FilterResult] = []
+        for ride_filter in filters:
+            try:
+                results.append(self.filter_rides(ride_filter))
+            except InvalidTrainRideFilter as e:
+                results.append(e)
+        return results
+
+    def _match(self, ride_filter: TrainRideFilter) -> int:
+        """Return the mask of the rides that pass the filter, available or not"""
+        string_ids = self.rides.string_ids
+        origin = string_ids.get(ride_filter.origin)
+        destination = string_ids.get(ride_filter.destination)
+        start = to_minutes(ride_filter.departure_date)
+        day_start = start - start % MINUTES_PER_DAY
+        group = self.groups.get((origin, destination, day_start // MINUTES_PER_DAY))
+        if group is None:
+            return 0
+
+        # Rides are stored to the minute, so a departure date with seconds starts a minute later,
+        # which after 23:59 leaves no ride of the day (the group has only that day's rides)
+        if ride_filter.departure_date.second or ride_filter.departure_date.microsecond:
+            start += 1
+        if ride_filter.min_departure_hour is not None:
+            min_hour = ride_filter.min_departure_hour
+            start = max(start, day_start + min_hour.hour * 60 + min_hour.minute
+                        + bool(min_hour.second or min_hour.microsecond))
+        first = bisect_left(group.departures, start)
+        last = len(group.departures)
+        if ride_filter.max_departure_hour is not None:
+            max_hour = ride_filter.max_departure_hour
+            last = bisect_right(group.departures,
+                                day_start + max_hour.hour * 60 + max_hour.minute)
+        if first >= last:
+            return 0
+
+        mask = group.from_masks[first] & group.until_masks[last]
+        if ride_filter.max_duration_minutes:
+            mask &= self.duration_masks[bisect_right(self.durations,
+                                                     ride_filter.max_duration_minutes)]
+        if ride_filter.max_price:
+            mask &= (self.price_masks[bisect_right(self.prices, ride_filter.max_price)]
+                     | self.unpriced_mask)
+        return mask
@@ -0,0 +1,331 @@
+"""This module contains the queue used to split the bot in several processes: the front-end talks
+with Telegram and enqueues the searches as jobs in a SQLite file, and the workers (see worker.py)
+poll Renfe for them and post the results back.
+
+Each route is always assigned to the same worker, by a hash of the route, so the searches of the
+same route still share a single scraper and its cache.
+
+The number of workers is set with the RENFE_BOT_WORKERS environment variable, 0 (the default)
+polls Renfe in the bot process as before."""
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, time
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time as timer
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from errors import InvalidDWRToken, InvalidTrainRideFilter, RenfeBotException, SessionExpired
+from models import StationRecord, TimeWindow, TrainRideFilter, TrainRideRecord, format_time_window
+from watches import Watch, WatchKey
+
+JOBS_FILE = Path("jobs.db")
+JOB_WORKERS = int(os.environ.get("RENFE_BOT_WORKERS", 0))
+# Seconds between the reads of the queue, by the front-end and the workers
+JOBS_POLL_INTERVAL = 0.2
+
+# Errors raised by a job in a worker that are raised again in the front-end, the rest are raised
+# as a generic Exception with the same message
+JOB_ERRORS = {error.__name__: error
+              for error in (InvalidDWRToken, InvalidTrainRideFilter, SessionExpired)}
+
+
+def route_worker(key: WatchKey, workers: int) -> int:
+    """Return the worker that polls a route, the same one in every process and run
+
+    :param key: The route
+    :type key: WatchKey
+    :param workers: Number of workers
+    :type workers: int
+    :return: The worker index, from 0 to workers - 1
+    :rtype: int
+    """
+    route = "|".join([
+        key.origin,
+        key.destination,
+        key.departure_date.isoformat(),
+        "" if key.return_date is None else key.return_date.isoformat(),
+        format_time_window(key.departure_hours),
+        format_time_window(key.return_hours),
+    ])
+    digest = hashlib.blake2b(route.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % workers
+
+
+def _dump_window(window: Optional[TimeWindow]) -> Optional[List[str]]:
+    """Convert a time window to JSON"""
+    return None if window is None else [window[0].isoformat(), window[1].isoformat()]
+
+
+def _load_window(window: Optional[List[str]]) -> Optional[TimeWindow]:
+    """Convert a time window from JSON"""
+    return None if window is None else (time.fromisoformat(window[0]),
+                                        time.fromisoformat(window[1]))
+
+
+@dataclass
+class Job:
+    """A search to be polled by a worker, with the arguments of :meth:`WatchRegistry.watch`"""
+
+    filters: List[TrainRideFilter]
+    origin: StationRecord
+    destination: StationRecord
+    departure_date: datetime
+    return_date: Optional[datetime] = None
+    departure_hours: Optional[TimeWindow] = None
+    return_hours: Optional[TimeWindow] = None
+    delay: float = 0.0
+    id: Optional[int] = None
+
+    @property
+    def key(self) -> WatchKey:
+        """The route of the job"""
+        return WatchKey.create(self.origin, self.destination, self.departure_date,
+                               self.return_date, self.departure_hours, self.return_hours)
+
+    def dumps(self) -> str:
+        """Serialize the job to JSON, without its id"""
+        return json.dumps({
+            "filters": [ride_filter.model_dump(mode="json") for ride_filter in self.filters],
+            "origin": self.origin.model_dump(),
+            "destination": self.destination.model_dump(),
+            "departure_date": self.departure_date.isoformat(),
+            "return_date": None if self.return_date is None else self.return_date.isoformat(),
+            "departure_hours": _dump_window(self.departure_hours),
+            "return_hours": _dump_window(self.return_hours),
+            "delay": self.delay,
+        })
+
+    @classmethod
+    def loads(cls, job_id: int, text: str) -> "Job":
+        """Deserialize a job from JSON"""
+        data = json.loads(text)
+        return cls(
+            filters=[TrainRideFilter.model_validate(ride_filter)
+                     for ride_filter in data["filters"]],
+            origin=StationRecord.model_validate(data["origin"]),
+            destination=StationRecord.model_validate(data["destination"]),
+            departure_date=datetime.fromisoformat(data["departure_date"]),
+            return_date=(None if data["return_date"] is None
+                         else datetime.fromisoformat(data["return_date"])),
+            departure_hours=_load_window(data["departure_hours"]),
+            return_hours=_load_window(data["return_hours"]),
+            delay=data["delay"],
+            id=job_id,
+        )
+
+
+class JobQueue:
+    """Jobs and their results, in a SQLite file in WAL mode shared by the front-end and the
+    workers.
+
+    A job is pending until its worker claims it, and running until the front-end removes it, once
+    it got the result that finishes it, or until it's cancelled. Results are "poll", "rides" (a
+    filter found train rides), "done" and "error".
+
+    :param path: The SQLite file, defaults to JOBS_FILE
+    :type path: Union[Path, str], optional
+    """
+
+    def __init__(self, path: Union[Path, str] = JOBS_FILE):
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "worker INTEGER NOT NULL, status TEXT NOT NULL, job TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "job_id INTEGER NOT NULL, kind TEXT NOT NULL, result TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_worker ON jobs (worker, status)")
+
+    def submit(self, job: Job, worker: int) -> int:
+        """Enqueue a job for a worker
+
+        :return: The job id
+        :rtype: int
+        """
+        cursor = self.db.execute(
+            "INSERT INTO jobs (worker, status, job, created_at) VALUES (?, 'pending', ?, ?)",
+            (worker, job.dumps(), timer.time()),
+        )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def claim(self, worker: int) -> List[Job]:
+        """Take the pending jobs of a worker, marking them as running"""
+        with self._transaction():
+            rows = self.db.execute(
+                "SELECT id, job FROM jobs WHERE worker = ? AND status = 'pending' ORDER BY id",
+                (worker,),
+            ).fetchall()
+            self.db.executemany("UPDATE jobs SET status = 'running' WHERE id = ?",
+                                [(job_id,) for job_id, _ in rows])
+        return [Job.loads(job_id, text) for job_id, text in rows]
+
+    def release(self, worker: int) -> None:
+        """Make the running jobs of a worker pending again, for a worker starting or stopping"""
+        self.db.execute("UPDATE jobs SET status = 'pending' WHERE worker = ? AND "
+                        "status = 'running'", (worker,))
+
+    def cancel(self, job_id: int) -> None:
+        """Ask the worker of a job to stop it"""
+        self.db.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ?", (job_id,))
+
+    def cancelled(self, job_ids: Iterable[int]) -> Set[int]:
+        """Return the jobs that were cancelled or removed, of the ones given"""
+        job_ids = set(job_ids)
+        if not job_ids:
+            return set()
+        placeholders = ",".join("?" * len(job_ids))
+        alive = {job_id for (job_id,) in self.db.execute(
+            f"SELECT id FROM jobs WHERE id IN ({placeholders}) AND status != 'cancelled'",
+            list(job_ids),
+        )}
+        return job_ids - alive
+
+    def remove(self, job_id: int) -> None:
+        """Remove a job and its results"""
+        with self._transaction():
+            self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self.db.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+
+    def post(self, job_id: int, kind: str, result: Any = None) -> None:
+        """Post a result of a job to the front-end"""
+        self.db.execute("INSERT INTO results (job_id, kind, result) VALUES (?, ?, ?)",
+                        (job_id, kind, json.dumps(result)))
+
+    def take_results(self) -> List[Tuple[int, str, Any]]:
+        """Take the results posted by the workers, in order
+
+        :return: The job id, kind and content of every result
+        :rtype: List[Tuple[int, str, Any]]
+        """
+        with self._transaction():
+            rows = self.db.execute(
+                "SELECT id, job_id, kind, result FROM results ORDER BY id"
+            ).fetchall()
+            if rows:
+                self.db.execute("DELETE FROM results WHERE id <= ?", (rows[-1][0],))
+        return [(job_id, kind, json.loads(result)) for _, job_id, kind, result in rows]
+
+    def job_counts(self) -> Dict[str, int]:
+        """Return the number of jobs by status"""
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def clear(self) -> None:
+        """Remove every job and result, for a front-end starting, as it resumes its searches from
+        the journal"""
+        with self._transaction():
+            self.db.execute("DELETE FROM jobs")
+            self.db.execute("DELETE FROM results")
+
+    def close(self) -> None:
+        """Close the SQLite file"""
+        self.db.close()
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self.db)
+
+
+class _Transaction:
+    """Context manager of an immediate transaction, as the connection is in autocommit mode"""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self) -> None:
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+class RemoteWatchRegistry:
+    """Front-end side of the queue, with the same :meth:`watch` as a WatchRegistry, but the
+    routes are polled by the worker processes.
+
+    :param queue: The job queue
+    :type queue: JobQueue
+    :param workers: Number of workers
+    :type workers: int
+    :param poll_interval: Seconds between the reads of the results, defaults to
+        JOBS_POLL_INTERVAL
+    :type poll_interval: float, optional
+    """
+
+    def __init__(self, queue: JobQueue, workers: int,
+                 poll_interval: float = JOBS_POLL_INTERVAL):
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.watches: Dict[int, Watch] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    async def watch(
+        self,
+        watch: Watch,
+        origin: StationRecord,
+        destination: StationRecord,
+        departure_date: datetime,
+        return_date: Optional[datetime] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
+        delay: float = 0.0,
+    ) -> None:
+        """Enqueue the watch for the worker of its route and wait until all its filters have
+        found train rides. Cancelling it cancels the job.
+
+        :raises InvalidTrainRideFilter: If any filter didn't return any result, available or not.
+        :raises InvalidDWRToken: If the route could not be polled because of the DWR token.
+        """
+        job = Job(watch.filters, origin, destination, departure_date, return_date,
+                  departure_hours, return_hours, delay)
+        job_id = self.queue.submit(job, route_worker(job.key, self.workers))
+        self.watches[job_id] = watch
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_results())
+
+        try:
+            await watch.done
+        finally:
+            del self.watches[job_id]
+            if watch.done.done():
+                self.queue.remove(job_id)
+            else:
+                self.queue.cancel(job_id)
+
+    def describe(self) -> str:
+        """Return a line with the jobs of the workers, for /debug"""
+        jobs = ", ".join(f"{count} {status}" for status, count in self.queue.job_counts().items())
+        return f"Workers: {self.workers}, jobs: {jobs or 'none'}"
+
+    async def _read_results(self) -> None:
+        """Deliver the results posted by the workers to their watches while there are any"""
+        while self.watches:
+            for job_id, kind, result in self.queue.take_results():
+                watch = self.watches.get(job_id)
+                if watch is None or watch.done.done():
+                    continue
+
+                try:
+                    if kind == "poll" and watch.on_poll is not None:
+                        watch.on_poll()
+                    elif kind == "rides":
+                        rides = [TrainRideRecord.model_validate(ride) for ride in result["rides"]]
+                        await watch.on_rides(watch.filters[result["filter"]], rides)
+                    elif kind == "done":
+                        watch.done.set_result(None)
+                    elif kind == "error":
+                        watch.fail(JOB_ERRORS.get(result["type"], Exception)(result["message"]))
+                except (RenfeBotException, Exception) as e:
+                    watch.fail(e)
+            await asyncio.sleep(self.poll_interval)
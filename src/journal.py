@@ -0,0 +1,226 @@
+"""This module contains the journal of the searches running in the bot, so they can be resumed
+after a restart instead of dying silently.
+
+The journal is an append-only file with a JSON event per line: a search started, a filter found
+its train rides, a search was polled or a search finished. Polls are only written every few
+minutes, as losing the last ones in a crash doesn't matter. Loading it replays the events, and the
+file is compacted, on load or while the bot runs, when most of its lines are about searches that
+already finished."""
+
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import time
+from typing import Any, Dict, List, Optional, Set, TextIO
+
+from models import SearchContext, TrainRideFilter
+
+WATCHES_FILE = Path("watches.jsonl")
+# The file is rewritten on load when it has this many lines per search running, and enough lines
+COMPACT_RATIO = 4
+COMPACT_MIN_LINES = 100
+# Seconds between the poll events written for the same search
+POLL_SAVE_INTERVAL = 600.0
+
+
+@dataclass
+class StoredWatch:
+    """A search as it is stored in the journal
+
+    :param user_id: The Telegram user that started it, only one search is stored per user
+    :type user_id: int
+    :param chat_id: The chat where the results are sent
+    :type chat_id: int
+    :param context: What the user answered
+    :type context: SearchContext
+    :param filters: One filter for each direction of the trip
+    :type filters: List[TrainRideFilter]
+    :param found: Indexes of the filters that already found train rides
+    :type found: Set[int]
+    :param created_at: When the search started, as a UNIX timestamp
+    :type created_at: float
+    :param last_poll: When the route of the search was polled for the last time
+    :type last_poll: Optional[float]
+    :param polls: Times the route of the search was polled
+    :type polls: int
+    """
+
+    user_id: int
+    chat_id: int
+    context: SearchContext
+    filters: List[TrainRideFilter]
+    found: Set[int] = field(default_factory=set)
+    created_at: float = field(default_factory=time.time)
+    last_poll: Optional[float] = None
+    polls: int = 0
+
+    @property
+    def pending_filters(self) -> List[TrainRideFilter]:
+        """The filters that didn't find train rides yet"""
+        return [ride_filter for idx, ride_filter in enumerate(self.filters)
+                if idx not in self.found]
+
+    def to_event(self) -> Dict[str, Any]:
+        """Return the event that starts this search, with all its progress"""
+        return {
+            "event": "start",
+            "user_id": self.user_id,
+            "chat_id": self.chat_id,
+            "context": self.context.model_dump(mode="json"),
+            "filters": [ride_filter.model_dump(mode="json") for ride_filter in self.filters],
+            "found": sorted(self.found),
+            "created_at": self.created_at,
+            "last_poll": self.last_poll,
+            "polls": self.polls,
+        }
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any]) -> "StoredWatch":
+        """Create a search from its start event"""
+        return cls(
+            user_id=event["user_id"],
+            chat_id=event["chat_id"],
+            context=SearchContext.model_validate(event["context"]),
+            filters=[TrainRideFilter.model_validate(data) for data in event["filters"]],
+            found=set(event.get("found", ())),
+            created_at=event["created_at"],
+            last_poll=event.get("last_poll"),
+            polls=event.get("polls", 0),
+        )
+
+
+class WatchJournal:
+    """Append-only journal of the searches running in the bot.
+
+    :param path: The journal file, defaults to WATCHES_FILE
+    :type path: Path, optional
+    """
+
+    def __init__(self, path: Path = WATCHES_FILE):
+        self.path = Path(path)
+        self.watches: Dict[int, StoredWatch] = {}
+        self._file: Optional[TextIO] = None
+        self._lines = 0
+        # When the last poll event of each search was written, and the searches polled since
+        self._saved_polls: Dict[int, float] = {}
+        self._unsaved_polls: Set[int] = set()
+
+    def load(self) -> List[StoredWatch]:
+        """Replay the journal, compacting it if needed
+
+        :return: The searches that were running, by creation order
+        :rtype: List[StoredWatch]
+        """
+        self.close()
+        self.watches = {}
+        self._saved_polls = {}
+        lines = 0
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A line cut by a crash, the rest of the journal is still valid
+                        continue
+
+        self._lines = lines
+        self._compact_if_needed()
+        return sorted(self.watches.values(), key=lambda watch: watch.created_at)
+
+    def start(self, watch: StoredWatch) -> None:
+        """Store a new search, replacing the one of the user if there was one"""
+        self.watches[watch.user_id] = watch
+        self._saved_polls.pop(watch.user_id, None)
+        self._unsaved_polls.discard(watch.user_id)
+        self._append(watch.to_event())
+
+    def found(self, user_id: int, filter_idx: int) -> None:
+        """Store that a filter of the search of a user found train rides"""
+        if (watch := self.watches.get(user_id)) is not None:
+            watch.found.add(filter_idx)
+            self._append({"event": "found", "user_id": user_id, "filter": filter_idx})
+
+    def polled(self, user_id: int, at: Optional[float] = None) -> None:
+        """Store that the route of the search of a user was polled. The poll is written if the
+        last one written for the search is POLL_SAVE_INTERVAL seconds old, or on close"""
+        if (watch := self.watches.get(user_id)) is None:
+            return
+        watch.last_poll = time.time() if at is None else at
+        watch.polls += 1
+        saved = self._saved_polls.get(user_id)
+        if saved is None or watch.last_poll - saved >= POLL_SAVE_INTERVAL:
+            self._save_poll(watch)
+        else:
+            self._unsaved_polls.add(user_id)
+
+    def finish(self, user_id: int) -> None:
+        """Remove the search of a user, because it finished or it was cancelled"""
+        if self.watches.pop(user_id, None) is not None:
+            self._saved_polls.pop(user_id, None)
+            self._unsaved_polls.discard(user_id)
+            self._append({"event": "finish", "user_id": user_id})
+
+    def compact(self) -> None:
+        """Rewrite the journal with a single event for each search running, with all its
+        progress"""
+        self._close_file()
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for watch in self.watches.values():
+                f.write(json.dumps(watch.to_event()) + "\n")
+        tmp_path.replace(self.path)
+        self._lines = len(self.watches)
+        self._unsaved_polls.clear()
+
+    def close(self) -> None:
+        """Write the polls not written yet and close the journal file, it's opened again on the
+        next event"""
+        for user_id in list(self._unsaved_polls):
+            if (watch := self.watches.get(user_id)) is not None:
+                self._save_poll(watch)
+        self._unsaved_polls.clear()
+        self._close_file()
+
+    def _close_file(self) -> None:
+        """Close the journal file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _apply(self, event: Dict[str, Any]) -> None:
+        """Apply an event to the searches in memory"""
+        user_id = event["user_id"]
+        if event["event"] == "start":
+            self.watches[user_id] = StoredWatch.from_event(event)
+        elif event["event"] == "finish":
+            self.watches.pop(user_id, None)
+        elif (watch := self.watches.get(user_id)) is not None:
+            if event["event"] == "found":
+                watch.found.add(event["filter"])
+            elif event["event"] == "poll":
+                watch.last_poll = event["at"]
+                watch.polls = event.get("polls", watch.polls + 1)
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        """Write an event at the end of the journal"""
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(event) + "\n")
+        self._file.flush()
+        self._lines += 1
+        self._compact_if_needed()
+
+    def _save_poll(self, watch: StoredWatch) -> None:
+        """Write the last poll of a search, with the polls it has done so far"""
+        assert watch.last_poll is not None
+        self._saved_polls[watch.user_id] = watch.last_poll
+        self._unsaved_polls.discard(watch.user_id)
+        self._append({"event": "poll", "user_id": watch.user_id, "at": watch.last_poll,
+                      "polls": watch.polls})
+
+    def _compact_if_needed(self) -> None:
+        """Compact the journal when most of its lines are about searches that finished"""
+        if self._lines >= COMPACT_MIN_LINES and self._lines > COMPACT_RATIO * len(self.watches):
+            self.compact()
@@ -1,12 +1,18 @@
 """This module contains the messages that the bot sends to the user"""
 
-from typing import List
+from typing import List, Tuple
 
 from models import TrainRideRecord, StationRecord
 
+# Longest message Telegram accepts, counted in UTF-16 code units
+MAX_MESSAGE_LENGTH = 4096
+
+# Train rides found, with the stations they go from and to
+TicketsSection = Tuple[List[TrainRideRecord], StationRecord, StationRecord]
+
 user_messages = {
     "welcome": "Hola {}. Bienvenido a tu bot de Renfe. Te ayudaré a encontrar billetes de tren para tus viajes. Para empezar, escribe /ayuda para ver los comandos disponibles.",
-    "help": "/ayuda - Muestra los comandos disponibles\n/buscar - Busca billetes de tren\n/cancelar - Cancela la búsqueda en curso.",
+    "help": "/ayuda - Muestra los comandos disponibles\n/buscar - Busca billetes de tren\n/cancelar - Cancela la búsqueda en curso.\n\nPuedes autocompletar las estaciones escribiendo @ seguido de mi nombre de usuario y parte del nombre de la estación.",
     "cancel": "La búsuqueda ha sido cancelada.",
     "cancel_params": "Reiniciando el proceso de búsqueda, usa /buscar para empezar de nuevo",
     "search_already_running": "Ya hay una búsqueda en curso, por favor espera o utiliza /cancelar para cancelarla",
@@ -16,25 +22,89 @@ user_messages = {
     "destination_date": "📅 ¿Qué día y a partir de qué hora sales?",
     "return_date": "📅 ¿Qué día y a partir de qué hora vuelves?",
     "needs_return": "🔙 ¿Necesitas billete de vuelta?",
-    "needs_filter": "🔍 ¿Quieres filtrar los resultados (precio, duración)?",
+    "needs_filter": "🔍 ¿Quieres filtrar los resultados (precio, duración, horas)?",
     "max_price": "💵 ¿Precio máximo? (introduce 0 si no quieres filtrar por precio)",
     "max_duration": "⏳ ¿Duración máxima? (introduce 0 si no quieres filtrar por duración)",
+    "departure_hours": "🕗 ¿Entre qué horas quieres salir? (por ejemplo 08:00-14:30, introduce 0 si te vale cualquier hora)",
+    "return_hours": "🕗 ¿Y entre qué horas quieres volver? (por ejemplo 16:00-21:00, introduce 0 si te vale cualquier hora)",
     "searching": "🔎 Buscando billetes...",
+    "tickets_found": "He encontrado varios billetes de {} a {}:\n\n{}",
+    "search_resumed": "🔁 Me he reiniciado, pero sigo buscando tus billetes de {} a {}.",
+    "search_expired": "⌛ Mientras estaba reiniciándome, los trenes de tu búsqueda de {} a {} ya han salido. Usa /buscar para empezar otra.",
     "station_not_found": "No he encontrado la estación {}, pero he encontrado estas:\n{}\nPor favor, introduce la tuya de nuevo.",
     "confirm_date": "Vale, a partir de esta fecha y hora: {}",
     "wrong_date": "Perdona, no he entendido la fecha, por favor introdúcela de nuevo.",
     "wrong_number": "Número incorrecto, introdúcelo de nuevo.",
+    "wrong_time_window": "No he entendido las horas, escríbelas como 08:00-14:30 o introduce 0.",
     "invalid_filter": "El filtro introducido no es válido o no se encontró ningún tren con estos parámetros, por favor, inténtalo de nuevo.",
     "invalid_dwr_token": "Si esto ha ocurrido, Renfe ha actualizado por fin su web. Por favor, abre una issue en github para que pueda revisarlo.",
     "undefined_exception": "Oops, algo se ha roto y no sé el qué. Aquí va toda la traza: {}"
 }
 
 
-def get_tickets_message(trains: List[TrainRideRecord], origin: StationRecord, destination: StationRecord):
-    message = (
-        f"He encontrado varios billetes de {origin.name.capitalize()} a "
-        f"{destination.name.capitalize()}:\n\n"
-    )
-    for train in trains:
-        message += str(train)
-    return message
+def get_tickets_message(trains: List[TrainRideRecord], origin: StationRecord,
+                        destination: StationRecord) -> str:
+    """Render the train rides found for a route"""
+    return user_messages["tickets_found"].format(origin.name.capitalize(),
+                                                 destination.name.capitalize(),
+                                                 "".join(str(train) for train in trains))
+
+
+def get_digest_messages(sections: List[TicketsSection],
+                        limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Render all the train rides found for a chat at once, in as few messages as possible
+
+    :param sections: The train rides found and their stations
+    :type sections: List[TicketsSection]
+    :param limit: Longest message, defaults to MAX_MESSAGE_LENGTH
+    :type limit: int, optional
+    :return: The messages to send
+    :rtype: List[str]
+    """
+    return split_message("\n".join(get_tickets_message(*section) for section in sections), limit)
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split a text in messages Telegram accepts, between lines when possible
+
+    :param text: The text
+    :type text: str
+    :param limit: Longest message, in UTF-16 code units as Telegram counts them, defaults to
+        MAX_MESSAGE_LENGTH
+    :type limit: int, optional
+    :return: The messages, without empty ones
+    :rtype: List[str]
+    """
+    messages = []
+    lines: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        length = _telegram_length(line)
+        if size + length > limit and lines:
+            messages.append("".join(lines))
+            lines, size = [], 0
+        while length > limit:
+            # A single line over the limit, it can only be cut
+            cut = _cut_index(line, limit)
+            messages.append(line[:cut])
+            line = line[cut:]
+            length = _telegram_length(line)
+        lines.append(line)
+        size += length
+    messages.append("".join(lines))
+    return [message.strip("\n") for message in messages if message.strip("\n")]
+
+
+def _telegram_length(text: str) -> int:
+    """Return the length of a text as Telegram counts it, in UTF-16 code units"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _cut_index(text: str, limit: int) -> int:
+    """Return the index of the longest prefix of the text within the limit"""
+    size = 0
+    for idx, char in enumerate(text):
+        size += 2 if ord(char) > 0xFFFF else 1
+        if size > limit:
+            return max(1, idx)
+    return len(text)
@@ -1,12 +1,22 @@
 """This module contains the models used in the application"""
 
 from datetime import datetime, time
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
 from errors import InvalidTrainRideFilter
 
+TimeWindow = Tuple[time, time]
+
+
+def format_time_window(window: Optional[TimeWindow]) -> str:
+    """Format a time window as the Renfe search form does, 'HH:MM-HH:MM', or an empty string
+    for the whole day"""
+    if window is None:
+        return ""
+    return f"{window[0].strftime("%H:%M")}-{window[1].strftime("%H:%M")}"
+
 class StationRecord(BaseModel):
     """Represents a Station, using Renfe's data definition. It can be seen at the file
     assets/station.json"""
@@ -53,10 +63,19 @@ class TrainRideFilter(BaseModel):
     destination: str
 
     departure_date: datetime
+    min_departure_hour: Optional[time] = None
+    max_departure_hour: Optional[time] = None
     max_duration_minutes: Optional[int] = None
 
     max_price: Optional[float] = None
 
+    @property
+    def departure_hours(self) -> Optional[TimeWindow]:
+        """Time window for the departure, or None if the filter doesn't limit it."""
+        if self.min_departure_hour is None and self.max_departure_hour is None:
+            return None
+        return (self.min_departure_hour or time.min, self.max_departure_hour or time.max)
+
     def filter_rides(self, rides: List[TrainRideRecord]) -> List[TrainRideRecord]:
         """Filter a list of TrainRideRecord based on user preferences."""
         filtered_rides = []
@@ -68,6 +87,11 @@ class TrainRideFilter(BaseModel):
                 continue
             if ride.departure_time < self.departure_date:
                 continue
+            departure_hour = ride.departure_time.time()
+            if self.min_departure_hour is not None and departure_hour < self.min_departure_hour:
+                continue
+            if self.max_departure_hour is not None and departure_hour > self.max_departure_hour:
+                continue
             if self.max_duration_minutes and ride.duration > self.max_duration_minutes:
                 continue
             if self.max_price and ride.price > self.max_price:
@@ -82,3 +106,14 @@ class TrainRideFilter(BaseModel):
                 f"The filter {self} didn't return any result, available or not."
             )
         return filtered_rides
+
+
+class SearchContext(BaseModel):
+    """SearchContext is a class that holds the context of the search process."""
+    user_id: int
+    origin: StationRecord | None = None
+    destination: StationRecord | None = None
+    departure_date: datetime | None = None
+    return_date: datetime | None = None
+    max_price: float | None = None
+    max_duration_minutes: float | None = None
@@ -0,0 +1,256 @@
+"""This module contains the outbox of the bot. Every message to a chat goes through it, so the bot
+stays under the limits of Telegram (about 30 messages per second in total and 1 per second to the
+same chat) instead of having its messages rejected when many searches find trains at once.
+
+Messages are sent by priority, the train alerts before the answers of the conversations, and in
+order within each chat. A message rejected with a 429 is sent again once the time Telegram asks
+for has passed."""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import itertools
+import math
+import time
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+from telebot import async_telebot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message
+
+from errors import RenfeBotException
+from ratelimit import RateLimiter, TokenBucket
+
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3.0
+# Times a message rejected with a 429 is sent again before giving up
+MAX_RETRIES = 5
+
+PRIORITY_ALERT = 0
+PRIORITY_CHAT = 1
+
+
+@dataclass
+class OutboxStats:
+    """Counters of the messages that went through the outbox
+
+    :param sent: Messages sent
+    :type sent: int
+    :param failed: Messages that could not be sent
+    :type failed: int
+    :param retried: Messages rejected with a 429 and queued again
+    :type retried: int
+    :param queued: Messages waiting to be sent right now
+    :type queued: int
+    :param max_queued: Most messages waiting at the same time
+    :type max_queued: int
+    :param total_latency: Seconds from the submission to the delivery of all the messages sent
+    :type total_latency: float
+    :param max_latency: Longest latency of a single message, in seconds
+    :type max_latency: float
+    """
+
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    queued: int = 0
+    max_queued: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        """Mean seconds from the submission to the delivery of a message"""
+        return self.total_latency / self.sent if self.sent else 0.0
+
+
+@dataclass(eq=False)
+class OutgoingMessage:
+    """A message waiting in the outbox"""
+
+    chat_id: int
+    text: str
+    priority: int
+    seq: int
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    created_at: float = field(default_factory=time.monotonic)
+    retries: int = 0
+
+
+class Outbox:
+    """Queue of the messages sent by the bot, with a token bucket for each chat and another one
+    for the whole bot.
+
+    A chat has a single message being sent at a time, so its messages arrive in order. Among the
+    chats that have a token, the message with the highest priority goes first, and the oldest one
+    for the same priority.
+
+    :param bot: The bot that sends the messages
+    :type bot: async_telebot.AsyncTeleBot
+    :param global_rate: Messages per second to all the chats, defaults to GLOBAL_RATE
+    :type global_rate: float, optional
+    :param global_burst: Messages that can be sent at once to all the chats, defaults to
+        GLOBAL_BURST
+    :type global_burst: float, optional
+    :param chat_rate: Messages per second to the same chat, defaults to CHAT_RATE
+    :type chat_rate: float, optional
+    :param chat_burst: Messages that can be sent at once to the same chat, defaults to CHAT_BURST
+    :type chat_burst: float, optional
+    :param max_retries: Times a message rejected with a 429 is sent again, defaults to
+        MAX_RETRIES
+    :type max_retries: int, optional
+    """
+
+    def __init__(
+        self,
+        bot: async_telebot.AsyncTeleBot,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets = RateLimiter({}, (chat_rate, chat_burst))
+        self.max_retries = max_retries
+        self.stats = OutboxStats()
+        self.lanes: Dict[int, Deque[OutgoingMessage]] = {}
+        self.sending: Set[int] = set()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_CHAT,
+                   **kwargs: Any) -> Message:
+        """Queue a message and wait until it's sent
+
+        :param chat_id: The chat
+        :type chat_id: int
+        :param text: The text of the message, the rest of arguments of send_message can be passed
+            as keyword arguments
+        :type text: str
+        :param priority: PRIORITY_ALERT or PRIORITY_CHAT, lower goes first, defaults to
+            PRIORITY_CHAT
+        :type priority: int, optional
+        :return: The message sent
+        :rtype: Message
+        :raises ApiTelegramException: If Telegram rejected the message
+        """
+        message = OutgoingMessage(chat_id, text, priority, next(self._seq), kwargs,
+                                  asyncio.get_running_loop().create_future())
+        self.lanes.setdefault(chat_id, deque()).append(message)
+        self.stats.queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self.stats.queued)
+        self._wake()
+        return await message.future
+
+    def describe(self) -> str:
+        """Return a line with the messages queued and how long they take, for /debug"""
+        return (f"Outbox: {self.stats.queued} queued (max {self.stats.max_queued}), "
+                f"{self.stats.sent} sent, {self.stats.retried} retried, {self.stats.failed} "
+                f"failed, {self.stats.mean_latency * 1000:.0f} ms mean latency")
+
+    def _wake(self) -> None:
+        """Tell the sender there may be a message to send, starting it if needed"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        assert self._wakeup is not None
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        """Send the messages as the buckets allow it, forever"""
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            message, wait = self._next_message()
+            if message is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           None if math.isinf(wait) else wait)
+                except TimeoutError:
+                    pass
+                continue
+
+            self.global_bucket.reserve()
+            self.chat_buckets.bucket(message.chat_id).reserve()
+            self.sending.add(message.chat_id)
+            task = asyncio.create_task(self._deliver(message))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    def _next_message(self) -> Tuple[Optional[OutgoingMessage], float]:
+        """Take the next message that can be sent now
+
+        :return: The message, or None and the seconds until one may be sent
+        :rtype: Tuple[Optional[OutgoingMessage], float]
+        """
+        wait = max(self._paused_until - time.monotonic(), self.global_bucket.available_in())
+        if wait > 0:
+            return None, wait
+
+        best: Optional[OutgoingMessage] = None
+        wait = math.inf
+        for chat_id, lane in list(self.lanes.items()):
+            # The callers that stopped waiting don't need their messages anymore
+            while lane and lane[0].future.done():
+                lane.popleft()
+                self.stats.queued -= 1
+            if not lane:
+                if chat_id not in self.sending:
+                    del self.lanes[chat_id]
+                continue
+            if chat_id in self.sending:
+                continue
+
+            chat_wait = self.chat_buckets.bucket(chat_id).available_in()
+            if chat_wait > 0:
+                wait = min(wait, chat_wait)
+            elif best is None or (lane[0].priority, lane[0].seq) < (best.priority, best.seq):
+                best = lane[0]
+
+        if best is None:
+            return None, wait
+        self.lanes[best.chat_id].popleft()
+        self.stats.queued -= 1
+        return best, 0.0
+
+    async def _deliver(self, message: OutgoingMessage) -> None:
+        """Send a message, queueing it again at the head of its chat if Telegram asks to wait"""
+        try:
+            result = await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and message.retries < self.max_retries:
+                message.retries += 1
+                self.stats.retried += 1
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+                # Telegram counts the limits for the whole bot, so nothing is sent meanwhile
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                self.lanes.setdefault(message.chat_id, deque()).appendleft(message)
+                self.stats.queued += 1
+            else:
+                self._fail(message, e)
+        except (RenfeBotException, Exception) as e:
+            self._fail(message, e)
+        else:
+            latency = time.monotonic() - message.created_at
+            self.stats.sent += 1
+            self.stats.total_latency += latency
+            self.stats.max_latency = max(self.stats.max_latency, latency)
+            if not message.future.done():
+                message.future.set_result(result)
+        finally:
+            self.sending.discard(message.chat_id)
+            self._wake()
+
+    def _fail(self, message: OutgoingMessage, error: BaseException) -> None:
+        """Raise an error to the caller waiting for a message"""
+        self.stats.failed += 1
+        if not message.future.done():
+            message.future.set_exception(error)
@@ -0,0 +1,157 @@
+"""This module contains the token buckets used to limit how fast the bot calls external services.
+Requests over the limit are queued until a token is available instead of being dropped."""
+
+import asyncio
+from dataclasses import dataclass
+import threading
+import time
+from typing import Callable, Dict, Hashable, Tuple
+
+
+@dataclass
+class BucketStats:
+    """Counters of the requests that went through a token bucket
+
+    :param requests: Requests that took a token
+    :type requests: int
+    :param queued: Requests that had to wait for their token
+    :type queued: int
+    :param waiting: Requests waiting for their token right now
+    :type waiting: int
+    :param total_wait: Seconds waited by all the requests
+    :type total_wait: float
+    :param max_wait: Longest wait of a single request, in seconds
+    :type max_wait: float
+    """
+
+    requests: int = 0
+    queued: int = 0
+    waiting: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        """Mean seconds waited per request"""
+        return self.total_wait / self.requests if self.requests else 0.0
+
+
+class TokenBucket:
+    """Token bucket that refills at a constant rate.
+
+    Tokens are reserved in call order, so a request never overtakes an earlier one. When the bucket
+    is empty, the reservation makes the balance negative and the request waits until it is paid
+    back.
+
+    :param rate: Tokens added per second
+    :type rate: float
+    :param capacity: Maximum number of tokens, which is the size of the allowed bursts
+    :type capacity: float
+    :param clock: Monotonic clock in seconds, defaults to time.monotonic
+    :type clock: Callable[[], float], optional
+    """
+
+    def __init__(self, rate: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.stats = BucketStats()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token from the bucket
+
+        :return: Seconds to wait until the token is available
+        :rtype: float
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+            self.stats.requests += 1
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+            if wait > 0:
+                self.stats.queued += 1
+        return wait
+
+    def available_in(self) -> float:
+        """Return the seconds until a token is available, without taking it
+
+        :return: Seconds to wait, 0 if there's a token now
+        :rtype: float
+        """
+        with self._lock:
+            tokens = min(self.capacity, self.tokens + (self.clock() - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    async def acquire(self) -> float:
+        """Wait asynchronously until a token is available
+
+        :return: Seconds waited
+        :rtype: float
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self.stats.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.stats.waiting -= 1
+        return wait
+
+    def acquire_sync(self) -> float:
+        """Block until a token is available
+
+        :return: Seconds waited
+        :rtype: float
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self.stats.waiting += 1
+            try:
+                time.sleep(wait)
+            finally:
+                self.stats.waiting -= 1
+        return wait
+
+
+class RateLimiter:
+    """Group of token buckets, one for each key (e.g. an endpoint or a chat). Buckets for keys
+    without a specific limit are created on demand with the default one.
+
+    :param limits: Rate and capacity for specific keys
+    :type limits: Dict[Hashable, Tuple[float, float]]
+    :param default: Rate and capacity for the rest of keys
+    :type default: Tuple[float, float]
+    """
+
+    def __init__(self, limits: Dict[Hashable, Tuple[float, float]], default: Tuple[float, float]):
+        self.default = default
+        self.buckets: Dict[Hashable, TokenBucket] = {
+            key: TokenBucket(rate, capacity) for key, (rate, capacity) in limits.items()
+        }
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        """Return the bucket of a key, creating it if needed"""
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(*self.default)
+        return self.buckets[key]
+
+    async def acquire(self, key: Hashable) -> float:
+        """Wait asynchronously until a token for the key is available"""
+        return await self.bucket(key).acquire()
+
+    def acquire_sync(self, key: Hashable) -> float:
+        """Block until a token for the key is available"""
+        return self.bucket(key).acquire_sync()
+
+    def stats(self) -> Dict[Hashable, BucketStats]:
+        """Return the stats of every bucket"""
+        return {key: bucket.stats for key, bucket in self.buckets.items()}
@@ -0,0 +1,146 @@
+"""This module contains the scheduler that decides when each route is polled. Routes whose trains
+leave sooner are polled more often, and all of them share a budget of polls per minute, given
+first to the ones with the earliest departure."""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+import heapq
+import itertools
+import random
+import time
+from typing import Callable, Deque, List, Optional, Tuple
+
+# Seconds between polls depending on the time left until departure, the first that matches is used
+POLL_INTERVALS = [
+    (timedelta(hours=6), 30),
+    (timedelta(days=2), 60),
+    (timedelta(days=7), 120),
+    (timedelta(days=30), 300),
+]
+FAR_FUTURE_INTERVAL = 900
+
+# Routes without any available train are polled less often, doubling the interval every
+# SOLD_OUT_POLLS polls up to MAX_SOLD_OUT_FACTOR times the normal interval
+SOLD_OUT_POLLS = 10
+MAX_SOLD_OUT_FACTOR = 4
+
+MAX_POLLS_PER_MINUTE = 30
+JITTER = 0.1
+
+
+def poll_interval(departure: datetime, sold_out_polls: int = 0,
+                  now: Optional[datetime] = None) -> float:
+    """Return the seconds to wait until the next poll of a route
+
+    :param departure: The earliest departure being watched in the route
+    :type departure: datetime
+    :param sold_out_polls: Consecutive polls without any available train, defaults to 0
+    :type sold_out_polls: int, optional
+    :param now: Current datetime, defaults to datetime.now()
+    :type now: Optional[datetime], optional
+    :return: Seconds until the next poll
+    :rtype: float
+    """
+    time_left = departure - (now or datetime.now())
+    interval = next(
+        (seconds for limit, seconds in POLL_INTERVALS if time_left <= limit), FAR_FUTURE_INTERVAL
+    )
+    return interval * min(2 ** (sold_out_polls // SOLD_OUT_POLLS), MAX_SOLD_OUT_FACTOR)
+
+
+class PollScheduler:
+    """Central scheduler for the polls of all the routes.
+
+    Each route waits for its turn with :meth:`wait`. Once its delay is over the route becomes
+    ready, and ready routes are released in earliest-deadline-first order as long as the polls
+    done in the last minute are under the budget.
+
+    :param max_polls_per_minute: Budget of polls for the whole process, defaults to
+                                 MAX_POLLS_PER_MINUTE
+    :type max_polls_per_minute: int, optional
+    :param jitter: Random fraction added or removed to every delay, so polls don't line up,
+                   defaults to JITTER
+    :type jitter: float, optional
+    :param clock: Monotonic clock in seconds, defaults to time.monotonic
+    :type clock: Callable[[], float], optional
+    """
+
+    def __init__(
+        self,
+        max_polls_per_minute: int = MAX_POLLS_PER_MINUTE,
+        jitter: float = JITTER,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_polls_per_minute = max_polls_per_minute
+        self.jitter = jitter
+        self.clock = clock
+
+        self._counter = itertools.count()
+        self._waiting: List[Tuple[float, int, datetime, asyncio.Future]] = []
+        self._ready: List[Tuple[datetime, int, asyncio.Future]] = []
+        self._polls: Deque[float] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Number of routes waiting for their turn"""
+        return len(self._waiting) + len(self._ready)
+
+    @property
+    def polls_last_minute(self) -> int:
+        """Number of polls released during the last minute"""
+        self._forget_old_polls(self.clock())
+        return len(self._polls)
+
+    async def wait(self, deadline: datetime, delay: float) -> None:
+        """Wait until the delay is over and the route gets its turn to be polled
+
+        :param deadline: The earliest departure being watched in the route
+        :type deadline: datetime
+        :param delay: Seconds to wait before the route becomes ready, before adding the jitter
+        :type delay: float
+        """
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (self.clock() + delay, next(self._counter), deadline, turn))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+
+        await turn
+
+    async def _dispatch(self) -> None:
+        """Release the routes as they become ready and the budget allows it"""
+        while self._waiting or self._ready:
+            now = self.clock()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, idx, deadline, turn = heapq.heappop(self._waiting)
+                heapq.heappush(self._ready, (deadline, idx, turn))
+
+            self._forget_old_polls(now)
+            while self._ready and len(self._polls) < self.max_polls_per_minute:
+                _, _, turn = heapq.heappop(self._ready)
+                if not turn.done():
+                    turn.set_result(None)
+                    self._polls.append(now)
+
+            if self._ready:
+                timeout = self._polls[0] + 60 - now
+            elif self._waiting:
+                timeout = self._waiting[0][0] - now
+            else:
+                break
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _forget_old_polls(self, now: float) -> None:
+        """Remove the polls older than a minute from the budget"""
+        while self._polls and self._polls[0] <= now - 60:
+            self._polls.popleft()
@@ -1,17 +1,28 @@
 """File containing all the logic to obtain the train rides from Renfe website."""
 
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+import hashlib
+from http.cookies import Morsel
+import json
 import random
 import re
-from typing import Any, Dict, Generator, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Generator, Optional, Tuple
 import string
 import urllib.parse
 
-import json5
 import requests
 
-from errors import InvalidDWRToken, InvalidTrainRideFilter
-from models import StationRecord, TrainRideRecord
+from batch import TrainRideBatch, to_minutes
+from cache import TrainRidesCache, cache_key
+from errors import InvalidDWRToken, InvalidTrainRideFilter, RenfeBotException, SessionExpired
+from executor import WorkerPool
+from models import StationRecord, TimeWindow, format_time_window
+from ratelimit import RateLimiter
+
+if TYPE_CHECKING:
+    # aiohttp takes longer to import than the rest of the module, and only the bot needs it
+    import aiohttp
 
 SEARCH_URL = "https://venta.renfe.com/vol/buscarTren.do?Idioma=es&Pais=ES"
 
@@ -20,10 +31,53 @@ SYSTEM_ID_URL = f"{DWR_ENDPOINT}__System.generateId.dwr"
 UPDATE_SESSION_URL = f"{DWR_ENDPOINT}buyEnlacesManager.actualizaObjetosSesion.dwr"
 TRAIN_LIST_URL = f"{DWR_ENDPOINT}trainEnlacesManager.getTrainsList.dwr"
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate",
+    "Accept": "*/*",
+    "Connection": "keep-alive",
+}
+REQUEST_TIMEOUT = 30
+
+# Requests per second and burst size allowed for each endpoint, shared by all the scrapers of the
+# process. Every handshake calls generateId twice, so it gets twice the rate of the other calls.
+RATE_LIMITS = {
+    SEARCH_URL: (0.5, 5),
+    SYSTEM_ID_URL: (1.0, 10),
+    UPDATE_SESSION_URL: (0.5, 5),
+    TRAIN_LIST_URL: (2.0, 10),
+}
+DEFAULT_RATE_LIMIT = (0.5, 5)
+rate_limiter = RateLimiter(RATE_LIMITS, default=DEFAULT_RATE_LIMIT)
+
+# Value of tipoFranjaI/tipoFranjaV when a time window is sent, to filter by departure time
+TIME_WINDOW_TYPE = "S"
+
+# Matches strings, to leave them untouched, and unquoted object keys of JS object literals
+JS_LITERAL_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|([A-Za-z_$][\w$]*)(\s*:)')
+
+
+@dataclass
+class ScraperStats:
+    """Counters of the calls done by a scraper
+
+    :param handshakes: Times the whole DWR handshake was done (5 HTTP calls each)
+    :type handshakes: int
+    :param cheap_polls: Times the train list was obtained reusing the session (1 HTTP call each)
+    :type cheap_polls: int
+    :param unchanged_responses: Train lists equal to the previous one, which were not parsed again
+    :type unchanged_responses: int
+    """
+
+    handshakes: int = 0
+    cheap_polls: int = 0
+    unchanged_responses: int = 0
 
-class Scraper:
-    """Scraper class that encapsulates the whole logic of obtaining the Renfe train rides from their
-    website.
+
+class BaseScraper:
+    """Base class that encapsulates the whole logic of obtaining the Renfe train rides from their
+    website, except for the HTTP calls themselves, which are left to the subclasses.
 
     It makes use of their backend implementation, which uses DWR (Direct Web Remoting) to enable
     async calls from Java. I think (and hope) that this app will be migrated sooner than later to
@@ -37,6 +91,13 @@ class Scraper:
     :type departure_date: datetime
     :param return_date: The day users will return if it's not a one way ride, defaults to None
     :type return_date: Optional[datetime], optional
+    :param cache: Cache of train lists to check before calling Renfe, defaults to None
+    :type cache: Optional[TrainRidesCache], optional
+    :param departure_hours: Departure time window for the trains from origin, sent to Renfe so
+                            it only returns those trains, defaults to None
+    :type departure_hours: Optional[TimeWindow], optional
+    :param return_hours: Departure time window for the trains back, defaults to None
+    :type return_hours: Optional[TimeWindow], optional
     """
 
     def __init__(
@@ -45,44 +106,90 @@ class Scraper:
         destination: StationRecord,
         departure_date: datetime,
         return_date: Optional[datetime] = None,
+        cache: Optional[TrainRidesCache] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
     ):
         """Initialize an Scraper object"""
         self.origin = origin
         self.destination = destination
         self.departure_date = departure_date
         self.return_date = return_date
+        self.cache = cache
+        self._set_time_windows(departure_hours, return_hours)
 
-        self.api = requests.Session()
         self.search_id = create_search_id()
         self.batch_id = get_idx()
 
         self.dwr_token = None
         self.script_session_id = None
+        self.stats = ScraperStats()
+
+        self.response_fingerprint: Optional[bytes] = None
+        self.trains = TrainRideBatch()
 
         if return_date is not None and return_date < departure_date:
             raise InvalidTrainRideFilter
 
-    def get_trainrides(self) -> List[TrainRideRecord]:
-        """Perform all the functions calls needed to obtain the trains list
-
-        :return: List of train rides objects
-        :rtype: List[TrainRideRecord]
+    def _set_time_windows(self, departure_hours: Optional[TimeWindow],
+                          return_hours: Optional[TimeWindow]) -> None:
+        """Change the time windows sent to Renfe, and the cache key that depends on them"""
+        self.departure_hours = departure_hours
+        self.return_hours = return_hours
+        self.cache_key = cache_key(self.origin, self.destination, self.departure_date,
+                                   self.return_date, departure_hours=departure_hours,
+                                   return_hours=return_hours)
+
+    def _get_cached_trainrides(self, bypass_cache: bool) -> Optional[TrainRideBatch]:
+        """Return the trains list stored in the cache, if it's fresh and the cache isn't bypassed"""
+        if self.cache is None or bypass_cache:
+            return None
+        return self.cache.get(self.cache_key)
+
+    def _parse_response(self, response_text: str) -> TrainRideBatch:
+        """Creates the batch of train rides from the getTrainsList response, reusing the one
+        from the previous response if the train list didn't change
+
+        :param response_text: The response from the trains API call
+        :type response_text: str
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
         """
-        self._do_search()
-        self._do_get_dwr_token()
-        self._do_update_session_objects()
-        trains = self._do_get_train_list()
-        return self._parse_train_list(trains)
+        train_list, fingerprint = self._extract_changed_train_list(response_text)
+        if train_list is not None:
+            self._update_trains(parse_js_object(train_list), fingerprint)
+        return self.trains
+
+    def _extract_changed_train_list(self, response_text: str) -> Tuple[Optional[str], bytes]:
+        """Extracts the train list object from the getTrainsList response, if it changed
+
+        :param response_text: The response from the trains API call
+        :type response_text: str
+        :return: The JS object literal, or None if it's the same as in the previous response, and
+            its fingerprint
+        :rtype: Tuple[Optional[str], bytes]
+        """
+        train_list = extract_callback_object(response_text)
+        fingerprint = hashlib.blake2b(train_list.encode(), digest_size=16).digest()
+        if fingerprint == self.response_fingerprint:
+            self.stats.unchanged_responses += 1
+            return None, fingerprint
+        return train_list, fingerprint
+
+    def _update_trains(self, trains: Dict[str, Any], fingerprint: bytes) -> None:
+        """Replace the batch of train rides with the ones of a new train list"""
+        self.trains = self._parse_train_list(trains)
+        self.response_fingerprint = fingerprint
 
-    def _parse_train_list(self, trains: Dict[str, Any]) -> List[TrainRideRecord]:
-        """Creates the list of train objects from the JSON
+    def _parse_train_list(self, trains: Dict[str, Any]) -> TrainRideBatch:
+        """Creates the batch of train rides from the JSON
 
         :param trains: trains dictionary
         :type trains: Dict[str, Any]
-        :return: List of train rides objects
-        :rtype: List[TrainRideRecord]
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
         """
-        trains_records = []
+        trains_batch = TrainRideBatch()
         for idx, train_way in enumerate(trains["listadoTrenes"]):
             departure_direction = [self.origin.name, self.destination.name]
             departure_time = self.departure_date if idx == 0 else self.return_date
@@ -92,21 +199,20 @@ class Scraper:
                 departure_direction.reverse()
 
             origin, destination = departure_direction
-            for train in train_way["listviajeViewEnlaceBean"]:
-                price = train["tarifaMinima"] or "NaN"
-                train_record = TrainRideRecord(
-                    origin=origin,
-                    destination=destination,
-                    departure_time=self._change_datetime_hour(train["horaSalida"], departure_time),
-                    arrival_time=self._change_datetime_hour(train["horaLlegada"], departure_time),
-                    duration=train["duracionViajeTotalEnMinutos"],
-                    price=float(price.replace(",", ".")),
-                    available=self._is_train_available(train),
-                    train_type=train.get("tipoTrenUno", "N/A"),
-                )
-                trains_records.append(train_record)
-
-        return trains_records
+            day = to_minutes(departure_time.replace(hour=0, minute=0, second=0, microsecond=0))
+            way_trains = train_way["listviajeViewEnlaceBean"]
+            trains_batch.extend(
+                origin,
+                destination,
+                [day + hour_to_minutes(train["horaSalida"]) for train in way_trains],
+                [day + hour_to_minutes(train["horaLlegada"]) for train in way_trains],
+                [int(train["duracionViajeTotalEnMinutos"]) for train in way_trains],
+                [float((train["tarifaMinima"] or "NaN").replace(",", ".")) for train in way_trains],
+                [self._is_train_available(train) for train in way_trains],
+                [train.get("tipoTrenUno", "N/A") for train in way_trains],
+            )
+
+        return trains_batch
 
     @staticmethod
     def _is_train_available(train: Dict[str, Any]) -> bool:
@@ -124,54 +230,6 @@ class Scraper:
             and not train["soloPlazaH"]
         )
 
-    @staticmethod
-    def _change_datetime_hour(hour: str, date: datetime) -> datetime:
-        """Add an hour to a date"""
-        hours, minute = map(int, hour.split(":"))
-        return date.replace(hour=hours, minute=minute)
-
-    def _do_search(self) -> None:
-        """Encapsulate the API calls that must be done to input the Renfe search page"""
-        data = self._create_search_payload()
-        cookies = create_cookiedict(self.origin, self.destination)
-        self.api.cookies.set(**cookies)
-        self.api.headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
-            "Accept-Encoding": "gzip, deflate",
-            "Accept": "*/*",
-            "Connection": "keep-alive",
-        }
-
-        r = self.api.post(SEARCH_URL, data=data, allow_redirects=True)
-        assert r.ok
-
-    def _do_get_dwr_token(self) -> None:
-        """Encapsulate the API calls that must be done to obtain the DWR token"""
-        payload = self._create_generate_id_payload()
-        self.api.post(SYSTEM_ID_URL, data=payload)
-
-        payload = self._create_generate_id_payload()
-        r = self.api.post(SYSTEM_ID_URL, data=payload)
-        assert r.ok
-
-        self.dwr_token = extract_dwr_token(r.text)
-        self.api.cookies.set("DWRSESSIONID", self.dwr_token, path="/vol", domain="venta.renfe.com")
-        self.script_session_id = create_session_script_id(self.dwr_token)
-
-    def _do_update_session_objects(self) -> None:
-        """Encapsulate the API calls that must be done to update the DWR session objects"""
-        payload = self._create_update_session_objects_payload()
-        r = self.api.post(UPDATE_SESSION_URL, data=payload)
-        assert r.ok
-
-    def _do_get_train_list(self) -> Dict[str, Any]:
-        """Encapsulate the API calls that must be done to get and parse the trains list"""
-        payload = self._create_get_train_list_payload()
-        r = self.api.post(TRAIN_LIST_URL, data=payload)
-        assert r.ok
-        return extract_train_list(r.text)
-
     def _create_search_payload(self) -> Dict[str, str]:
         """Creates the payload that will be send by POST to the Renfe search URL
 
@@ -208,8 +266,8 @@ class Scraper:
             "plazaH": "false",
             "sinEnlace": "false",
             "asistencia": "false",
-            "franjaHoraI": "",
-            "franjaHoraV": "",
+            "franjaHoraI": format_time_window(self.departure_hours),
+            "franjaHoraV": format_time_window(self.return_hours),
             "Idioma": "es",
             "Pais": "ES",
         }
@@ -276,6 +334,8 @@ class Scraper:
             "" if self.departure_date is None else self.departure_date.strftime(date_format)
         )
         return_date = "" if self.return_date is None else self.return_date.strftime(date_format)
+        departure_hours = format_time_window(self.departure_hours)
+        return_hours = format_time_window(self.return_hours)
         payload = (
             "callCount=1\n"
             "windowName=\n"
@@ -285,10 +345,10 @@ class Scraper:
             "c0-e1=string:false\n"
             "c0-e2=string:false\n"
             "c0-e3=string:false\n"
-            "c0-e4=string:\n"
-            "c0-e5=string:\n"
-            "c0-e6=string:\n"
-            "c0-e7=string:\n"
+            f"c0-e4=string:{TIME_WINDOW_TYPE if departure_hours else ""}\n"
+            f"c0-e5=string:{TIME_WINDOW_TYPE if return_hours else ""}\n"
+            f"c0-e6=string:{urllib.parse.quote_plus(departure_hours)}\n"
+            f"c0-e7=string:{urllib.parse.quote_plus(return_hours)}\n"
             f"c0-e8=string:{urllib.parse.quote_plus(departure_date)}\n"
             f"c0-e9=string:{urllib.parse.quote_plus(return_date)}\n"
             "c0-e10=string:1\n"
@@ -310,6 +370,323 @@ class Scraper:
         return payload
 
 
+class Scraper(BaseScraper):
+    """Scraper that performs the calls to the Renfe website synchronously, using requests. It's
+    the one used by the CLI, where blocking is not a problem.
+    """
+
+    def __init__(
+        self,
+        origin: StationRecord,
+        destination: StationRecord,
+        departure_date: datetime,
+        return_date: Optional[datetime] = None,
+        cache: Optional[TrainRidesCache] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
+    ):
+        """Initialize an Scraper object"""
+        super().__init__(origin, destination, departure_date, return_date, cache,
+                         departure_hours, return_hours)
+        self.api = requests.Session()
+
+    def get_trainrides(self, bypass_cache: bool = False) -> TrainRideBatch:
+        """Obtain the trains list from the cache if it's fresh there, or from Renfe otherwise
+
+        :param bypass_cache: Always call Renfe, but still store the result, defaults to False
+        :type bypass_cache: bool, optional
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
+        """
+        if (trains := self._get_cached_trainrides(bypass_cache)) is not None:
+            return trains
+
+        trains = self._fetch_trainrides()
+        if self.cache is not None:
+            self.cache.set(self.cache_key, trains)
+        return trains
+
+    def _fetch_trainrides(self) -> TrainRideBatch:
+        """Obtain the trains list, reusing the DWR session from previous calls if there is one.
+        The whole handshake is only done for the first call or when the session has expired.
+
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
+        """
+        if self.dwr_token is not None:
+            try:
+                trains = self._parse_response(self._do_get_train_list())
+                self.stats.cheap_polls += 1
+                return trains
+            except SessionExpired:
+                pass
+
+        try:
+            self._do_handshake()
+            return self._parse_response(self._do_get_train_list())
+        except SessionExpired:
+            if self.departure_hours is None and self.return_hours is None:
+                raise
+
+        # Renfe may not accept the time windows, they are only dropped if the same search without
+        # them works, and then the filters leave out the trains outside of them
+        time_windows = self.departure_hours, self.return_hours
+        self._set_time_windows(None, None)
+        try:
+            self._do_handshake()
+            return self._parse_response(self._do_get_train_list())
+        except (RenfeBotException, Exception):
+            # Renfe is failing for any search, the next poll tries the time windows again
+            self._set_time_windows(*time_windows)
+            self.dwr_token = None
+            raise
+
+    def _do_handshake(self) -> None:
+        """Perform all the functions calls needed to start a DWR session for the search"""
+        self._do_search()
+        self._do_get_dwr_token()
+        self._do_update_session_objects()
+        self.stats.handshakes += 1
+
+    def _do_search(self) -> None:
+        """Encapsulate the API calls that must be done to input the Renfe search page"""
+        data = self._create_search_payload()
+        cookies = create_cookiedict(self.origin, self.destination)
+        self.api.cookies.set(**cookies)
+        self.api.headers = HEADERS.copy()
+
+        r = self._post(SEARCH_URL, data)
+        assert r.ok
+
+    def _do_get_dwr_token(self) -> None:
+        """Encapsulate the API calls that must be done to obtain the DWR token"""
+        payload = self._create_generate_id_payload()
+        self._post(SYSTEM_ID_URL, payload)
+
+        payload = self._create_generate_id_payload()
+        r = self._post(SYSTEM_ID_URL, payload)
+        assert r.ok
+
+        self.dwr_token = extract_dwr_token(r.text)
+        self.api.cookies.set("DWRSESSIONID", self.dwr_token, path="/vol", domain="venta.renfe.com")
+        self.script_session_id = create_session_script_id(self.dwr_token)
+
+    def _do_update_session_objects(self) -> None:
+        """Encapsulate the API calls that must be done to update the DWR session objects"""
+        payload = self._create_update_session_objects_payload()
+        r = self._post(UPDATE_SESSION_URL, payload)
+        assert r.ok
+
+    def _do_get_train_list(self) -> str:
+        """Encapsulate the API calls that must be done to get the trains list"""
+        payload = self._create_get_train_list_payload()
+        r = self._post(TRAIN_LIST_URL, payload)
+        assert r.ok
+        return r.text
+
+    def _post(self, url: str, data: Dict[str, str] | str) -> requests.Response:
+        """POST the data to the given URL once the rate limiter allows it
+
+        :param url: The endpoint URL
+        :type url: str
+        :param data: The payload, a dict for form data or a string for DWR calls
+        :type data: Dict[str, str] | str
+        :return: The response
+        :rtype: requests.Response
+        """
+        rate_limiter.acquire_sync(url)
+        return self.api.post(url, data=data, allow_redirects=True)
+
+
+class AsyncScraper(BaseScraper):
+    """Scraper that performs the calls to the Renfe website asynchronously, using aiohttp, so many
+    searches can share the bot's event loop without blocking each other.
+
+    The HTTP session is created on the first request and must be released with :meth:`close`, or
+    by using the scraper as an async context manager.
+    """
+
+    def __init__(
+        self,
+        origin: StationRecord,
+        destination: StationRecord,
+        departure_date: datetime,
+        return_date: Optional[datetime] = None,
+        cache: Optional[TrainRidesCache] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
+        executor: Optional[WorkerPool] = None,
+    ):
+        """Initialize an AsyncScraper object. The responses are parsed by the executor, if there
+        is one, or in the event loop otherwise"""
+        super().__init__(origin, destination, departure_date, return_date, cache,
+                         departure_hours, return_hours)
+        self.executor = executor
+        self.api: Optional["aiohttp.ClientSession"] = None
+
+    async def __aenter__(self) -> "AsyncScraper":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the underlying HTTP session, if it was ever opened"""
+        if self.api is not None and not self.api.closed:
+            await self.api.close()
+        self.api = None
+
+    async def get_trainrides(self, bypass_cache: bool = False) -> TrainRideBatch:
+        """Obtain the trains list from the cache if it's fresh there, or from Renfe otherwise
+
+        :param bypass_cache: Always call Renfe, but still store the result, defaults to False
+        :type bypass_cache: bool, optional
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
+        """
+        if (trains := self._get_cached_trainrides(bypass_cache)) is not None:
+            return trains
+
+        trains = await self._fetch_trainrides()
+        if self.cache is not None:
+            self.cache.set(self.cache_key, trains)
+        return trains
+
+    async def _fetch_trainrides(self) -> TrainRideBatch:
+        """Obtain the trains list, reusing the DWR session from previous calls if there is one.
+        The whole handshake is only done for the first call or when the session has expired.
+
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
+        """
+        if self.dwr_token is not None:
+            try:
+                trains = await self._parse_response_async(await self._do_get_train_list())
+                self.stats.cheap_polls += 1
+                return trains
+            except SessionExpired:
+                pass
+
+        try:
+            await self._do_handshake()
+            return await self._parse_response_async(await self._do_get_train_list())
+        except SessionExpired:
+            if self.departure_hours is None and self.return_hours is None:
+                raise
+
+        # Renfe may not accept the time windows, they are only dropped if the same search without
+        # them works, and then the filters leave out the trains outside of them
+        time_windows = self.departure_hours, self.return_hours
+        self._set_time_windows(None, None)
+        try:
+            await self._do_handshake()
+            return await self._parse_response_async(await self._do_get_train_list())
+        except (RenfeBotException, Exception):
+            # Renfe is failing for any search, the next poll tries the time windows again
+            self._set_time_windows(*time_windows)
+            self.dwr_token = None
+            raise
+
+    async def _parse_response_async(self, response_text: str) -> TrainRideBatch:
+        """Like :meth:`_parse_response`, but the train list is parsed by the executor, so a big
+        response doesn't block the event loop
+
+        :param response_text: The response from the trains API call
+        :type response_text: str
+        :return: Batch of train rides
+        :rtype: TrainRideBatch
+        """
+        if self.executor is None:
+            return self._parse_response(response_text)
+
+        train_list, fingerprint = self._extract_changed_train_list(response_text)
+        if train_list is not None:
+            self._update_trains(await self.executor.run(parse_js_object, train_list), fingerprint)
+        return self.trains
+
+    async def _do_handshake(self) -> None:
+        """Perform all the functions calls needed to start a DWR session for the search"""
+        await self._do_search()
+        await self._do_get_dwr_token()
+        await self._do_update_session_objects()
+        self.stats.handshakes += 1
+
+    async def _do_search(self) -> None:
+        """Encapsulate the API calls that must be done to input the Renfe search page"""
+        data = self._create_search_payload()
+        self._set_cookie(**create_cookiedict(self.origin, self.destination))
+        await self._post(SEARCH_URL, data)
+
+    async def _do_get_dwr_token(self) -> None:
+        """Encapsulate the API calls that must be done to obtain the DWR token"""
+        await self._post(SYSTEM_ID_URL, self._create_generate_id_payload())
+        response_text = await self._post(SYSTEM_ID_URL, self._create_generate_id_payload())
+
+        self.dwr_token = extract_dwr_token(response_text)
+        self._set_cookie("DWRSESSIONID", self.dwr_token, path="/vol", domain="venta.renfe.com")
+        self.script_session_id = create_session_script_id(self.dwr_token)
+
+    async def _do_update_session_objects(self) -> None:
+        """Encapsulate the API calls that must be done to update the DWR session objects"""
+        await self._post(UPDATE_SESSION_URL, self._create_update_session_objects_payload())
+
+    async def _do_get_train_list(self) -> str:
+        """Encapsulate the API calls that must be done to get the trains list"""
+        return await self._post(TRAIN_LIST_URL, self._create_get_train_list_payload())
+
+    async def _post(self, url: str, data: Dict[str, str] | str) -> str:
+        """POST the data to the given URL once the rate limiter allows it and return the response
+        body
+
+        :param url: The endpoint URL
+        :type url: str
+        :param data: The payload, a dict for form data or a string for DWR calls
+        :type data: Dict[str, str] | str
+        :return: The response body
+        :rtype: str
+        """
+        await rate_limiter.acquire(url)
+        async with self._get_api().post(url, data=data, allow_redirects=True) as r:
+            assert r.ok
+            return await r.text()
+
+    def _get_api(self) -> "aiohttp.ClientSession":
+        """Return the HTTP session, creating it if needed. It must be created from inside a
+        running event loop, that's why it is not done in the constructor."""
+        if self.api is None or self.api.closed:
+            import aiohttp
+
+            self.api = aiohttp.ClientSession(
+                headers=HEADERS, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+        return self.api
+
+    def _set_cookie(self, name: str, value: str, domain: str, path: str) -> None:
+        """Store a cookie in the session jar, scoped to the given domain and path"""
+        morsel: Morsel = Morsel()
+        morsel.set(name, value, value)
+        morsel["domain"] = domain
+        morsel["path"] = path
+        from yarl import URL
+        response_url = URL.build(scheme="https", host=domain.lstrip("."), path=path)
+        self._get_api().cookie_jar.update_cookies({name: morsel}, response_url)
+
+
+def split_rate_limits(processes: int) -> None:
+    """Limit this process to its share of RATE_LIMITS, for the bots that poll Renfe from several
+    processes at once, so all of them together don't go over the limits
+
+    :param processes: Number of processes calling Renfe
+    :type processes: int
+    """
+    global rate_limiter
+    processes = max(1, processes)
+    limits = {url: (rate / processes, max(1.0, capacity / processes))
+              for url, (rate, capacity) in RATE_LIMITS.items()}
+    rate, capacity = DEFAULT_RATE_LIMIT
+    rate_limiter = RateLimiter(limits, default=(rate / processes, max(1.0, capacity / processes)))
+
+
 def get_idx() -> Generator:
     """Yields numbers from 0 to inf
 
@@ -322,6 +699,12 @@ def get_idx() -> Generator:
         num += 1
 
 
+def hour_to_minutes(hour: str) -> int:
+    """Convert an 'HH:MM' hour to minutes since midnight"""
+    hours, minutes = hour.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
 def extract_dwr_token(response_text: str) -> str:
     """Extracts the DWR token from the API response of the generateId calls
 
@@ -342,14 +725,63 @@ def extract_dwr_token(response_text: str) -> str:
 def extract_train_list(response_text: str) -> Dict[str, Any]:
     """Extracts the train list returned as JS code by the DWR call
 
+    The object is located with plain string searches instead of a regex over the whole response,
+    and it's parsed as strict JSON when possible. If it's not valid JSON, usually because the keys
+    are not quoted, it's normalized first, and json5 is only used as the last resort.
+
     :param response_text: The response from the trains API call
     :type response_text: str
     :return: Trains JSON
     :rtype: Dict[str, Any]
     """
-    match = re.search(r"r\.handleCallback\([^,]+,\s*[^,]+,\s*(\{.*\})\);", response_text, re.DOTALL)
-    assert match is not None
-    return json5.loads(match.group(1))
+    return parse_js_object(extract_callback_object(response_text))
+
+
+def extract_callback_object(response_text: str) -> str:
+    """Extracts the JS object passed to the callback of a DWR response, without the batch id
+    arguments that change with every call
+
+    :param response_text: The response from the DWR call
+    :type response_text: str
+    :raises SessionExpired: If Renfe answered with an exception or without the callback
+    :return: The JS object literal
+    :rtype: str
+    """
+    callback_start = response_text.find("r.handleCallback(")
+    if callback_start == -1 or "r.handleBatchException(" in response_text:
+        raise SessionExpired
+    object_start = response_text.find("{", callback_start)
+    object_end = response_text.rfind("});")
+    assert object_start != -1 and object_end > object_start
+    return response_text[object_start:object_end + 1]
+
+
+def parse_js_object(text: str) -> Dict[str, Any]:
+    """Parse a JS object literal, trying the fastest parsers first
+
+    :param text: The JS object literal
+    :type text: str
+    :return: The parsed object
+    :rtype: Dict[str, Any]
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    try:
+        return json.loads(JS_LITERAL_PATTERN.sub(_quote_js_key, text))
+    except ValueError:
+        import json5
+
+        return json5.loads(text)
+
+
+def _quote_js_key(match: re.Match) -> str:
+    """Quote the object key of a match of JS_LITERAL_PATTERN, or return the string matched"""
+    if match.group(1) is None:
+        return match.group(0)
+    return f'"{match.group(1)}"{match.group(2)}'
 
 
 def create_cookiedict(
@@ -0,0 +1,274 @@
+"""This module contains the storage of the conversations of the bot (the state of each user and
+the data they have answered) in a SQLite file, so they survive a restart and several processes can
+share them.
+
+The most recently used conversations are kept in memory, and the changes are written in batches:
+once a second, or as soon as enough of them are pending."""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import pickle
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Union
+
+from telebot.asyncio_storage import StateStorageBase
+from telebot.asyncio_storage.base_storage import StateDataContext
+
+STATES_FILE = Path("states.db")
+STATES_HOT_SIZE = 1024
+STATES_FLUSH_INTERVAL = 1.0
+STATES_MAX_PENDING = 64
+
+# A conversation: {"state": str, "data": dict}, or None if the user has none
+Conversation = Optional[Dict[str, Any]]
+
+
+@dataclass
+class StateStorageStats:
+    """Counters of the state storage
+
+    :param hits: Lookups answered from memory
+    :type hits: int
+    :param misses: Lookups that had to read the SQLite file
+    :type misses: int
+    :param flushes: Batches of changes written to the SQLite file
+    :type flushes: int
+    :param writes: Changes written to the SQLite file, fewer than the changes made if the same
+        conversation changed several times in the same batch
+    :type writes: int
+    """
+
+    hits: int = 0
+    misses: int = 0
+    flushes: int = 0
+    writes: int = 0
+
+
+class SQLiteStateStorage(StateStorageBase):
+    """State storage of the bot over a SQLite file in WAL mode.
+
+    Changes are visible right away to this process, and to the rest once they are flushed. The
+    processes that share the file must handle different chats, or use a hot_size and a
+    flush_interval of 0 to read and write the file on every call.
+
+    :param path: The SQLite file, defaults to STATES_FILE
+    :type path: Union[Path, str], optional
+    :param hot_size: Conversations kept in memory, defaults to STATES_HOT_SIZE
+    :type hot_size: int, optional
+    :param flush_interval: Seconds the changes can wait before being written, defaults to
+        STATES_FLUSH_INTERVAL
+    :type flush_interval: float, optional
+    :param max_pending: Changes that are written right away once they are pending, defaults to
+        STATES_MAX_PENDING
+    :type max_pending: int, optional
+    :param separator: Separator of the parts of the keys, defaults to ":"
+    :type separator: str, optional
+    :param prefix: Prefix of the keys, defaults to "telebot"
+    :type prefix: str, optional
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, str] = STATES_FILE,
+        hot_size: int = STATES_HOT_SIZE,
+        flush_interval: float = STATES_FLUSH_INTERVAL,
+        max_pending: int = STATES_MAX_PENDING,
+        separator: str = ":",
+        prefix: str = "telebot",
+    ):
+        super().__init__()
+        self.hot_size = hot_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.separator = separator
+        self.prefix = prefix
+        self.stats = StateStorageStats()
+        self.hot: OrderedDict[str, Conversation] = OrderedDict()
+        self.pending: Dict[str, Conversation] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self.db: Optional[sqlite3.Connection] = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS states "
+            "(key TEXT PRIMARY KEY, state TEXT NOT NULL, data BLOB NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    async def set_state(self, chat_id: int, user_id: int, state: Any,
+                        business_connection_id: Optional[str] = None,
+                        message_thread_id: Optional[int] = None,
+                        bot_id: Optional[int] = None) -> bool:
+        """Set the state of a user, starting a conversation without data if there wasn't one"""
+        if hasattr(state, "name"):
+            state = state.name
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        conversation = self._load(key)
+        if conversation is None:
+            conversation = {"state": state, "data": {}}
+        else:
+            conversation["state"] = state
+        self._store(key, conversation)
+        return True
+
+    async def get_state(self, chat_id: int, user_id: int,
+                        business_connection_id: Optional[str] = None,
+                        message_thread_id: Optional[int] = None,
+                        bot_id: Optional[int] = None) -> Optional[str]:
+        """Return the state of a user, or None if there's no conversation"""
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        conversation = self._load(key)
+        return None if conversation is None else conversation["state"]
+
+    async def delete_state(self, chat_id: int, user_id: int,
+                           business_connection_id: Optional[str] = None,
+                           message_thread_id: Optional[int] = None,
+                           bot_id: Optional[int] = None) -> bool:
+        """Delete the conversation of a user, with its data"""
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        if self._load(key) is None:
+            return False
+        self._store(key, None)
+        return True
+
+    async def set_data(self, chat_id: int, user_id: int, key: str, value: Any,
+                       business_connection_id: Optional[str] = None,
+                       message_thread_id: Optional[int] = None,
+                       bot_id: Optional[int] = None) -> bool:
+        """Set a value in the data of a conversation
+
+        :raises RuntimeError: If the user has no conversation
+        """
+        storage_key = self._key(chat_id, user_id, business_connection_id, message_thread_id,
+                                bot_id)
+        conversation = self._load(storage_key)
+        if conversation is None:
+            raise RuntimeError(f"SQLiteStateStorage: key {storage_key} does not exist.")
+        conversation["data"][key] = value
+        self._store(storage_key, conversation)
+        return True
+
+    async def get_data(self, chat_id: int, user_id: int,
+                       business_connection_id: Optional[str] = None,
+                       message_thread_id: Optional[int] = None,
+                       bot_id: Optional[int] = None) -> Dict[str, Any]:
+        """Return the data of a conversation, empty if there's no conversation"""
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        conversation = self._load(key)
+        return {} if conversation is None else conversation["data"]
+
+    async def reset_data(self, chat_id: int, user_id: int,
+                         business_connection_id: Optional[str] = None,
+                         message_thread_id: Optional[int] = None,
+                         bot_id: Optional[int] = None) -> bool:
+        """Remove the data of a conversation, keeping its state"""
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        conversation = self._load(key)
+        if conversation is None:
+            return False
+        conversation["data"] = {}
+        self._store(key, conversation)
+        return True
+
+    def get_interactive_data(self, chat_id: int, user_id: int,
+                             business_connection_id: Optional[str] = None,
+                             message_thread_id: Optional[int] = None,
+                             bot_id: Optional[int] = None) -> StateDataContext:
+        """Return a context manager with a copy of the data, saved back when it exits"""
+        return StateDataContext(self, chat_id=chat_id, user_id=user_id,
+                                business_connection_id=business_connection_id,
+                                message_thread_id=message_thread_id, bot_id=bot_id)
+
+    async def save(self, chat_id: int, user_id: int, data: Dict[str, Any],
+                   business_connection_id: Optional[str] = None,
+                   message_thread_id: Optional[int] = None,
+                   bot_id: Optional[int] = None) -> bool:
+        """Replace the data of a conversation"""
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        conversation = self._load(key)
+        if conversation is None:
+            return False
+        conversation["data"] = data
+        self._store(key, conversation)
+        return True
+
+    def flush(self) -> None:
+        """Write the pending changes to the SQLite file in a single transaction"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.pending or self.db is None:
+            return
+
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM states WHERE key = ?",
+                [(key,) for key, conversation in self.pending.items() if conversation is None],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO states (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(key, conversation["state"], pickle.dumps(conversation["data"]), now)
+                 for key, conversation in self.pending.items() if conversation is not None],
+            )
+        self.stats.flushes += 1
+        self.stats.writes += len(self.pending)
+        self.pending.clear()
+
+    def close(self) -> None:
+        """Write the pending changes and close the SQLite file"""
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _key(self, chat_id: int, user_id: int, business_connection_id: Optional[str],
+             message_thread_id: Optional[int], bot_id: Optional[int]) -> str:
+        """Return the key of a conversation"""
+        return self._get_key(chat_id, user_id, self.prefix, self.separator,
+                             business_connection_id, message_thread_id, bot_id)
+
+    def _load(self, key: str) -> Conversation:
+        """Return the conversation of a key, from memory if it's there or from the file"""
+        if key in self.hot:
+            self.hot.move_to_end(key)
+            self.stats.hits += 1
+            return self.hot[key]
+        if key in self.pending:
+            self.stats.hits += 1
+            return self.pending[key]
+
+        self.stats.misses += 1
+        assert self.db is not None
+        row = self.db.execute("SELECT state, data FROM states WHERE key = ?", (key,)).fetchone()
+        conversation = None if row is None else {"state": row[0], "data": pickle.loads(row[1])}
+        self._remember(key, conversation)
+        return conversation
+
+    def _store(self, key: str, conversation: Conversation) -> None:
+        """Save a conversation in memory and schedule its write"""
+        self._remember(key, conversation)
+        self.pending[key] = conversation
+        if len(self.pending) >= self.max_pending or self.flush_interval <= 0:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval,
+                                                                       self.flush)
+
+    def _remember(self, key: str, conversation: Conversation) -> None:
+        """Keep a conversation in memory, forgetting the least recently used ones over the size"""
+        if self.hot_size <= 0:
+            return
+        self.hot[key] = conversation
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.hot_size:
+            self.hot.popitem(last=False)
+
+    def __str__(self) -> str:
+        return (f"<SQLiteStateStorage: {len(self.hot)} in memory, {len(self.pending)} pending, "
+                f"{self.stats.flushes} flushes>")
@@ -1,16 +1,62 @@
-"""Manages the storage and retrieval of stations data."""
+"""Manages the storage and retrieval of stations data.
 
+The stations JSON is the source of truth, but it has many fields the bot never uses, so it's
+compiled into a smaller index with just the name, code, priority and search key of every station.
+The index is built the first time the stations are needed, or running this module:
+
+    python src/storage.py
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+import heapq
 import itertools
 import json
 from pathlib import Path
-from typing import Any, Dict, List, Iterable, Optional
-
-from thefuzz import process
+import re
+from typing import Any, Dict, List, Iterable, NamedTuple, Optional, Set, Tuple
+import unicodedata
 
 from errors import StationNotFound
 from models import StationRecord
 
 STATIONS_PATH = Path("assets/stations.json")
+STATIONS_INDEX_PATH = Path("assets/stations.idx")
+STATIONS_INDEX_HEADER = "renfe-bot stations index v1"
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^0-9a-z]+")
+
+# Suggestions for a misspelled station: how many, and the minimum similarity (0-100) they need
+SUGGESTIONS_LIMIT = 5
+SUGGESTIONS_SCORE_CUTOFF = 90
+# Completions returned for a partial station name
+COMPLETIONS_LIMIT = 10
+# Fraction of the trigrams of the shortest of both names that a station must share with the
+# searched name to be scored at all
+MIN_SHARED_TRIGRAMS = 0.4
+
+
+class IndexedStation(NamedTuple):
+    """Station as stored in the stations index"""
+
+    name: str
+    code: str
+    priority: int
+    key: str
+
+
+def normalize_station_name(name: str) -> str:
+    """Return the search key of a station name: lowercase, without accents and with any run of
+    symbols replaced by a single space
+
+    :param name: The station name, as written by Renfe or by a user
+    :type name: str
+    :return: The search key
+    :rtype: str
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC_PATTERN.sub(" ", without_accents).strip()
 
 
 def load_json(path: Path) -> Dict[str, Any]:
@@ -27,15 +73,226 @@ def load_json(path: Path) -> Dict[str, Any]:
     return json_content
 
 
+def trigrams(key: str) -> Set[str]:
+    """Return the trigrams of a search key, padded so the start and end of the name count too"""
+    padded = f"  {key} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+class StationSearchIndex:
+    """Indexes of the station search keys, used to suggest stations for misspelled names and to
+    complete partial ones.
+
+    For misspelled names, only the stations that share enough trigrams with the searched name are
+    scored, with the same scorer thefuzz uses by default, so a search doesn't compare the name
+    with every station.
+
+    For partial names, every station is stored in a sorted array once per word of its name, with
+    the rest of the name from that word on, so "atocha" completes "MADRID PTA. ATOCHA - ALMUDENA
+    GRANDES" and "alacant" completes "ALICANTE/ALACANT". Completing is a binary search.
+
+    :param stations: The stations to index
+    :type stations: Iterable[IndexedStation]
+    """
+
+    def __init__(self, stations: Iterable[IndexedStation]):
+        self.stations = list(stations)
+        self.trigram_counts: List[int] = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        suffixes: List[Tuple[str, int]] = []
+        for idx, station in enumerate(self.stations):
+            station_trigrams = trigrams(station.key)
+            self.trigram_counts.append(len(station_trigrams))
+            for trigram in station_trigrams:
+                self.postings[trigram].append(idx)
+
+            words = station.key.split()
+            suffixes.extend((" ".join(words[start:]), idx) for start in range(len(words)))
+
+        suffixes.sort()
+        self.suffixes = [suffix for suffix, _ in suffixes]
+        self.suffix_stations = [idx for _, idx in suffixes]
+        self.by_priority = sorted(range(len(self.stations)),
+                                  key=lambda idx: self.stations[idx].priority)
+
+    def complete(self, prefix: str, limit: int = COMPLETIONS_LIMIT) -> List[IndexedStation]:
+        """Return the stations with a word starting with a partial name, ignoring case and accents
+
+        :param prefix: The partial name, as written by the user
+        :type prefix: str
+        :param limit: Maximum number of stations returned, defaults to COMPLETIONS_LIMIT
+        :type limit: int, optional
+        :return: The stations whose name starts with the prefix, and then the ones with other
+                 words starting with it, from the most important one. The most important
+                 stations if the prefix is empty.
+        :rtype: List[IndexedStation]
+        """
+        key = normalize_station_name(prefix)
+        if not key:
+            return [self.stations[idx] for idx in self.by_priority[:limit]]
+
+        first = bisect_left(self.suffixes, key)
+        last = bisect_right(self.suffixes, key + "\uffff", lo=first)
+        ranks: Dict[int, Tuple[bool, int]] = {}
+        for position in range(first, last):
+            idx = self.suffix_stations[position]
+            station = self.stations[idx]
+            rank = (not station.key.startswith(key), station.priority)
+            if idx not in ranks or rank < ranks[idx]:
+                ranks[idx] = rank
+        return [self.stations[idx] for idx in heapq.nsmallest(limit, ranks, key=ranks.__getitem__)]
+
+    def search(self, name: str, limit: int = SUGGESTIONS_LIMIT,
+               score_cutoff: int = SUGGESTIONS_SCORE_CUTOFF) -> List[Tuple[IndexedStation, int]]:
+        """Return the stations most similar to a name, ignoring case and accents
+
+        :param name: The name to search, as written by the user
+        :type name: str
+        :param limit: Maximum number of stations returned, defaults to SUGGESTIONS_LIMIT
+        :type limit: int, optional
+        :param score_cutoff: Minimum similarity, defaults to SUGGESTIONS_SCORE_CUTOFF
+        :type score_cutoff: int, optional
+        :return: The stations and their similarity, from the most similar one and, for the same
+                 similarity, from the most important one
+        :rtype: List[Tuple[IndexedStation, int]]
+        """
+        key = normalize_station_name(name)
+        # One or two letters are a partial match of half the stations, nothing worth suggesting
+        if len(key) < 3:
+            return []
+
+        # thefuzz is only imported by the searches, the completions and the index don't need it
+        from thefuzz import fuzz
+
+        key_trigrams = trigrams(key)
+        shared = Counter(itertools.chain.from_iterable(
+            self.postings.get(trigram, ()) for trigram in key_trigrams
+        ))
+        results = []
+        for idx, count in shared.items():
+            if count < MIN_SHARED_TRIGRAMS * min(len(key_trigrams), self.trigram_counts[idx]):
+                continue
+            station = self.stations[idx]
+            if (score := fuzz.WRatio(key, station.key)) >= score_cutoff:
+                results.append((station, score))
+        results.sort(key=lambda result: (-result[1], result[0].priority))
+        return results[:limit]
+
+
+def index_stations(stations: Dict[str, Dict[str, Any]]) -> Dict[str, IndexedStation]:
+    """Keep only the fields of the stations JSON used by the bot, adding their search keys
+
+    :param stations: The contents of the stations JSON
+    :type stations: Dict[str, Dict[str, Any]]
+    :return: The indexed stations, by name
+    :rtype: Dict[str, IndexedStation]
+    """
+    return {
+        name: IndexedStation(station["desgEstacion"], station["clave"],
+                             station["nmroPrioridad"], normalize_station_name(name))
+        for name, station in stations.items()
+    }
+
+
+def write_stations_index(stations: Dict[str, IndexedStation],
+                         index_path: Path = STATIONS_INDEX_PATH) -> None:
+    """Write the stations index.
+
+    It's a text file with a header line and a line per station, with its name, code, priority and
+    search key separated by tabs. It's written to a temporary file first, so readers never see
+    half of it.
+
+    :param stations: The indexed stations, by name
+    :type stations: Dict[str, IndexedStation]
+    :param index_path: Where the index is written, defaults to STATIONS_INDEX_PATH
+    :type index_path: Path, optional
+    """
+    lines = [STATIONS_INDEX_HEADER] + ["\t".join(map(str, station))
+                                      for station in stations.values()]
+    tmp_path = index_path.with_suffix(".tmp")
+    tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp_path.replace(index_path)
+
+
+def read_stations_index(index_path: Path = STATIONS_INDEX_PATH) -> Dict[str, IndexedStation]:
+    """Read the stations index in a single read
+
+    :param index_path: Where the index is located, defaults to STATIONS_INDEX_PATH
+    :type index_path: Path, optional
+    :raises ValueError: If the file is not a stations index of this version
+    :return: The indexed stations, by name
+    :rtype: Dict[str, IndexedStation]
+    """
+    header, *lines = index_path.read_text(encoding="utf-8").splitlines()
+    if header != STATIONS_INDEX_HEADER:
+        raise ValueError(f"{index_path} is not a stations index ({header!r})")
+
+    stations = {}
+    for line in lines:
+        name, code, priority, key = line.split("\t")
+        stations[name] = IndexedStation(name, code, int(priority), key)
+    return stations
+
+
+def load_stations(json_path: Path = STATIONS_PATH,
+                  index_path: Path = STATIONS_INDEX_PATH) -> Dict[str, IndexedStation]:
+    """Load the stations from the index, building it first if it's missing or older than the JSON
+
+    :param json_path: Where the stations JSON is located, defaults to STATIONS_PATH
+    :type json_path: Path, optional
+    :param index_path: Where the index is located, defaults to STATIONS_INDEX_PATH
+    :type index_path: Path, optional
+    :return: The indexed stations, by name
+    :rtype: Dict[str, IndexedStation]
+    """
+    try:
+        if not json_path.exists() or index_path.stat().st_mtime >= json_path.stat().st_mtime:
+            return read_stations_index(index_path)
+    except (OSError, ValueError):
+        pass
+
+    stations = index_stations(load_json(json_path))
+    try:
+        write_stations_index(stations, index_path)
+    except OSError:
+        pass  # Read-only assets folder, the JSON will be read again on the next start
+    return stations
+
+
 class StationsStorage:
     """Manages the storage and retrieval of station data.
 
-    :param stations: A dictionary containing station data, where the key is the station name and the
-                     value is a dictionary with station details.
-    :type stations: Dict, optional
+    :param stations: The indexed stations, where the key is the station name, loaded the first
+                     time they are needed
+    :type stations: Dict[str, IndexedStation], optional
     """
 
-    stations: Optional[Dict[str, Dict]] = None
+    stations: Optional[Dict[str, IndexedStation]] = None
+    search_index: Optional[StationSearchIndex] = None
+
+    @classmethod
+    def get_stations(cls) -> Dict[str, IndexedStation]:
+        """Return the indexed stations, loading them if it's the first time
+
+        :return: The indexed stations, by name
+        :rtype: Dict[str, IndexedStation]
+        """
+        if cls.stations is None:
+            cls.stations = load_stations(STATIONS_PATH, STATIONS_INDEX_PATH)
+            cls.search_index = None
+        return cls.stations
+
+    @classmethod
+    def get_search_index(cls) -> StationSearchIndex:
+        """Return the trigram index of the stations, building it if it's the first time
+
+        :return: The trigram index
+        :rtype: StationSearchIndex
+        """
+        stations = cls.get_stations()
+        if cls.search_index is None:
+            cls.search_index = StationSearchIndex(stations.values())
+        return cls.search_index
 
     @classmethod
     def get_station(cls, name: str) -> StationRecord:
@@ -48,44 +305,53 @@ class StationsStorage:
         :rtype: StationRecord
         """
 
-        if cls.stations is None:
-            cls.stations = load_json(STATIONS_PATH)
-
-        if (station := cls.stations.get(name, None)) is None:
+        if (station := cls.get_stations().get(name, None)) is None:
             raise StationNotFound(f"Couldn't find the station '{name}'")
 
-        assert isinstance(station, dict)
-        return StationRecord(name=station['desgEstacion'], code=station['clave'])
+        return StationRecord(name=station.name, code=station.code)
 
     @classmethod
     def find_station(cls, name: str) -> List[str]:
-        """Retrieves a list of station records fuzzy finding the names
+        """Retrieves a list of station records fuzzy finding the names, ignoring case and accents
 
         :param name: The name of the station to retrieve
         :type name: str
-        :raises StationNotFound: If the station is not found in the storage.
-        :return: The names of similar stations, containing its name and code
+        :return: The names of similar stations, from the most similar one
         :rtype: strings
         """
 
-        if cls.stations is None:
-            cls.stations = load_json(STATIONS_PATH)
+        return [station.name for station, _ in cls.get_search_index().search(name)]
+
+    @classmethod
+    def complete_station(cls, prefix: str, limit: int = COMPLETIONS_LIMIT) -> List[str]:
+        """Retrieves the names of the stations that complete a partial name, ignoring case and
+        accents
 
-        guesses = process.extractBests(name, cls.stations.keys(), score_cutoff=90)
-        return [guess[0] for guess in guesses]
+        :param prefix: The partial name, as the user is typing it
+        :type prefix: str
+        :param limit: Maximum number of names returned, defaults to COMPLETIONS_LIMIT
+        :type limit: int, optional
+        :return: The names of the stations, from the best completion
+        :rtype: List[str]
+        """
+
+        return [station.name for station in cls.get_search_index().complete(prefix, limit)]
 
     @classmethod
     def get_all_stations(cls) -> Iterable[StationRecord]:
         """Retrieves all available stations.
 
         If the station data is not loaded, it initializes the storage by
-        loading data from a JSON file.
+        loading data from the stations index.
 
         :return: A consumable iterable containing the records for all stations.
         :rtype: Iterable[StationRecord]
         """
-        if cls.stations is None:
-            cls.stations = load_json(STATIONS_PATH)
+        return itertools.chain([StationRecord(name=station.name, code=station.code)
+                                for station in cls.get_stations().values()])
+
 
-        return itertools.chain([StationRecord(name=station['desgEstacion'], code=station['clave'])
-                                for _, station in cls.stations.items()])
+if __name__ == "__main__":
+    indexed = index_stations(load_json(STATIONS_PATH))
+    write_stations_index(indexed)
+    print(f"Indexed {len(indexed)} stations in {STATIONS_INDEX_PATH}")
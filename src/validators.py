@@ -1,16 +1,19 @@
 """This module contains the validators for the user input"""
 
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, time
+import re
 from typing import Optional
 
-import dateparser
-
+from dates import parse_date
 from errors import StationNotFound
 from messages import user_messages as msg
-from models import StationRecord
+from models import StationRecord, TimeWindow
 from storage import StationsStorage
 
+# Hours answered as 'HH:MM-HH:MM', the minutes are optional
+TIME_WINDOW_PATTERN = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*-\s*(\d{1,2})(?::(\d{2}))?\s*$")
+
 
 @dataclass
 class StationValidationResult:
@@ -47,6 +50,18 @@ class FloatValidationResult:
         return self.is_valid
 
 
+@dataclass
+class TimeWindowValidationResult:
+    """Holds the result of a time window validation, None if the user doesn't want any"""
+
+    is_valid: bool
+    window: TimeWindow | None = None
+    error_message: str = ""
+
+    def __bool__(self):
+        return self.is_valid
+
+
 def validate_station(station_name: Optional[str]) -> StationValidationResult:
     """Validates the station provided by the user, returning partial matches if the station is
     not found"""
@@ -69,14 +84,12 @@ def validate_station(station_name: Optional[str]) -> StationValidationResult:
 
 
 def validate_date(message: Optional[str]) -> DateValidationResult:
-    """Validates the date provided by the user using the dateparser library, that supports
-    creating a datetime object from a natural language string in multiple languages"""
+    """Validates the date provided by the user, written as a date or in natural language, in
+    Spanish or English. See :func:`dates.parse_date`"""
     if not message:
         return DateValidationResult(is_valid=False, error_message=msg["wrong_date"])
 
-    parsed_date = dateparser.parse(message,
-                                   languages=["es", "en"],
-                                   settings={"STRICT_PARSING": True})
+    parsed_date = parse_date(message)
     if parsed_date is None:
         return DateValidationResult(is_valid=False, error_message=msg["wrong_date"])
     return DateValidationResult(is_valid=True, date=parsed_date)
@@ -88,3 +101,22 @@ def validate_float(message: Optional[str]) -> FloatValidationResult:
         return FloatValidationResult(is_valid=False, error_message=msg["wrong_number"])
     parsed_number = float(message)
     return FloatValidationResult(is_valid=True, number=parsed_number)
+
+
+def validate_time_window(message: Optional[str]) -> TimeWindowValidationResult:
+    """Validates the hours between which the user wants to leave, written as 'HH:MM-HH:MM', or 0
+    for any hour"""
+    if message is not None and message.strip() == "0":
+        return TimeWindowValidationResult(is_valid=True)
+
+    match = TIME_WINDOW_PATTERN.match(message or "")
+    if match is None:
+        return TimeWindowValidationResult(is_valid=False, error_message=msg["wrong_time_window"])
+    start_hour, start_minute, end_hour, end_minute = (int(group or 0) for group in match.groups())
+    try:
+        window = (time(start_hour, start_minute), time(end_hour, end_minute))
+    except ValueError:
+        return TimeWindowValidationResult(is_valid=False, error_message=msg["wrong_time_window"])
+    if window[0] > window[1]:
+        return TimeWindowValidationResult(is_valid=False, error_message=msg["wrong_time_window"])
+    return TimeWindowValidationResult(is_valid=True, window=window)
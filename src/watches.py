@@ -0,0 +1,393 @@
+"""This module contains the registry of the searches running in the bot. Searches for the same
+route and dates share a single scraper, so the Renfe website is polled once per route no matter
+how many users are watching it."""
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+import math
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from batch import TrainRideBatch
+from errors import InvalidTrainRideFilter, RenfeBotException
+from executor import WorkerPool
+from filtering import FilterResult, RideIndex
+from models import StationRecord, TimeWindow, TrainRideFilter, TrainRideRecord
+from cache import TrainRidesCache
+from scheduler import PollScheduler, poll_interval
+from scraper import AsyncScraper
+
+RidesCallback = Callable[[TrainRideFilter, List[TrainRideRecord]], Awaitable[None]]
+# The pending filters of a watch with what they returned for the rides of a poll
+FilterMatches = Sequence[Tuple[TrainRideFilter, FilterResult]]
+
+# Routes that can be polling Renfe at the same time, the rest wait for their turn
+MAX_CONCURRENT_POLLS = 8
+
+
+def rides_fingerprint(rides: TrainRideBatch) -> int:
+    """Return a hash of a batch of train rides that doesn't depend on their order
+
+    :param rides: The train rides
+    :type rides: TrainRideBatch
+    :return: The fingerprint
+    :rtype: int
+    """
+    return hash(frozenset(
+        (origin, destination, departure, arrival, duration,
+         None if math.isnan(price) else price, available, train_type)
+        for origin, destination, departure, arrival, duration, price, available, train_type
+        in rides.rows()
+    ))
+
+
+@dataclass
+class RegistryStats:
+    """Counters of the work done by the registry
+
+    :param polls: Polls done for all the routes
+    :type polls: int
+    :param unchanged_polls: Polls that returned the same train rides as the previous poll
+    :type unchanged_polls: int
+    :param feeds: Times the filters of a watch were run over the train rides
+    :type feeds: int
+    :param skipped_feeds: Times the filters of a watch were not run because the train rides were
+                          the same they already ran over
+    :type skipped_feeds: int
+    :param active_polls: Routes polling Renfe right now
+    :type active_polls: int
+    :param cancelled_routes: Routes stopped because all their watches left before they finished
+    :type cancelled_routes: int
+    """
+
+    polls: int = 0
+    unchanged_polls: int = 0
+    feeds: int = 0
+    skipped_feeds: int = 0
+    active_polls: int = 0
+    cancelled_routes: int = 0
+
+
+@dataclass(frozen=True)
+class WatchKey:
+    """Identifies a route that can be polled once for all the users watching it."""
+
+    origin: str
+    destination: str
+    departure_date: date
+    return_date: Optional[date] = None
+    departure_hours: Optional[TimeWindow] = None
+    return_hours: Optional[TimeWindow] = None
+
+    @classmethod
+    def create(
+        cls,
+        origin: StationRecord,
+        destination: StationRecord,
+        departure_date: datetime,
+        return_date: Optional[datetime] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
+    ) -> "WatchKey":
+        """Create the key of a search, ignoring the hours of the dates as Renfe returns all the
+        trains of the day anyway. Only the time windows sent to Renfe make a different route."""
+        return cls(
+            origin=origin.code,
+            destination=destination.code,
+            departure_date=departure_date.date(),
+            return_date=None if return_date is None else return_date.date(),
+            departure_hours=departure_hours,
+            return_hours=return_hours,
+        )
+
+
+@dataclass(eq=False)
+class Watch:
+    """A user search, waiting for train rides that pass its filters.
+
+    :param filters: One filter for each direction of the trip
+    :type filters: List[TrainRideFilter]
+    :param on_rides: Coroutine called with a filter and its rides the first time it finds any
+    :type on_rides: RidesCallback
+    :param on_poll: Function called every time the route of the watch is polled, defaults to None
+    :type on_poll: Optional[Callable[[], None]], optional
+    """
+
+    filters: List[TrainRideFilter]
+    on_rides: RidesCallback
+    on_poll: Optional[Callable[[], None]] = None
+    pending: List[TrainRideFilter] = field(init=False)
+    done: asyncio.Future = field(init=False)
+    fingerprint: Optional[int] = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.pending = list(self.filters)
+        self.done = asyncio.get_running_loop().create_future()
+
+    async def feed(self, matches: FilterMatches) -> None:
+        """Take the results of the pending filters over the rides of a poll, notifying the ones
+        that found something.
+
+        :raises InvalidTrainRideFilter: If any filter didn't return any result, available or not.
+        """
+        for ride_filter, filtered_rides in matches:
+            # Another feed of the same watch may have found it while this one was notifying
+            if ride_filter not in self.pending:
+                continue
+            if isinstance(filtered_rides, InvalidTrainRideFilter):
+                raise filtered_rides
+            if filtered_rides:
+                self.pending.remove(ride_filter)
+                await self.on_rides(ride_filter, filtered_rides)
+
+        if not self.pending and not self.done.done():
+            self.done.set_result(None)
+
+    def fail(self, error: BaseException) -> None:
+        """Finish the watch with an error, that will be raised to whoever is waiting for it"""
+        if not self.done.done():
+            self.done.set_exception(error)
+
+
+@dataclass(eq=False)
+class Route:
+    """A route being polled and the watches subscribed to it."""
+
+    scraper: AsyncScraper
+    watches: Set[Watch] = field(default_factory=set)
+    task: Optional[asyncio.Task] = None
+    sold_out_polls: int = 0
+    fingerprint: Optional[int] = None
+    rides: Optional[TrainRideBatch] = None
+    closing: bool = False
+
+    @property
+    def deadline(self) -> datetime:
+        """The earliest departure the watches of this route are still waiting for"""
+        return min(
+            ride_filter.departure_date for watch in self.watches for ride_filter in watch.pending
+        )
+
+
+class WatchRegistry:
+    """Keeps one polling task for each route being watched and fans out the train rides obtained
+    to all of its watches. When each route is polled is decided by the scheduler, and how many
+    routes poll at the same time is limited by the registry.
+
+    Cancelling the task waiting in :meth:`watch` unsubscribes the watch, and the route stops
+    polling and closes its scraper as soon as no watch is left.
+
+    :param scheduler: The scheduler shared by all the routes, defaults to a new PollScheduler
+    :type scheduler: Optional[PollScheduler], optional
+    :param cache: Cache of train lists shared by the scrapers of all the routes, defaults to None
+    :type cache: Optional[TrainRidesCache], optional
+    :param executor: Pool where the scrapers parse the responses, defaults to None (the event
+        loop)
+    :type executor: Optional[WorkerPool], optional
+    :param max_concurrent_polls: Routes that can poll at the same time, defaults to
+        MAX_CONCURRENT_POLLS
+    :type max_concurrent_polls: int, optional
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[PollScheduler] = None,
+        cache: Optional[TrainRidesCache] = None,
+        executor: Optional[WorkerPool] = None,
+        max_concurrent_polls: int = MAX_CONCURRENT_POLLS,
+    ):
+        self.scheduler = scheduler or PollScheduler()
+        self.cache = cache
+        self.executor = executor
+        self.max_concurrent_polls = max_concurrent_polls
+        self.stats = RegistryStats()
+        self.routes: Dict[WatchKey, Route] = {}
+        self._poll_slots = asyncio.Semaphore(max_concurrent_polls)
+
+    async def watch(
+        self,
+        watch: Watch,
+        origin: StationRecord,
+        destination: StationRecord,
+        departure_date: datetime,
+        return_date: Optional[datetime] = None,
+        departure_hours: Optional[TimeWindow] = None,
+        return_hours: Optional[TimeWindow] = None,
+        delay: float = 0.0,
+    ) -> None:
+        """Subscribe a watch to its route and wait until all its filters have found train rides.
+        The delay is the seconds until the first poll if the route is not being polled yet, used
+        to spread the searches resumed after a restart.
+
+        :raises InvalidTrainRideFilter: If any filter didn't return any result, available or not.
+        :raises InvalidDWRToken: If the route could not be polled because of the DWR token.
+        """
+        key = WatchKey.create(origin, destination, departure_date, return_date,
+                              departure_hours, return_hours)
+        route = self.routes.get(key)
+        if route is None:
+            scraper = AsyncScraper(
+                origin,
+                destination,
+                datetime.combine(key.departure_date, time()),
+                None if key.return_date is None else datetime.combine(key.return_date, time()),
+                cache=self.cache,
+                departure_hours=departure_hours,
+                return_hours=return_hours,
+                executor=self.executor,
+            )
+            route = self.routes[key] = Route(scraper=scraper)
+            route.task = asyncio.create_task(self._poll_route(key, route, delay))
+
+        route.watches.add(watch)
+        try:
+            if route.rides is not None:
+                # The route may not poll again for a long time, the watch starts with the rides
+                # the other watches got in the last poll
+                pending = list(watch.pending)
+                results = RideIndex(route.rides).filter_many(pending)
+                await self._feed(watch, list(zip(pending, results)), route.fingerprint)
+            await watch.done
+        finally:
+            route.watches.discard(watch)
+            if not route.watches and not route.closing and route.task is not None:
+                # The last watch left before the route stopped by itself, there's nobody left to
+                # poll the route for. It's only a cancelled route if the watch didn't finish, the
+                # future is cancelled too when the watch is.
+                self._forget_route(key, route)
+                finished = watch.done.done() and not watch.done.cancelled()
+                if route.task.cancel() and not finished:
+                    self.stats.cancelled_routes += 1
+
+    def describe(self) -> str:
+        """Return a line with the routes being polled, for /debug"""
+        return (f"Routes: {len(self.routes)} watched, "
+                f"{self.stats.active_polls}/{self.max_concurrent_polls} polling")
+
+    async def _poll_route(self, key: WatchKey, route: Route, delay: float = 0.0) -> None:
+        """Poll the route until no watch is left, feeding the train rides to every watch"""
+        try:
+            polls = 0
+            while route.watches:
+                await self.scheduler.wait(route.deadline, delay)
+                if not route.watches:
+                    break
+
+                async with self._poll_slots:
+                    self.stats.active_polls += 1
+                    try:
+                        # Only the first poll can be answered by the cache, the rest must be fresh
+                        rides = await route.scraper.get_trainrides(bypass_cache=polls > 0)
+                    finally:
+                        self.stats.active_polls -= 1
+                polls += 1
+                route.sold_out_polls = 0 if rides.any_available() else route.sold_out_polls + 1
+
+                fingerprint = rides_fingerprint(rides)
+                self.stats.polls += 1
+                if fingerprint == route.fingerprint:
+                    self.stats.unchanged_polls += 1
+                route.fingerprint = fingerprint
+                route.rides = rides
+
+                feeding = []
+                for watch in list(route.watches):
+                    if watch.on_poll is not None:
+                        watch.on_poll()
+
+                    # The filters already ran over these rides without finding anything
+                    if watch.fingerprint == fingerprint:
+                        self.stats.skipped_feeds += 1
+                    else:
+                        feeding.append((watch, list(watch.pending)))
+
+                # The filters of all the watches run together over a single index of the rides
+                filters = [ride_filter for _, pending in feeding for ride_filter in pending]
+                results = RideIndex(rides).filter_many(filters) if filters else []
+                start = 0
+                for watch, pending in feeding:
+                    end = start + len(pending)
+                    await self._feed(watch, list(zip(pending, results[start:end])), fingerprint)
+                    start = end
+                    if watch.done.done():
+                        route.watches.discard(watch)
+
+                if route.watches:
+                    delay = poll_interval(route.deadline, route.sold_out_polls)
+
+        except (RenfeBotException, Exception) as e:
+            for watch in route.watches:
+                watch.fail(e)
+
+        finally:
+            # From here on the route stops by itself, it's not cancelled while closing the scraper
+            route.closing = True
+            self._forget_route(key, route)
+            await route.scraper.close()
+
+    async def _feed(self, watch: Watch, matches: FilterMatches,
+                    fingerprint: Optional[int]) -> None:
+        """Feed a watch the results of its filters over the rides of a poll, failing the watch on
+        any error"""
+        self.stats.feeds += 1
+        try:
+            await watch.feed(matches)
+            watch.fingerprint = fingerprint
+        except (RenfeBotException, Exception) as e:
+            watch.fail(e)
+
+    def _forget_route(self, key: WatchKey, route: Route) -> None:
+        """Remove the route from the registry, unless it was already replaced by a new one"""
+        if self.routes.get(key) is route:
+            del self.routes[key]
+
+
+class UserSearches:
+    """Tasks of the searches running for each user, so they can be cancelled with /cancelar.
+
+    A user has at most one search running, starting a new one cancels the previous one.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.tasks
+
+    def start(self, user_id: int, search: Awaitable[None]) -> asyncio.Task:
+        """Run the search of a user in a new task
+
+        :param user_id: The Telegram user id
+        :type user_id: int
+        :param search: The search coroutine, usually :meth:`WatchRegistry.watch`
+        :type search: Awaitable[None]
+        :return: The task running the search
+        :rtype: asyncio.Task
+        """
+        self.cancel(user_id)
+        task = asyncio.ensure_future(search)
+        self.tasks[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+        return task
+
+    def cancel(self, user_id: int) -> bool:
+        """Cancel the search of a user
+
+        :param user_id: The Telegram user id
+        :type user_id: int
+        :return: True if the user had a search running
+        :rtype: bool
+        """
+        task = self.tasks.pop(user_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def _forget(self, user_id: int, task: asyncio.Task) -> None:
+        """Remove a finished task, unless the user already started another one"""
+        if self.tasks.get(user_id) is task:
+            del self.tasks[user_id]
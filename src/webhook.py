@@ -0,0 +1,208 @@
+"""This module contains the webhook mode of the bot: instead of asking Telegram for updates in a
+loop, Telegram sends every update to an HTTP server embedded in the bot as soon as it happens.
+
+The webhook mode is enabled with environment variables, without them the bot polls Telegram:
+
+- RENFE_BOT_WEBHOOK_URL: Public HTTPS URL where Telegram sends the updates, usually a reverse
+  proxy in front of the server
+- RENFE_BOT_WEBHOOK_LISTEN: Address the server listens on, defaults to 0.0.0.0
+- RENFE_BOT_WEBHOOK_PORT: Port the server listens on, defaults to 8080
+- RENFE_BOT_WEBHOOK_SECRET: Secret Telegram sends with every update, so nobody else can send
+  them, defaults to a random one on every start
+"""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import os
+import secrets
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telebot import async_telebot
+from telebot.types import Update
+
+from errors import RenfeBotException
+
+WEBHOOK_URL = os.environ.get("RENFE_BOT_WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("RENFE_BOT_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("RENFE_BOT_WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.environ.get("RENFE_BOT_WEBHOOK_SECRET", "")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: Update) -> Optional[int]:
+    """Return the chat of an update, or the user for the updates sent outside a chat like the
+    inline queries
+
+    :param update: The update
+    :type update: Update
+    :return: The chat id, or None if the update has no chat nor user
+    :rtype: Optional[int]
+    """
+    for message in (update.message, update.edited_message, update.channel_post,
+                    update.edited_channel_post):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    for query in (update.callback_query, update.inline_query, update.chosen_inline_result):
+        if query is not None:
+            return query.from_user.id
+    return None
+
+
+@dataclass
+class DispatcherStats:
+    """Counters of the updates dispatched
+
+    :param received: Updates submitted
+    :type received: int
+    :param processed: Updates processed, successfully or not
+    :type processed: int
+    :param failed: Updates whose processing raised an exception
+    :type failed: int
+    :param max_queued: Most updates waiting for the same chat at the same time
+    :type max_queued: int
+    """
+
+    received: int = 0
+    processed: int = 0
+    failed: int = 0
+    max_queued: int = 0
+
+
+class ChatDispatcher:
+    """Processes the updates of different chats at the same time, and the updates of the same
+    chat one after another in the order they arrived, so a conversation never sees its answers
+    out of order.
+
+    :param process: Coroutine that processes a list of updates, e.g.
+        AsyncTeleBot.process_new_updates
+    :type process: Callable[[List[Update]], Awaitable[None]]
+    """
+
+    def __init__(self, process: Callable[[List[Update]], Awaitable[None]]):
+        self.process = process
+        self.stats = DispatcherStats()
+        self.queues: Dict[int, Deque[Update]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, update: Update) -> None:
+        """Schedule the processing of an update, without waiting for it"""
+        self.stats.received += 1
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            self._spawn(self._process(update))
+            return
+
+        queue = self.queues.get(chat_id)
+        if queue is not None:
+            queue.append(update)
+            self.stats.max_queued = max(self.stats.max_queued, len(queue))
+            return
+        self.queues[chat_id] = deque([update])
+        self._spawn(self._drain(chat_id))
+
+    async def join(self) -> None:
+        """Wait until all the updates submitted are processed"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _drain(self, chat_id: int) -> None:
+        """Process the updates of a chat until none is left"""
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                # The update stays in the queue while it's processed, so the new ones wait
+                await self._process(queue[0])
+                queue.popleft()
+        finally:
+            del self.queues[chat_id]
+
+    async def _process(self, update: Update) -> None:
+        """Process an update, counting its errors instead of raising them"""
+        try:
+            await self.process([update])
+        except (RenfeBotException, Exception) as e:
+            self.stats.failed += 1
+            print(f"Error procesando la actualización {update.update_id}: {e!r}")
+        finally:
+            self.stats.processed += 1
+
+    def _spawn(self, coroutine: Awaitable[None]) -> None:
+        """Run a coroutine in a task that is kept until it finishes"""
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+class WebhookServer:
+    """HTTP server that receives the updates of the bot from Telegram.
+
+    Every update is answered as soon as it's queued in the dispatcher, so a slow handler never
+    makes Telegram wait or send it again.
+
+    :param bot: The bot
+    :type bot: async_telebot.AsyncTeleBot
+    :param url: Public URL of the webhook, its path is the path served
+    :type url: str
+    :param listen: Address the server listens on, defaults to WEBHOOK_LISTEN
+    :type listen: str, optional
+    :param port: Port the server listens on, 0 for any free one, defaults to WEBHOOK_PORT
+    :type port: int, optional
+    :param secret: Secret Telegram must send with the updates, defaults to WEBHOOK_SECRET or a
+        random one
+    :type secret: Optional[str], optional
+    """
+
+    def __init__(self, bot: async_telebot.AsyncTeleBot, url: str,
+                 listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 secret: Optional[str] = None):
+        self.bot = bot
+        self.url = url
+        self.listen = listen
+        self.port = port
+        self.secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self.dispatcher = ChatDispatcher(bot.process_new_updates)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        """Start the server and tell Telegram to send the updates to it"""
+        app = web.Application()
+        app.router.add_post(urlparse(self.url).path or "/", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        # The port actually used, for the servers started on any free port
+        self.port = self._runner.addresses[0][1]
+        await self.bot.set_webhook(self.url, secret_token=self.secret)
+
+    async def stop(self) -> None:
+        """Stop receiving updates and wait for the ones received to be processed. The webhook is
+        kept, so Telegram holds the updates until the bot starts again"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dispatcher.join()
+
+    async def serve_forever(self) -> None:
+        """Start the server and keep it running until the task is cancelled"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Receive an update from Telegram"""
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json())
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        self.dispatcher.submit(update)
+        return web.Response()
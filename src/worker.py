@@ -0,0 +1,122 @@
+"""This module contains the worker processes of the bot, started by bot.py when RENFE_BOT_WORKERS
+is over 0. Each worker polls Renfe for the jobs of its routes, with its own registry, cache of
+train lists and pool, and posts the results to the job queue (see jobs.py).
+
+A worker can also be started by hand, e.g. after killing it:
+
+    PYTHONPATH=src python src/worker.py <index> <workers>
+"""
+
+import asyncio
+from pathlib import Path
+import sys
+from typing import Dict, List, Optional, Union
+
+from cache import CACHE_FILE, TrainRidesCache
+from errors import RenfeBotException
+from executor import WorkerPool
+from jobs import JOBS_FILE, JOBS_POLL_INTERVAL, Job, JobQueue
+from models import TrainRideFilter, TrainRideRecord
+from scheduler import MAX_POLLS_PER_MINUTE, PollScheduler
+from scraper import split_rate_limits
+from watches import Watch, WatchRegistry
+
+
+async def run_job(queue: JobQueue, registry: WatchRegistry, job: Job) -> None:
+    """Watch the route of a job, posting its polls, its train rides and how it finished"""
+    assert job.id is not None
+    job_id = job.id
+
+    def on_poll() -> None:
+        queue.post(job_id, "poll")
+
+    async def on_rides(ride_filter: TrainRideFilter, rides: List[TrainRideRecord]) -> None:
+        filter_idx = next(idx for idx, f in enumerate(job.filters) if f is ride_filter)
+        queue.post(job_id, "rides", {
+            "filter": filter_idx,
+            "rides": [ride.model_dump(mode="json") for ride in rides],
+        })
+
+    watch = Watch(job.filters, on_rides, on_poll=on_poll)
+    try:
+        await registry.watch(watch, job.origin, job.destination, job.departure_date,
+                             job.return_date, job.departure_hours, job.return_hours,
+                             delay=job.delay)
+    except (RenfeBotException, Exception) as e:
+        queue.post(job_id, "error", {"type": type(e).__name__, "message": str(e)})
+    else:
+        queue.post(job_id, "done")
+
+
+async def serve(queue: JobQueue, worker: int, registry: WatchRegistry,
+                poll_interval: float = JOBS_POLL_INTERVAL,
+                stop: Optional[asyncio.Event] = None) -> None:
+    """Run the jobs of a worker as they are enqueued, and cancel the ones the front-end cancels,
+    until the stop event is set
+
+    :param queue: The job queue
+    :type queue: JobQueue
+    :param worker: Index of the worker
+    :type worker: int
+    :param registry: The registry that polls the routes of the worker
+    :type registry: WatchRegistry
+    :param poll_interval: Seconds between the reads of the queue, defaults to JOBS_POLL_INTERVAL
+    :type poll_interval: float, optional
+    :param stop: Event that stops the worker, defaults to None (run forever)
+    :type stop: Optional[asyncio.Event], optional
+    """
+    tasks: Dict[int, asyncio.Task] = {}
+    try:
+        while stop is None or not stop.is_set():
+            for job in queue.claim(worker):
+                assert job.id is not None
+                tasks[job.id] = asyncio.create_task(run_job(queue, registry, job))
+
+            for job_id in queue.cancelled(tasks):
+                tasks.pop(job_id).cancel()
+                queue.remove(job_id)
+            for job_id in [job_id for job_id, task in tasks.items() if task.done()]:
+                del tasks[job_id]
+
+            await asyncio.sleep(poll_interval)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
+def run_worker(worker: int, workers: int, path: Union[Path, str] = JOBS_FILE) -> None:
+    """Entry point of a worker process. The polls per minute and the rate limits of the Renfe
+    endpoints are split among the workers, so all of them together call Renfe as much as a single
+    process would
+
+    :param worker: Index of the worker, from 0 to workers - 1
+    :type worker: int
+    :param workers: Number of workers
+    :type workers: int
+    :param path: The job queue, defaults to JOBS_FILE
+    :type path: Union[Path, str], optional
+    """
+    async def main() -> None:
+        registry = WatchRegistry(
+            scheduler=PollScheduler(max(1, MAX_POLLS_PER_MINUTE // workers)),
+            # The first worker removes the expired train lists for all of them
+            cache=TrainRidesCache(path=CACHE_FILE, prune=worker == 0),
+            executor=WorkerPool(),
+        )
+        await serve(queue, worker, registry)
+
+    split_rate_limits(workers)
+    queue = JobQueue(path)
+    # The jobs this worker was running before being restarted
+    queue.release(worker)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    run_worker(int(sys.argv[1]), int(sys.argv[2]))
@@ -0,0 +1,62 @@
+"""Benchmark of parse_date against calling dateparser for every date, as validate_date did.
+
+The corpus has the kind of dates users answer to "¿Qué día y a partir de qué hora sales?". Pass
+a file with one date per line to use other inputs:
+
+    PYTHONPATH=src python tests/benchmarks/bench_dates.py [dates.txt]
+"""
+
+from datetime import datetime
+import statistics
+import sys
+import time
+from typing import Callable, List, Optional
+
+from dates import fast_parse_date, parse_date
+
+CORPUS = [
+    "21/06/2025", "21/06/2025 08:30", "1/7/2025 7:00", "15/08/2025 a las 18:00", "03-09-2025",
+    "hoy", "Hoy a las 07:00", "hoy 17:30", "mañana", "Mañana", "manana a las 8", "mañana 9:15",
+    "pasado mañana", "Pasado mañana 20:00", "viernes", "el viernes", "Viernes a las 16:30",
+    "domingo 19:00", "sábado", "lunes 6:45", "tomorrow", "tomorrow 10:00", "friday 9:00",
+    "2025-06-21", "21 de junio", "21 de junio a las 8", "June 21 2025", "en dos días",
+]
+
+
+def latencies(parse: Callable[[str], Optional[datetime]], corpus: List[str],
+              repeat: int = 20) -> List[float]:
+    """Return the latency of every parse of the corpus, in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        for text in corpus:
+            start = time.perf_counter()
+            parse(text)
+            times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name: str, times: List[float]) -> None:
+    """Print the median and the 99th percentile of the latencies"""
+    percentiles = statistics.quantiles(times, n=100)
+    print(f"{name}: median {statistics.median(times):.4f} ms, p99 {percentiles[98]:.4f} ms")
+
+
+if __name__ == "__main__":
+    corpus = CORPUS
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    import dateparser
+    print(f"dateparser import: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def legacy_parse(text: str) -> Optional[datetime]:
+        """validate_date before the fast path"""
+        return dateparser.parse(text, languages=["es", "en"], settings={"STRICT_PARSING": True})
+
+    legacy_parse(corpus[0])  # dateparser loads the languages in the first call
+    fast = sum(1 for text in corpus if fast_parse_date(text) is not None)
+    print(f"{fast} of {len(corpus)} dates parsed by the fast path")
+    report("dateparser", latencies(legacy_parse, corpus))
+    report("parse_date", latencies(parse_date, corpus))
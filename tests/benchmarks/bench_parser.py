@@ -0,0 +1,77 @@
+"""Benchmark of extract_train_list against the previous implementation (a DOTALL regex over the
+whole response followed by json5.loads).
+
+Run it with recorded getTrainsList responses, or without arguments to use a synthetic response
+with the same format:
+
+    PYTHONPATH=src python tests/benchmarks/bench_parser.py [response.txt ...]
+"""
+
+import random
+import re
+import sys
+import timeit
+from typing import Any, Dict
+
+import json5
+
+from scraper import extract_train_list
+
+
+def legacy_extract_train_list(response_text: str) -> Dict[str, Any]:
+    """extract_train_list as it was before the fast path"""
+    match = re.search(r"r\.handleCallback\([^,]+,\s*[^,]+,\s*(\{.*\})\);", response_text, re.DOTALL)
+    assert match is not None
+    return json5.loads(match.group(1))
+
+
+def synthetic_response(trains: int = 60) -> str:
+    """Build a getTrainsList response like the ones returned by DWR, with unquoted keys"""
+    beans = []
+    for idx in range(trains):
+        departure = 6 * 60 + idx * 15
+        duration = random.randint(150, 200)
+        arrival = departure + duration
+        beans.append(
+            "{"
+            f'horaSalida:"{departure // 60 % 24:02d}:{departure % 60:02d}",'
+            f'horaLlegada:"{arrival // 60 % 24:02d}:{arrival % 60:02d}",'
+            f"duracionViajeTotalEnMinutos:{duration},"
+            f'tarifaMinima:"{random.randint(20, 120)},{random.randint(0, 99):02d}",'
+            f"completo:{'true' if idx % 3 == 0 else 'false'},"
+            'razonNoDisponible:"",soloPlazaH:false,tipoTrenUno:"AVE",tipoTrenDos:null,'
+            f'codTren:"0{3000 + idx}",codProducto:"2",desProducto:"AVE",numPlazas:{idx},'
+            'estacionOrigen:"MADRID-PUERTA DE ATOCHA",estacionDestino:"BARCELONA-SANTS",'
+            'listaTarifas:[{codTarifa:"0001",desTarifa:"Básico",importe:"45,50",clase:"T"},'
+            '{codTarifa:"0002",desTarifa:"Elige",importe:"60,10",clase:"T"},'
+            '{codTarifa:"0003",desTarifa:"Prémium",importe:"98,30",clase:"P"}],'
+            'observaciones:"Servicio de restauración: \\"cafetería\\"",accesible:true'
+            "}"
+        )
+    return (
+        "throw 'allowScriptTagRemoting is false.';\n//#DWR-INSERT\n//#DWR-REPLY\n"
+        'r.handleCallback("1","0",{listadoTrenes:[{listviajeViewEnlaceBean:['
+        + ",".join(beans)
+        + ']}],mensaje:null,error:false});\n'
+    )
+
+
+def bench(name: str, response_text: str, number: int = 20) -> None:
+    """Time both implementations over a response and print the speedup"""
+    assert extract_train_list(response_text) == legacy_extract_train_list(response_text)
+    legacy = min(timeit.repeat(lambda: legacy_extract_train_list(response_text),
+                               number=number, repeat=3)) / number
+    current = min(timeit.repeat(lambda: extract_train_list(response_text),
+                                number=number, repeat=3)) / number
+    print(f"{name} ({len(response_text) / 1024:.0f} KB): legacy {legacy * 1000:.2f} ms, "
+          f"current {current * 1000:.3f} ms, {legacy / current:.0f}x faster")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "r", encoding="utf-8") as f:
+                bench(path, f.read())
+    else:
+        random.seed(0)
+        bench("synthetic", synthetic_response())
@@ -0,0 +1,85 @@
+"""Benchmark of the train records built per second from a parsed getTrainsList response.
+
+It compares the previous parser, which validated a TrainRideRecord for every train, against the
+TrainRideBatch one, which validates the records it builds in a single strict call. The polls only
+build the records of the rides shown to the users, so the rides parsed per second without building
+any record are shown too:
+
+    PYTHONPATH=src python tests/benchmarks/bench_records.py [trains]
+"""
+
+from datetime import datetime
+import random
+import sys
+import timeit
+from typing import Any, Dict, List
+
+from batch import TrainRideBatch
+from bench_parser import synthetic_response
+from models import StationRecord, TrainRideRecord
+from scraper import Scraper, extract_train_list
+
+
+def change_datetime_hour(hour: str, date: datetime) -> datetime:
+    """Scraper._change_datetime_hour as it was before the batches"""
+    hours, minute = map(int, hour.split(":"))
+    return date.replace(hour=hours, minute=minute, second=0, microsecond=0)
+
+
+def legacy_parse_train_list(scraper: Scraper, trains: Dict[str, Any]) -> List[TrainRideRecord]:
+    """Scraper._parse_train_list as it was before the batches"""
+    trains_records = []
+    for idx, train_way in enumerate(trains["listadoTrenes"]):
+        departure_direction = [scraper.origin.name, scraper.destination.name]
+        departure_time = scraper.departure_date if idx == 0 else scraper.return_date
+        if idx == 1:
+            departure_direction.reverse()
+
+        origin, destination = departure_direction
+        for train in train_way["listviajeViewEnlaceBean"]:
+            price = train["tarifaMinima"] or "NaN"
+            trains_records.append(TrainRideRecord(
+                origin=origin,
+                destination=destination,
+                departure_time=change_datetime_hour(train["horaSalida"], departure_time),
+                arrival_time=change_datetime_hour(train["horaLlegada"], departure_time),
+                duration=train["duracionViajeTotalEnMinutos"],
+                price=float(price.replace(",", ".")),
+                available=scraper._is_train_available(train),
+                train_type=train.get("tipoTrenUno", "N/A"),
+            ))
+    return trains_records
+
+
+def current_parse_train_list(scraper: Scraper, trains: Dict[str, Any]) -> List[TrainRideRecord]:
+    """Parse the trains into a batch and build the records of all of them"""
+    rides = scraper._parse_train_list(trains)
+    return rides.records(range(len(rides)))
+
+
+def batch_parse_train_list(scraper: Scraper, trains: Dict[str, Any]) -> TrainRideBatch:
+    """Parse the trains into a batch without building any record"""
+    return scraper._parse_train_list(trains)
+
+
+def records_per_second(parse, scraper: Scraper, trains: Dict[str, Any], number: int) -> float:
+    """Return the records built per second by a parse function, best of 3 runs"""
+    count = len(parse(scraper, trains))
+    best = min(timeit.repeat(lambda: parse(scraper, trains), number=number, repeat=3))
+    return count * number / best
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    trains = extract_train_list(synthetic_response(int(sys.argv[1]) if len(sys.argv) > 1 else 60))
+    scraper = Scraper(StationRecord(name="Madrid", code="MADRI"),
+                      StationRecord(name="Barcelona", code="BARCE"), datetime(2025, 1, 30))
+    assert legacy_parse_train_list(scraper, trains) == current_parse_train_list(scraper, trains)
+
+    legacy = records_per_second(legacy_parse_train_list, scraper, trains, number=200)
+    current = records_per_second(current_parse_train_list, scraper, trains, number=200)
+    parse_only = records_per_second(batch_parse_train_list, scraper, trains, number=200)
+
+    print(f"legacy: {legacy:,.0f} records/s")
+    print(f"batch: {current:,.0f} records/s ({current / legacy:.1f}x)")
+    print(f"parse only: {parse_only:,.0f} rides/s ({parse_only / legacy:.1f}x)")
@@ -0,0 +1,85 @@
+import math
+import pytest
+from datetime import datetime, timedelta
+from batch import TrainRideBatch, as_batch, from_minutes, to_minutes
+from models import TrainRideRecord
+
+
+def make_ride(hour, available=True, price=50.0, origin="Madrid"):
+    departure = datetime(2025, 1, 30, hour, 15)
+    return TrainRideRecord(
+        origin=origin,
+        destination="Barcelona",
+        departure_time=departure,
+        arrival_time=departure + timedelta(minutes=150),
+        duration=150,
+        price=price,
+        available=available,
+        train_type="AVE"
+    )
+
+
+def test_minutes_round_trip():
+    date = datetime(2025, 1, 30, 8, 45)
+    assert from_minutes(to_minutes(date)) == date
+    assert to_minutes(date.replace(second=59)) == to_minutes(date)
+
+
+def test_batch_round_trip():
+    rides = [make_ride(8), make_ride(12, available=False, origin="Sevilla")]
+    batch = TrainRideBatch.from_records(rides)
+    assert len(batch) == 2
+    assert list(batch) == rides
+    assert batch == rides
+    assert TrainRideBatch.from_rows(batch.rows()) == batch
+    assert as_batch(batch) is batch
+
+
+def test_batch_interns_strings():
+    batch = TrainRideBatch.from_records([make_ride(hour) for hour in range(6, 20)])
+    assert batch.strings == ["Madrid", "Barcelona", "AVE"]
+    assert set(batch.origins) == {batch.string_ids["Madrid"]}
+
+
+def test_batch_availability_bitmap():
+    rides = [make_ride(hour, available=hour % 3 == 0) for hour in range(20)]
+    batch = TrainRideBatch.from_records(rides)
+    assert len(batch.available) == 3
+    assert [batch.is_available(idx) for idx in range(20)] == [ride.available for ride in rides]
+    assert batch.available_mask == sum(1 << idx for idx in range(20) if idx % 3 == 0)
+    assert batch.any_available()
+    assert not TrainRideBatch.from_records([make_ride(8, available=False)]).any_available()
+
+
+def test_batch_indexing():
+    rides = [make_ride(hour) for hour in range(8, 12)]
+    batch = TrainRideBatch.from_records(rides)
+    assert batch[-1] == rides[-1]
+    assert batch[1:3] == rides[1:3]
+    with pytest.raises(IndexError):
+        batch[4]
+
+
+def test_batch_keeps_nan_prices():
+    batch = TrainRideBatch.from_records([make_ride(8, price=float("nan"))])
+    assert math.isnan(batch[0].price)
+
+
+def test_batch_extend_matches_append():
+    rides = [make_ride(hour, available=hour % 2 == 0) for hour in range(6, 18)]
+    batch = TrainRideBatch.from_records(rides[:3])
+    batch.extend("Madrid", "Barcelona",
+                 [to_minutes(ride.departure_time) for ride in rides[3:]],
+                 [to_minutes(ride.arrival_time) for ride in rides[3:]],
+                 [ride.duration for ride in rides[3:]], [ride.price for ride in rides[3:]],
+                 [ride.available for ride in rides[3:]], [ride.train_type for ride in rides[3:]])
+    assert batch == TrainRideBatch.from_records(rides)
+    assert batch.available_mask == TrainRideBatch.from_records(rides).available_mask
+
+
+def test_records_match_the_original_ones():
+    rides = [make_ride(8), make_ride(12, available=False)]
+    records = TrainRideBatch.from_records(rides).records(range(2))
+    assert records == rides
+    assert records[0].model_dump() == rides[0].model_dump()
+    assert records[0].model_copy(update={"price": 10.0}).price == 10.0
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, time, timedelta
+from functools import partial
+from unittest.mock import AsyncMock, MagicMock, patch
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.asyncio_storage import StateMemoryStorage
+from telebot.types import Update
+import bot
+from cache import TrainRidesCache
+from executor import WorkerPool
+from journal import StoredWatch, WatchJournal
+from models import SearchContext, StationRecord, TrainRideFilter
+from outbox import Outbox
+from scraper import AsyncScraper
+from watches import WatchRegistry
+
+
+def make_app(tmp_path, watch_registry=None):
+    return bot.create_bot("123456789:TEST", state_storage=StateMemoryStorage(),
+                          watch_registry=watch_registry or WatchRegistry(cache=TrainRidesCache()),
+                          executor=WorkerPool("inline"),
+                          watch_journal=WatchJournal(tmp_path / "watches.jsonl"))
+
+
+def make_stored_watch(user_id, days):
+    departure = datetime.now().replace(microsecond=0) + timedelta(days=days)
+    origin = StationRecord(name="MADRID", code="MADRI")
+    destination = StationRecord(name="BARCELONA", code="BARCE")
+    return StoredWatch(
+        user_id=user_id, chat_id=user_id,
+        context=SearchContext(user_id=user_id, origin=origin, destination=destination,
+                              departure_date=departure),
+        filters=[TrainRideFilter(origin=origin.name, destination=destination.name,
+                                 departure_date=departure)],
+    )
+
+
+def test_import_has_no_side_effects():
+    assert not hasattr(bot, "bot")
+    assert not hasattr(bot, "TOKEN")
+
+
+def test_create_bot_registers_the_handlers(tmp_path):
+    app = make_app(tmp_path)
+    commands = {command for handler in app.bot.message_handlers
+                for command in handler["filters"].get("commands") or ()}
+    assert {"start", "ayuda", "buscar", "cancelar", "debug"} <= commands
+    assert len(app.bot.inline_handlers) == 1
+
+
+def test_resume_searches(tmp_path):
+    journal = WatchJournal(tmp_path / "watches.jsonl")
+    journal.start(make_stored_watch(1, days=3))
+    journal.start(make_stored_watch(2, days=1))
+    journal.start(make_stored_watch(3, days=-2))
+    finished = make_stored_watch(4, days=2)
+    finished.found.add(0)
+    journal.start(finished)
+    journal.close()
+
+    registry = MagicMock()
+    registry.watch = AsyncMock()
+    app = make_app(tmp_path, watch_registry=registry)
+    app.bot.send_message = AsyncMock()
+
+    async def run():
+        for user_id in (3, 4):
+            await app.bot.set_state(user_id, bot.SearchStates.searching, user_id)
+        resumed = await app.resume_searches()
+        # The users are told in the background
+        await asyncio.sleep(0.05)
+        return resumed, [await app.bot.get_state(user_id, user_id) for user_id in (3, 4)]
+
+    resumed, states = asyncio.run(run())
+    assert resumed == 2
+    # The expired and finished searches don't leave their users stuck in the searching state
+    assert states == [None, None]
+    calls = registry.watch.await_args_list
+    assert [call.args[3].date() for call in calls] == [
+        (datetime.now() + timedelta(days=1)).date(), (datetime.now() + timedelta(days=3)).date()
+    ]
+    assert [call.kwargs["delay"] for call in calls] == [0.0, bot.RESUME_STAGGER]
+    # Two searches resumed and one expired
+    assert app.bot.send_message.await_count == 3
+    expired = app.bot.send_message.await_args_list[0].args
+    assert expired[0] == 3 and expired[1].startswith("⌛")
+    # The finished searches are removed from the journal
+    assert WatchJournal(tmp_path / "watches.jsonl").load() == []
+
+
+def test_resume_searches_of_blocked_users(tmp_path):
+    journal = WatchJournal(tmp_path / "watches.jsonl")
+    journal.start(make_stored_watch(1, days=1))
+    journal.start(make_stored_watch(2, days=2))
+    journal.close()
+    blocked = ApiTelegramException("sendMessage", None, {
+        "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+    })
+
+    async def send_message(chat_id, text, **kwargs):
+        if chat_id == 1:
+            raise blocked
+
+    async def watch(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    registry = MagicMock()
+    registry.watch = AsyncMock(side_effect=watch)
+    app = make_app(tmp_path, watch_registry=registry)
+    app.bot.send_message = AsyncMock(side_effect=send_message)
+
+    async def run():
+        # The startup doesn't fail nor wait for the messages
+        resumed = await app.resume_searches()
+        await asyncio.sleep(0.05)
+        return resumed
+
+    assert asyncio.run(run()) == 2
+    # The user who blocked the bot won't be resumed again after the next restart
+    assert [stored.user_id for stored in WatchJournal(tmp_path / "watches.jsonl").load()] == [2]
+
+
+def test_conversation_sends_the_hours_to_renfe(tmp_path):
+    registry = MagicMock()
+    registry.watch = AsyncMock()
+    # The conversation sends more messages to the chat than Telegram allows per second
+    with patch("bot.Outbox", partial(Outbox, chat_rate=1000, chat_burst=1000)):
+        app = make_app(tmp_path, watch_registry=registry)
+    app.bot.send_message = AsyncMock()
+    answers = ["/buscar", "Madrid (Todas)", "Barcelona-Sants", "mañana 06:00", "si",
+               "pasado mañana", "si", "0", "0", "08:00-12:30", "18-21"]
+
+    async def run():
+        for idx, text in enumerate(answers):
+            await app.bot.process_new_updates([Update.de_json({
+                "update_id": idx,
+                "message": {"message_id": idx, "date": 0, "text": text,
+                            "chat": {"id": 1, "type": "private"},
+                            "from": {"id": 1, "is_bot": False, "first_name": "Test"}},
+            })])
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    watch, origin, destination, departure_date, return_date, departure_hours, return_hours = (
+        registry.watch.await_args.args)
+    assert departure_hours == (time(8, 0), time(12, 30))
+    assert return_hours == (time(18, 0), time(21, 0))
+    assert watch.filters[0].min_departure_hour == time(8, 0)
+
+    scraper = AsyncScraper(origin, destination, departure_date, return_date,
+                           departure_hours=departure_hours, return_hours=return_hours)
+    payload = scraper._create_get_train_list_payload()
+    assert "08%3A00-12%3A30" in payload and "18%3A00-21%3A00" in payload
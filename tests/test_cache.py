@@ -0,0 +1,113 @@
+import pytest
+from datetime import datetime
+import time
+from unittest.mock import patch
+from batch import as_batch
+from cache import TrainRidesCache, cache_key
+from models import StationRecord, TrainRideRecord
+
+origin = StationRecord(name="Madrid", code="MAD")
+destination = StationRecord(name="Barcelona", code="BCN")
+
+
+@pytest.fixture
+def rides():
+    return [
+        TrainRideRecord(
+            origin="Madrid",
+            destination="Barcelona",
+            departure_time=datetime(2025, 1, 30, 8, 30),
+            arrival_time=datetime(2025, 1, 30, 11, 30),
+            duration=180,
+            price=50.0,
+            available=True,
+            train_type="AVE"
+        )
+    ]
+
+
+def test_cache_key_ignores_hours():
+    key = cache_key(origin, destination, datetime(2025, 1, 30, 8, 0))
+    assert key == cache_key(origin, destination, datetime(2025, 1, 30, 20, 0))
+    assert key != cache_key(origin, destination, datetime(2025, 1, 30), datetime(2025, 2, 1))
+    assert key != cache_key(origin, destination, datetime(2025, 1, 30), adults=2)
+
+
+def test_cache_hit_and_miss(rides):
+    cache = TrainRidesCache()
+    assert cache.get("key") is None
+    cache.set("key", rides)
+    assert cache.get("key") == rides
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.hit_rate == 0.5
+
+
+def test_cache_expires(rides):
+    cache = TrainRidesCache(ttl=30)
+    with patch("cache.time.time", return_value=1000):
+        cache.set("key", rides)
+    with patch("cache.time.time", return_value=1029):
+        assert cache.get("key") == rides
+    with patch("cache.time.time", return_value=1030):
+        assert cache.get("key") is None
+    assert "key" not in cache.entries
+
+
+def test_cache_evicts_least_recently_used(rides):
+    cache = TrainRidesCache(max_size=2)
+    cache.set("a", rides)
+    cache.set("b", rides)
+    cache.get("a")
+    cache.set("c", rides)
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats.evictions == 1
+
+
+def test_cache_persists_in_sqlite(rides, tmp_path):
+    cache = TrainRidesCache(path=tmp_path / "cache.db")
+    cache.set("key", rides)
+    cache.close()
+
+    cache = TrainRidesCache(path=tmp_path / "cache.db")
+    assert cache.get("key") == rides
+    assert cache.stats.disk_hits == 1
+    cache.clear()
+    assert TrainRidesCache(path=tmp_path / "cache.db").get("key") is None
+
+
+def test_locked_sqlite_is_not_an_error(rides, tmp_path):
+    path = tmp_path / "cache.db"
+    with patch("cache.CACHE_DB_TIMEOUT", 0.1):
+        cache = TrainRidesCache(path=path)
+        other = TrainRidesCache(path=path, prune=False)
+    other.db.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process is writing, the train list is only kept in memory
+        cache.set("key", rides)
+        cache.flush()
+        assert cache.get("key") == rides
+        assert cache.stats.disk_errors == 1
+    finally:
+        other.db.rollback()
+    assert cache.db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert TrainRidesCache(path=path).get("key") is None
+
+
+def test_unchanged_train_list_is_not_written_again(rides, tmp_path):
+    cache = TrainRidesCache(path=tmp_path / "cache.db")
+    batch = as_batch(rides)
+    cache.set("key", batch)
+    cache.flush()
+    [(first_expiration,)] = cache.db.execute("SELECT expires_at FROM train_ride_batches")
+    with patch("cache.time.time", return_value=time.time() + 10):
+        cache.set("key", batch)
+    cache.flush()
+    assert cache.stats.disk_writes == 1
+    cache.close()
+
+    cache = TrainRidesCache(path=tmp_path / "cache.db")
+    [(expiration,)] = cache.db.execute("SELECT expires_at FROM train_ride_batches")
+    # Only the expiration was updated
+    assert expiration > first_expiration
+    assert cache.get("key") == rides
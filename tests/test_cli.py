@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from cli import parse_args
+
+SRC = Path(__file__).parent.parent / "src"
+# Modules the CLI must not import before the arguments are parsed
+HEAVY_MODULES = {"aiohttp", "dateparser", "json5", "pydantic", "requests", "rich", "telebot",
+                 "thefuzz"}
+
+
+def imported_modules(*args):
+    """Run python -X importtime with the arguments and return the top level packages imported"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True, text=True, cwd=SRC.parent, env={**os.environ, "PYTHONPATH": str(SRC)},
+    )
+    return {
+        line.rsplit("|", 1)[1].strip().split(".")[0]
+        for line in result.stderr.splitlines() if line.startswith("import time:")
+    }
+
+
+def test_parse_args():
+    args = parse_args(["-o", "Madrid", "-d", "Barcelona", "--departure_date", "21/06/2025"])
+    assert (args.origin, args.destination, args.departure_date) == ("Madrid", "Barcelona",
+                                                                    "21/06/2025")
+    assert not args.no_cache
+
+
+def test_cli_help_imports_nothing_heavy():
+    assert not imported_modules(str(SRC / "cli.py"), "--help") & HEAVY_MODULES
+
+
+def test_search_path_imports_no_async_client():
+    modules = imported_modules("-c", "import cache, scraper, validators")
+    assert not modules & {"aiohttp", "dateparser", "json5", "rich", "telebot", "thefuzz"}
@@ -0,0 +1,46 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from dates import fast_parse_date, parse_date
+
+# A Sunday
+now = datetime(2026, 10, 18, 9, 41, 12)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("21/06/2027", datetime(2027, 6, 21)),
+    ("21/6/2027 8:30", datetime(2027, 6, 21, 8, 30)),
+    ("21-06-2027 a las 18:05", datetime(2027, 6, 21, 18, 5)),
+    ("hoy", now),
+    ("Hoy a las 07:00", datetime(2026, 10, 18, 7, 0)),
+    ("mañana", datetime(2026, 10, 19)),
+    ("MANANA 8", datetime(2026, 10, 19, 8, 0)),
+    ("pasado mañana a las 9", datetime(2026, 10, 20, 9, 0)),
+    ("tomorrow at 10:00", datetime(2026, 10, 19, 10, 0)),
+    ("viernes", datetime(2026, 10, 23)),
+    ("el Miércoles 18:30", datetime(2026, 10, 21, 18, 30)),
+    ("domingo", datetime(2026, 10, 25)),
+    ("Saturday 10h", datetime(2026, 10, 24, 10, 0)),
+])
+def test_fast_parse_date(text, expected):
+    assert fast_parse_date(text, now) == expected
+
+
+@pytest.mark.parametrize("text", ["31/02/2027", "hoy a las 25:00", "mañana 10:75"])
+def test_fast_parse_date_invalid(text):
+    with pytest.raises(ValueError):
+        fast_parse_date(text, now)
+    assert parse_date(text, now) is None
+
+
+def test_fast_parse_date_unknown_format():
+    assert fast_parse_date("2027-06-21", now) is None
+    assert fast_parse_date("la semana que viene", now) is None
+
+
+def test_parse_date_falls_back_to_dateparser():
+    with patch("dateparser.parse", return_value=datetime(2027, 6, 21)) as dateparser_parse:
+        assert parse_date("viernes", now) == datetime(2026, 10, 23)
+        dateparser_parse.assert_not_called()
+        assert parse_date("2027-06-21", now) == datetime(2027, 6, 21)
+        dateparser_parse.assert_called_once()
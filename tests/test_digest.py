@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock
+from digest import ChatDigests
+from models import StationRecord, TrainRideRecord
+from outbox import PRIORITY_ALERT
+
+origin = StationRecord(name="MADRID", code="MADRI")
+destination = StationRecord(name="BARCELONA", code="BARCE")
+
+
+def make_ride(hour):
+    return TrainRideRecord(
+        origin="Madrid",
+        destination="Barcelona",
+        departure_time=datetime(2025, 1, 30, hour, 0),
+        arrival_time=datetime(2025, 1, 30, hour + 3, 0),
+        duration=180,
+        price=50.0,
+        available=True,
+        train_type="AVE"
+    )
+
+
+def test_rides_of_a_chat_are_sent_together():
+    outbox = AsyncMock()
+    sent = []
+
+    async def run():
+        digests = ChatDigests(outbox, window=0.01)
+        digests.add(1, [make_ride(8)], origin, destination, on_sent=lambda: sent.append("a"))
+        digests.add(1, [make_ride(18)], destination, origin, on_sent=lambda: sent.append("b"))
+        digests.add(2, [make_ride(10)], origin, destination)
+        assert sent == []
+        await asyncio.sleep(0.05)
+        return digests
+
+    digests = asyncio.run(run())
+    assert outbox.send.await_count == 2
+    chat_id, text = outbox.send.await_args_list[0].args
+    assert chat_id == 1
+    assert text.count("He encontrado") == 2
+    assert outbox.send.await_args_list[0].kwargs == {"priority": PRIORITY_ALERT}
+    assert sent == ["a", "b"]
+    assert digests.pending == {}
+    assert (digests.stats.digests, digests.stats.sections, digests.stats.messages) == (2, 3, 2)
+
+
+def test_flush_sends_right_away():
+    outbox = AsyncMock()
+
+    async def run():
+        digests = ChatDigests(outbox, window=10)
+        digests.add(1, [make_ride(8)], origin, destination)
+        await digests.flush(1)
+        await digests.flush(1)
+
+    asyncio.run(run())
+    outbox.send.assert_awaited_once()
+
+
+def test_failed_digest_is_not_marked_as_sent():
+    outbox = AsyncMock()
+    outbox.send.side_effect = Exception("Forbidden")
+    sent = []
+
+    async def run():
+        digests = ChatDigests(outbox, window=0.01)
+        digests.add(1, [make_ride(8)], origin, destination, on_sent=lambda: sent.append(1))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert sent == []
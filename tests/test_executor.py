@@ -0,0 +1,53 @@
+import asyncio
+import math
+import threading
+import pytest
+from executor import WorkerPool
+
+
+def test_thread_pool_runs_out_of_the_event_loop():
+    pool = WorkerPool("thread", workers=2, queue_size=4)
+
+    async def run():
+        return await pool.run(threading.get_ident)
+
+    assert asyncio.run(run()) != threading.get_ident()
+    assert pool.stats.calls == 1
+    assert pool.stats.pending == 0
+    pool.shutdown()
+
+
+def test_process_pool():
+    pool = WorkerPool("process", workers=1, queue_size=0)
+    assert asyncio.run(pool.run(math.factorial, 10)) == 3628800
+    pool.shutdown()
+
+
+def test_inline_pool_counts_failures():
+    pool = WorkerPool("inline")
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run(int, "not a number"))
+    assert pool.stats.calls == pool.stats.failed == 1
+
+
+def test_full_queue_waits_in_the_event_loop():
+    pool = WorkerPool("thread", workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def run():
+        calls = [asyncio.create_task(pool.run(release.wait)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        stats = (pool.stats.pending, pool.queued, pool.stats.waiting)
+        release.set()
+        await asyncio.gather(*calls)
+        return stats
+
+    assert asyncio.run(run()) == (2, 1, 1)
+    assert pool.stats.max_pending == 2
+    assert "1 workers" in pool.describe()
+    pool.shutdown()
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        WorkerPool("fibers")
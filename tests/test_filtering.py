@@ -0,0 +1,113 @@
+import math
+import random
+import pytest
+from datetime import datetime, time, timedelta
+from errors import InvalidTrainRideFilter
+from filtering import RideIndex, iter_bits, prefix_masks
+from models import TrainRideFilter, TrainRideRecord
+
+
+def make_ride(departure, duration=180, price=50.0, available=True, origin="Madrid"):
+    return TrainRideRecord(
+        origin=origin,
+        destination="Barcelona",
+        departure_time=departure,
+        arrival_time=departure + timedelta(minutes=duration),
+        duration=duration,
+        price=price,
+        available=available,
+        train_type="AVE"
+    )
+
+
+def comparable(rides):
+    # NaN prices are never equal, and the index builds new records for its results
+    return [ride.model_copy(update={"price": None}) if math.isnan(ride.price) else ride
+            for ride in rides]
+
+
+def filter_result(ride_filter, rides):
+    try:
+        return comparable(ride_filter.filter_rides(rides))
+    except InvalidTrainRideFilter as e:
+        return type(e)
+
+
+def index_result(ride_filter, index):
+    try:
+        return comparable(index.filter_rides(ride_filter))
+    except InvalidTrainRideFilter as e:
+        return type(e)
+
+
+def test_bit_helpers():
+    assert prefix_masks([1, 4, 2]) == [0, 1, 5, 7]
+    assert list(iter_bits(0b10110)) == [1, 2, 4]
+
+
+def test_index_keeps_input_order():
+    rides = [make_ride(datetime(2025, 1, 30, 10)), make_ride(datetime(2025, 1, 30, 8))]
+    index = RideIndex(rides)
+    ride_filter = TrainRideFilter(origin="Madrid", destination="Barcelona",
+                                  departure_date=datetime(2025, 1, 30))
+    assert index.filter_rides(ride_filter) == rides
+
+
+def test_index_unpriced_rides_pass_price_filter():
+    rides = [make_ride(datetime(2025, 1, 30, 8), price=float("nan"))]
+    ride_filter = TrainRideFilter(origin="Madrid", destination="Barcelona",
+                                  departure_date=datetime(2025, 1, 30), max_price=10)
+    assert comparable(RideIndex(rides).filter_rides(ride_filter)) == comparable(rides)
+
+
+def test_index_no_results():
+    index = RideIndex([make_ride(datetime(2025, 1, 30, 8))])
+    ride_filter = TrainRideFilter(origin="Madrid", destination="Barcelona",
+                                  departure_date=datetime(2025, 1, 31))
+    with pytest.raises(InvalidTrainRideFilter):
+        index.filter_rides(ride_filter)
+    assert isinstance(index.filter_many([ride_filter])[0], InvalidTrainRideFilter)
+
+
+def test_index_matches_filter_rides():
+    rng = random.Random(0)
+    day = datetime(2025, 1, 30)
+    rides = [
+        make_ride(day + timedelta(days=rng.randint(0, 1), minutes=rng.randint(0, 24 * 60 - 1)),
+                  duration=rng.randint(60, 300),
+                  price=rng.choice([float("nan"), rng.uniform(10, 100)]),
+                  available=rng.random() < 0.5,
+                  origin=rng.choice(["Madrid", "Sevilla"]))
+        for _ in range(80)
+    ]
+    filters = []
+    for _ in range(300):
+        min_hour, max_hour = sorted(time(rng.randint(0, 23), rng.choice([0, 30])) for _ in "ab")
+        filters.append(TrainRideFilter(
+            origin=rng.choice(["Madrid", "Sevilla"]),
+            destination="Barcelona",
+            departure_date=day + timedelta(days=rng.randint(0, 2), hours=rng.randint(0, 23)),
+            min_departure_hour=rng.choice([None, min_hour]),
+            max_departure_hour=rng.choice([None, max_hour]),
+            max_duration_minutes=rng.choice([None, 0, rng.randint(60, 300)]),
+            max_price=rng.choice([None, 0, rng.uniform(10, 100)]),
+        ))
+
+    index = RideIndex(rides)
+    results = index.filter_many(filters)
+    for ride_filter, result in zip(filters, results):
+        expected = filter_result(ride_filter, rides)
+        assert index_result(ride_filter, index) == expected
+        assert (type(result) if isinstance(result, InvalidTrainRideFilter)
+                else comparable(result)) == expected
+
+
+def test_index_departure_date_with_seconds_at_the_end_of_the_day():
+    day = datetime(2025, 1, 30)
+    rides = [make_ride(day + timedelta(hours=23, minutes=59)), make_ride(day + timedelta(days=1))]
+    index = RideIndex(rides)
+    for departure_date in (day + timedelta(hours=23, minutes=59, seconds=30),
+                           day + timedelta(hours=23, minutes=59)):
+        ride_filter = TrainRideFilter(origin="Madrid", destination="Barcelona",
+                                      departure_date=departure_date)
+        assert index_result(ride_filter, index) == filter_result(ride_filter, rides)
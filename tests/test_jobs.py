@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, time
+import pytest
+from unittest.mock import patch, AsyncMock
+from batch import TrainRideBatch
+from errors import InvalidTrainRideFilter
+from jobs import Job, JobQueue, RemoteWatchRegistry, route_worker
+from models import StationRecord, TrainRideFilter, TrainRideRecord
+from watches import Watch, WatchKey, WatchRegistry
+from worker import serve
+
+origin = StationRecord(name="Madrid", code="MAD")
+destination = StationRecord(name="Barcelona", code="BCN")
+
+
+def make_ride(hour, available=True):
+    return TrainRideRecord(
+        origin="Madrid",
+        destination="Barcelona",
+        departure_time=datetime(2025, 1, 30, hour, 0),
+        arrival_time=datetime(2025, 1, 30, hour + 3, 0),
+        duration=180,
+        price=50.0,
+        available=available,
+        train_type="AVE"
+    )
+
+
+def make_filter(hour=0):
+    return TrainRideFilter(origin="Madrid", destination="Barcelona",
+                           departure_date=datetime(2025, 1, 30, hour, 0))
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db")
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def scraper_mock():
+    with patch("watches.AsyncScraper") as scraper_cls, \
+         patch("watches.poll_interval", return_value=0):
+        scraper_cls.return_value.close = AsyncMock()
+        yield scraper_cls
+
+
+def run_with_worker(queue, search):
+    """Run a search in the front-end while a worker serves its jobs in the same loop"""
+    async def run():
+        stop = asyncio.Event()
+        worker = asyncio.create_task(serve(queue, 0, WatchRegistry(), poll_interval=0.01,
+                                           stop=stop))
+        try:
+            return await search()
+        finally:
+            stop.set()
+            await worker
+
+    return asyncio.run(run())
+
+
+def test_route_worker_is_stable():
+    key = WatchKey.create(origin, destination, datetime(2025, 1, 30, 8, 0))
+    same_route = WatchKey.create(origin, destination, datetime(2025, 1, 30, 17, 0))
+    assert route_worker(key, 4) == route_worker(same_route, 4)
+    assert {route_worker(WatchKey.create(origin, destination, datetime(2025, 1, day)), 4)
+            for day in range(1, 29)} == {0, 1, 2, 3}
+
+
+def test_job_round_trip(queue):
+    job = Job([make_filter(8)], origin, destination, datetime(2025, 1, 30, 8, 0),
+              departure_hours=(time(8, 0), time(12, 0)), delay=2.0)
+    job_id = queue.submit(job, 1)
+
+    assert queue.claim(0) == []
+    [claimed] = queue.claim(1)
+    assert claimed.id == job_id
+    assert claimed.filters == job.filters
+    assert claimed.key == job.key
+    assert claimed.delay == 2.0
+    assert queue.claim(1) == []
+
+    queue.release(1)
+    assert [job.id for job in queue.claim(1)] == [job_id]
+
+
+def test_cancelled_jobs(queue):
+    job = Job([make_filter()], origin, destination, datetime(2025, 1, 30))
+    job_1, job_2, job_3 = (queue.submit(job, 0) for _ in range(3))
+    queue.cancel(job_1)
+    queue.remove(job_2)
+    assert queue.cancelled([job_1, job_2, job_3]) == {job_1, job_2}
+
+
+def test_results_are_taken_once(queue):
+    queue.post(1, "poll")
+    queue.post(1, "rides", {"filter": 0, "rides": []})
+    assert queue.take_results() == [(1, "poll", None), (1, "rides", {"filter": 0, "rides": []})]
+    assert queue.take_results() == []
+
+
+def test_remote_watch(queue, scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        side_effect=[TrainRideBatch.from_records([make_ride(12, available=False)]),
+                     TrainRideBatch.from_records([make_ride(8), make_ride(12)])]
+    )
+    front = RemoteWatchRegistry(queue, 1, poll_interval=0.01)
+    notified = []
+    polls = []
+
+    async def on_rides(ride_filter, rides):
+        notified.append((ride_filter, rides))
+
+    async def search():
+        watch = Watch([make_filter(10)], on_rides, on_poll=lambda: polls.append(1))
+        await front.watch(watch, origin, destination, datetime(2025, 1, 30, 10, 0))
+
+    run_with_worker(queue, search)
+    assert len(polls) == 2
+    assert notified == [(make_filter(10), [make_ride(12)])]
+    assert queue.job_counts() == {}
+
+
+def test_remote_watch_error(queue, scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=TrainRideBatch.from_records([make_ride(8)])
+    )
+    front = RemoteWatchRegistry(queue, 1, poll_interval=0.01)
+
+    async def search():
+        await front.watch(Watch([make_filter(20)], AsyncMock()), origin, destination,
+                          datetime(2025, 1, 30, 20, 0))
+
+    with pytest.raises(InvalidTrainRideFilter):
+        run_with_worker(queue, search)
+
+
+def test_cancelled_remote_watch_stops_the_worker(queue, scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=TrainRideBatch.from_records([make_ride(8, available=False)])
+    )
+    front = RemoteWatchRegistry(queue, 1, poll_interval=0.01)
+
+    async def search():
+        task = asyncio.create_task(front.watch(Watch([make_filter()], AsyncMock()), origin,
+                                               destination, datetime(2025, 1, 30)))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.sleep(0.1)
+        return task
+
+    task = run_with_worker(queue, search)
+    assert task.cancelled()
+    assert queue.job_counts() == {}
+    scraper_mock.return_value.close.assert_awaited_once()
@@ -0,0 +1,76 @@
+from datetime import datetime
+import json
+import journal as journal_module
+from journal import StoredWatch, WatchJournal
+from models import SearchContext, StationRecord, TrainRideFilter
+
+
+def make_stored_watch(user_id, return_trip=False):
+    origin = StationRecord(name="MADRID", code="MADRI")
+    destination = StationRecord(name="BARCELONA", code="BARCE")
+    filters = [TrainRideFilter(origin=origin.name, destination=destination.name,
+                               departure_date=datetime(2025, 1, 30, 8, 0), max_price=60.0)]
+    if return_trip:
+        filters.append(TrainRideFilter(origin=destination.name, destination=origin.name,
+                                       departure_date=datetime(2025, 2, 2, 17, 0)))
+    return StoredWatch(
+        user_id=user_id, chat_id=user_id * 10,
+        context=SearchContext(user_id=user_id, origin=origin, destination=destination,
+                              departure_date=datetime(2025, 1, 30, 8, 0), max_price=60.0),
+        filters=filters,
+    )
+
+
+def test_journal_replays_the_events(tmp_path):
+    path = tmp_path / "watches.jsonl"
+    journal = WatchJournal(path)
+    journal.start(make_stored_watch(1, return_trip=True))
+    journal.start(make_stored_watch(2))
+    journal.found(1, 0)
+    journal.polled(1, at=1000.0)
+    journal.finish(2)
+    journal.close()
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"event": "finish", "user_')  # Cut by a crash
+
+    watches = WatchJournal(path).load()
+    assert len(watches) == 1
+    watch = watches[0]
+    assert watch.chat_id == 10
+    assert watch.context.origin == StationRecord(name="MADRID", code="MADRI")
+    assert watch.found == {0}
+    assert watch.pending_filters == [make_stored_watch(1, return_trip=True).filters[1]]
+    assert (watch.last_poll, watch.polls) == (1000.0, 1)
+
+
+def test_journal_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "COMPACT_MIN_LINES", 10)
+    path = tmp_path / "watches.jsonl"
+    journal = WatchJournal(path)
+    journal.start(make_stored_watch(42))
+    for user_id in range(10):
+        journal.start(make_stored_watch(user_id))
+        journal.finish(user_id)
+        # Compacted while running, not only on load
+        assert len(path.read_text(encoding="utf-8").splitlines()) < 10
+    journal.close()
+
+    watches = WatchJournal(path).load()
+    assert [watch.user_id for watch in watches] == [42]
+    assert WatchJournal(path).load() == watches
+
+
+def test_polls_are_written_now_and_then(tmp_path):
+    path = tmp_path / "watches.jsonl"
+    journal = WatchJournal(path)
+    journal.start(make_stored_watch(42))
+    for idx in range(100):
+        journal.polled(42, at=1000.0 + idx * 60)
+    # The first poll, and one every POLL_SAVE_INTERVAL seconds
+    events = [json.loads(line)["event"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert events.count("poll") == 10
+    journal.close()
+
+    [watch] = WatchJournal(path).load()
+    assert (watch.last_poll, watch.polls) == (1000.0 + 99 * 60, 100)
@@ -0,0 +1,59 @@
+from datetime import datetime
+from messages import get_digest_messages, get_tickets_message, split_message
+from models import StationRecord, TrainRideRecord
+
+origin = StationRecord(name="MADRID", code="MADRI")
+destination = StationRecord(name="BARCELONA", code="BARCE")
+
+
+def make_ride(hour):
+    return TrainRideRecord(
+        origin="Madrid",
+        destination="Barcelona",
+        departure_time=datetime(2025, 1, 30, hour, 0),
+        arrival_time=datetime(2025, 1, 30, hour + 3, 0),
+        duration=180,
+        price=50.0,
+        available=True,
+        train_type="AVE"
+    )
+
+
+def test_tickets_message():
+    message = get_tickets_message([make_ride(8), make_ride(12)], origin, destination)
+    assert message == (
+        "He encontrado varios billetes de Madrid a Barcelona:\n\n"
+        "🚆 Tren AVE: 🕒 08:00 - 11:00 🕙 - 50.00 €\n"
+        "🚆 Tren AVE: 🕒 12:00 - 15:00 🕙 - 50.00 €\n"
+    )
+
+
+def test_digest_renders_all_the_sections():
+    [message] = get_digest_messages([([make_ride(8)], origin, destination),
+                                     ([make_ride(18)], destination, origin)])
+    assert message.count("He encontrado") == 2
+    assert "de Barcelona a Madrid" in message
+    assert "18:00" in message
+
+
+def test_split_message_between_lines():
+    text = "".join(f"line {idx}\n" for idx in range(10))
+    messages = split_message(text, limit=20)
+    assert messages == ["line 0\nline 1", "line 2\nline 3", "line 4\nline 5", "line 6\nline 7",
+                        "line 8\nline 9"]
+    assert split_message("short") == ["short"]
+    assert split_message("\n\n") == []
+
+
+def test_split_message_counts_like_telegram():
+    # Emojis out of the BMP count twice, and lines over the limit are cut
+    messages = split_message("🚆" * 5 + "\nabc", limit=4)
+    assert messages == ["🚆🚆", "🚆🚆", "🚆", "abc"]
+
+
+def test_long_digest_is_split():
+    rides = [make_ride(hour % 20) for hour in range(300)]
+    messages = get_digest_messages([(rides, origin, destination)])
+    assert len(messages) > 1
+    assert all(len(message.encode("utf-16-le")) // 2 <= 4096 for message in messages)
+    assert sum(message.count("🚆") for message in messages) == 300
@@ -97,6 +97,29 @@ def test_filter_rides_by_max_price(sample_rides):
     assert len(result) == 1  # Only the first ride should pass due to price
 
 
+def test_filter_rides_by_departure_hours(sample_rides):
+    filter = TrainRideFilter(
+        origin="Madrid",
+        destination="Barcelona",
+        departure_date=datetime(2025, 1, 30),
+        min_departure_hour=time(9, 0),
+        max_departure_hour=time(10, 0),
+    )
+
+    assert filter.departure_hours == (time(9, 0), time(10, 0))
+    with pytest.raises(InvalidTrainRideFilter):
+        filter.filter_rides([sample_rides[0]])  # Only the 09:30 ride is in the window
+    assert filter.filter_rides(sample_rides) == []  # And it's not available
+
+
+def test_filter_departure_hours_open_ends():
+    filter = TrainRideFilter(origin="Madrid", destination="Barcelona",
+                             departure_date=datetime(2025, 1, 30), max_departure_hour=time(12, 0))
+    assert filter.departure_hours == (time.min, time(12, 0))
+    filter.max_departure_hour = None
+    assert filter.departure_hours is None
+
+
 def test_filter_rides_no_results(sample_rides):
     filter = TrainRideFilter(
         origin="Madrid",
@@ -0,0 +1,130 @@
+import asyncio
+import time
+import pytest
+from telebot.asyncio_helper import ApiTelegramException
+from outbox import PRIORITY_ALERT, PRIORITY_CHAT, Outbox
+
+
+class FakeBot:
+    """Records the messages sent, failing with the errors given for some texts"""
+
+    def __init__(self, errors=None, delay=0.0):
+        self.sent = []
+        self.errors = errors or {}
+        self.delay = delay
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        errors = self.errors.get(text)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after},
+    })
+
+
+def test_messages_of_a_chat_keep_their_order():
+    bot = FakeBot(delay=0.01)
+
+    async def run():
+        outbox = Outbox(bot, chat_burst=10)
+        return await asyncio.gather(*(outbox.send(1, str(idx)) for idx in range(5)))
+
+    assert asyncio.run(run()) == ["0", "1", "2", "3", "4"]
+    assert bot.sent == [(1, "0"), (1, "1"), (1, "2"), (1, "3"), (1, "4")]
+
+
+def test_alerts_go_before_chatter():
+    bot = FakeBot()
+
+    async def run():
+        outbox = Outbox(bot, global_rate=20, global_burst=1)
+        sends = [asyncio.create_task(outbox.send(chat_id, f"chat {chat_id}"))
+                 for chat_id in range(1, 4)]
+        await asyncio.sleep(0)
+        sends.append(asyncio.create_task(outbox.send(9, "alert", priority=PRIORITY_ALERT)))
+        await asyncio.gather(*sends)
+
+    asyncio.run(run())
+    # The first message took the only token, the alert skipped the rest of the queue
+    assert bot.sent[:2] == [(1, "chat 1"), (9, "alert")]
+
+
+def test_chats_are_rate_limited():
+    bot = FakeBot()
+
+    async def run():
+        outbox = Outbox(bot, chat_rate=20, chat_burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*(outbox.send(1, str(idx)) for idx in range(3)),
+                             outbox.send(2, "other"))
+        return outbox, time.monotonic() - start
+
+    outbox, elapsed = asyncio.run(run())
+    assert elapsed >= 0.09
+    assert bot.sent[:2] == [(1, "0"), (2, "other")]
+    assert outbox.stats.sent == 4
+    assert outbox.stats.queued == 0
+    assert outbox.stats.max_queued == 4
+    assert outbox.stats.max_latency >= 0.09
+
+
+def test_retry_after_too_many_requests():
+    bot = FakeBot(errors={"hola": [too_many_requests(0.05)]})
+
+    async def run():
+        outbox = Outbox(bot)
+        start = time.monotonic()
+        result = await outbox.send(1, "hola")
+        return outbox, result, time.monotonic() - start
+
+    outbox, result, elapsed = asyncio.run(run())
+    assert result == "hola"
+    assert elapsed >= 0.05
+    assert outbox.stats.retried == 1
+    assert outbox.stats.sent == 1
+
+
+def test_failed_message_raises_to_the_caller():
+    forbidden = ApiTelegramException("sendMessage", None, {
+        "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+    })
+    bot = FakeBot(errors={"hola": [forbidden], "retry": [too_many_requests(0)] * 3})
+
+    async def run():
+        outbox = Outbox(bot, max_retries=2)
+        with pytest.raises(ApiTelegramException):
+            await outbox.send(1, "hola")
+        with pytest.raises(ApiTelegramException):
+            await outbox.send(2, "retry")
+        assert await outbox.send(1, "adiós", priority=PRIORITY_CHAT) == "adiós"
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert outbox.stats.failed == 2
+    assert outbox.stats.retried == 2
+    assert bot.sent == [(1, "adiós")]
+
+
+def test_cancelled_messages_are_not_sent():
+    bot = FakeBot()
+
+    async def run():
+        outbox = Outbox(bot, chat_rate=10, chat_burst=1)
+        first = asyncio.create_task(outbox.send(1, "first"))
+        second = asyncio.create_task(outbox.send(1, "second"))
+        await first
+        second.cancel()
+        await asyncio.sleep(0.15)
+        return outbox
+
+    outbox = asyncio.run(run())
+    assert bot.sent == [(1, "first")]
+    assert outbox.stats.queued == 0
+    assert outbox.lanes == {}
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from ratelimit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_bursts():
+    bucket = TokenBucket(rate=1, capacity=3, clock=FakeClock())
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.stats.queued == 0
+
+
+def test_bucket_queues_requests_in_order():
+    bucket = TokenBucket(rate=2, capacity=1, clock=FakeClock())
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.stats.queued == 2
+    assert bucket.stats.total_wait == pytest.approx(1.5)
+    assert bucket.stats.max_wait == pytest.approx(1.0)
+    assert bucket.stats.mean_wait == pytest.approx(0.5)
+
+
+def test_bucket_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now = 10
+    assert bucket.tokens == 0
+    assert bucket.reserve() == 0
+    assert bucket.tokens == 1  # Never more than the capacity
+
+
+def test_bucket_available_in_does_not_take_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=1, clock=clock)
+    assert bucket.available_in() == 0
+    bucket.reserve()
+    assert bucket.available_in() == pytest.approx(0.5)
+    assert bucket.available_in() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.available_in() == 0
+    assert bucket.stats.requests == 1
+
+
+def test_bucket_acquire_waits():
+    bucket = TokenBucket(rate=1, capacity=1, clock=FakeClock())
+    bucket.reserve()
+    with patch("ratelimit.asyncio.sleep") as sleep:
+        waited = asyncio.run(bucket.acquire())
+    sleep.assert_called_once_with(waited)
+    assert waited == pytest.approx(1.0)
+    assert bucket.stats.waiting == 0
+
+
+def test_rate_limiter_buckets_per_key():
+    limiter = RateLimiter({"search": (1, 1)}, default=(5, 2))
+    assert limiter.acquire_sync("search") == 0
+    assert limiter.acquire_sync("trains") == 0
+    assert limiter.bucket("search").rate == 1
+    assert limiter.bucket("trains").rate == 5
+    assert set(limiter.stats()) == {"search", "trains"}
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+from scheduler import PollScheduler, poll_interval
+
+now = datetime(2025, 1, 30, 8, 0)
+
+
+def test_poll_interval_closer_departures_poll_more():
+    soon = poll_interval(now + timedelta(hours=2), now=now)
+    tomorrow = poll_interval(now + timedelta(days=1), now=now)
+    next_month = poll_interval(now + timedelta(days=20), now=now)
+    far_away = poll_interval(now + timedelta(days=60), now=now)
+    assert soon < tomorrow < next_month < far_away
+
+
+def test_poll_interval_sold_out_backoff():
+    departure = now + timedelta(days=1)
+    normal = poll_interval(departure, now=now)
+    assert poll_interval(departure, sold_out_polls=9, now=now) == normal
+    assert poll_interval(departure, sold_out_polls=10, now=now) == normal * 2
+    assert poll_interval(departure, sold_out_polls=1000, now=now) == normal * 4
+
+
+def test_scheduler_earliest_deadline_first():
+    released = []
+
+    async def wait(scheduler, deadline):
+        await scheduler.wait(deadline, 0)
+        released.append(deadline)
+
+    async def run():
+        scheduler = PollScheduler(max_polls_per_minute=1, jitter=0)
+        tasks = [asyncio.create_task(wait(scheduler, now + timedelta(days=days)))
+                 for days in (3, 1, 2)]
+        await asyncio.sleep(0.05)
+        pending = scheduler.pending
+        polls = scheduler.polls_last_minute
+        for task in tasks:
+            task.cancel()
+        return pending, polls
+
+    pending, polls = asyncio.run(run())
+    assert released == [now + timedelta(days=1)]
+    assert pending == 2
+    assert polls == 1
+
+
+def test_scheduler_waits_for_delay():
+    async def run():
+        scheduler = PollScheduler(jitter=0)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await scheduler.wait(now, 0.05)
+        return loop.time() - start
+
+    assert asyncio.run(run()) >= 0.04
@@ -1,9 +1,12 @@
+import asyncio
 import pytest
-from datetime import datetime
-from unittest.mock import patch, MagicMock
-from src.scraper import Scraper, extract_dwr_token, extract_train_list, create_search_id, create_session_script_id, tokenify
+from datetime import datetime, time
+from unittest.mock import patch, MagicMock, AsyncMock
+from cache import TrainRidesCache
+from src.scraper import AsyncScraper, Scraper, extract_dwr_token, extract_train_list, parse_js_object, create_search_id, create_session_script_id, tokenify
 from models import StationRecord, TrainRideRecord
-from errors import InvalidDWRToken, InvalidTrainRideFilter
+from errors import InvalidDWRToken, InvalidTrainRideFilter, SessionExpired
+from executor import WorkerPool
 
 @pytest.fixture
 def scraper():
@@ -12,6 +15,19 @@ def scraper():
     departure_date = datetime(2023, 12, 25)
     return Scraper(origin, destination, departure_date)
 
+@pytest.fixture
+def async_scraper():
+    origin = StationRecord(name="Madrid", code="MAD")
+    destination = StationRecord(name="Barcelona", code="BCN")
+    departure_date = datetime(2023, 12, 25)
+    return AsyncScraper(origin, destination, departure_date)
+
+TRAIN_LIST_RESPONSE = (
+    'r.handleCallback("0","0",{"listadoTrenes":[{"listviajeViewEnlaceBean":[{"horaSalida":"08:30",'
+    '"horaLlegada":"11:00","duracionViajeTotalEnMinutos":150,"tarifaMinima":"45,50",'
+    '"completo":false,"razonNoDisponible":"","soloPlazaH":false,"tipoTrenUno":"AVE"}]}]});'
+)
+
 def test_create_search_id():
     search_id = create_search_id()
     assert len(search_id) == 5
@@ -42,6 +58,24 @@ def test_extract_train_list():
     train_list = extract_train_list(response_text)
     assert "listadoTrenes" in train_list
 
+def test_extract_train_list_unquoted_keys():
+    response_text = ("//#DWR-REPLY\nr.handleCallback(\"1\",\"0\",{listadoTrenes:[{horaSalida:"
+                     "\"08:30\",obs:\"a: b});\"}],error:false});\n")
+    train_list = extract_train_list(response_text)
+    assert train_list == {"listadoTrenes": [{"horaSalida": "08:30", "obs": "a: b});"}],
+                          "error": False}
+
+def test_extract_train_list_invalid():
+    with pytest.raises(SessionExpired):
+        extract_train_list("//#DWR-REPLY\nr.handleBatchException(...);")
+    with pytest.raises(SessionExpired):
+        extract_train_list("")
+
+def test_parse_js_object():
+    assert parse_js_object('{"a": [1, null]}') == {"a": [1, None]}
+    assert parse_js_object('{a: "b:c", $d_1: true}') == {"a": "b:c", "$d_1": True}
+    assert parse_js_object("{a: 'single quotes'}") == {"a": "single quotes"}
+
 def test_invalid_return_date():
     origin = StationRecord(name="Madrid", code="MAD")
     destination = StationRecord(name="Barcelona", code="BCN")
@@ -75,16 +109,9 @@ def test_do_update_session_objects(mock_post, scraper):
 def test_do_get_train_list(mock_post, scraper):
     mock_post.return_value.ok = True
     mock_post.return_value.text = 'r.handleCallback(0,0,{"listadoTrenes":[]});'
-    train_list = scraper._do_get_train_list()
+    train_list = extract_train_list(scraper._do_get_train_list())
     assert "listadoTrenes" in train_list
 
-def test_change_datetime_hour():
-    date = datetime(2023, 12, 25)
-    hour = "14:30"
-    new_date = Scraper._change_datetime_hour(hour, date)
-    assert new_date.hour == 14
-    assert new_date.minute == 30
-
 def test_is_train_available():
     train = {
         "completo": False,
@@ -111,3 +138,153 @@ def test_is_train_not_available_only_handicapped():
         "soloPlazaH": True
     }
     assert not Scraper._is_train_available(train)
+
+def test_async_get_trainrides(async_scraper):
+    responses = ["", "", 'r.handleCallback("0","0","test_token")', "", TRAIN_LIST_RESPONSE]
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, side_effect=responses) as post:
+        trains = asyncio.run(async_scraper.get_trainrides())
+    assert post.await_count == 5
+    assert async_scraper.dwr_token == "test_token"
+    assert len(trains) == 1
+    assert trains[0].price == 45.5
+    assert trains[0].departure_time == datetime(2023, 12, 25, 8, 30)
+    assert trains[0].available
+
+def test_async_get_trainrides_reuses_session(async_scraper):
+    responses = ["", "", 'r.handleCallback("0","0","test_token")', "", TRAIN_LIST_RESPONSE,
+                 TRAIN_LIST_RESPONSE]
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, side_effect=responses) as post:
+        asyncio.run(async_scraper.get_trainrides())
+        trains = asyncio.run(async_scraper.get_trainrides())
+    assert post.await_count == 6
+    assert len(trains) == 1
+    assert async_scraper.stats.handshakes == 1
+    assert async_scraper.stats.cheap_polls == 1
+
+def test_async_get_trainrides_expired_session(async_scraper):
+    async_scraper.dwr_token = "expired_token"
+    responses = ["//#DWR-REPLY\nr.handleBatchException(...)", "", "",
+                 'r.handleCallback("0","0","test_token")', "", TRAIN_LIST_RESPONSE]
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, side_effect=responses) as post:
+        trains = asyncio.run(async_scraper.get_trainrides())
+    assert post.await_count == 6
+    assert len(trains) == 1
+    assert async_scraper.dwr_token == "test_token"
+    assert async_scraper.stats.handshakes == 1
+    assert async_scraper.stats.cheap_polls == 0
+
+def test_async_get_trainrides_other_errors_are_raised(async_scraper):
+    async_scraper.dwr_token = "valid_token"
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock,
+                      side_effect=[AssertionError]) as post:
+        with pytest.raises(AssertionError):
+            asyncio.run(async_scraper.get_trainrides())
+    # A failed request is not an expired session, so there is no new handshake
+    assert post.await_count == 1
+    assert async_scraper.stats.handshakes == 0
+
+def test_unchanged_response_is_not_parsed_again(async_scraper):
+    next_response = TRAIN_LIST_RESPONSE.replace('handleCallback("0"', 'handleCallback("1"')
+    with patch.object(AsyncScraper, "_parse_train_list",
+                      wraps=async_scraper._parse_train_list) as parse:
+        first = async_scraper._parse_response(TRAIN_LIST_RESPONSE)
+        second = async_scraper._parse_response(next_response)
+    assert parse.call_count == 1
+    assert first == second
+    assert async_scraper.stats.unchanged_responses == 1
+
+def test_response_parsed_in_the_executor(async_scraper):
+    async_scraper.executor = WorkerPool("thread", workers=1)
+    trains = asyncio.run(async_scraper._parse_response_async(TRAIN_LIST_RESPONSE))
+    assert trains == Scraper(async_scraper.origin, async_scraper.destination,
+                             async_scraper.departure_date)._parse_response(TRAIN_LIST_RESPONSE)
+    assert async_scraper.executor.stats.calls == 1
+    async_scraper.executor.shutdown()
+
+def test_async_do_get_dwr_token_invalid(async_scraper):
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, return_value="invalid"):
+        with pytest.raises(InvalidDWRToken):
+            asyncio.run(async_scraper._do_get_dwr_token())
+
+def test_async_scraper_close(async_scraper):
+    async def use_scraper():
+        async with async_scraper:
+            api = async_scraper._get_api()
+        return api
+    api = asyncio.run(use_scraper())
+    assert api.closed
+    assert async_scraper.api is None
+
+@patch('src.scraper.requests.Session.post')
+def test_get_trainrides_reuses_session(mock_post, scraper):
+    mock_post.return_value.ok = True
+    mock_post.return_value.text = 'r.handleCallback(0,0,{"listadoTrenes":[]});'
+    scraper.dwr_token = "test_token"
+    scraper.get_trainrides()
+    assert mock_post.call_count == 1
+    assert scraper.stats.cheap_polls == 1
+    assert scraper.stats.handshakes == 0
+
+def test_get_trainrides_from_cache(scraper):
+    scraper.cache = TrainRidesCache()
+    scraper.cache.set(scraper.cache_key, [])
+    with patch.object(Scraper, "_fetch_trainrides", return_value=[]) as fetch:
+        scraper.get_trainrides()
+        assert not fetch.called
+        scraper.get_trainrides(bypass_cache=True)
+        assert fetch.call_count == 1
+    assert scraper.cache.stats.hits == 1
+
+def test_time_windows_in_payloads():
+    origin = StationRecord(name="Madrid", code="MAD")
+    destination = StationRecord(name="Barcelona", code="BCN")
+    scraper = Scraper(origin, destination, datetime(2023, 12, 25), datetime(2023, 12, 26),
+                      departure_hours=(time(8, 0), time(12, 30)))
+    assert scraper._create_search_payload()["franjaHoraI"] == "08:00-12:30"
+    assert scraper._create_search_payload()["franjaHoraV"] == ""
+    payload = scraper._create_get_train_list_payload()
+    assert "c0-e4=string:S\n" in payload
+    assert "c0-e5=string:\n" in payload
+    assert "c0-e6=string:08%3A00-12%3A30\n" in payload
+    assert scraper.cache_key != Scraper(origin, destination, datetime(2023, 12, 25),
+                                        datetime(2023, 12, 26)).cache_key
+
+def test_time_windows_not_accepted(async_scraper):
+    key = async_scraper.cache_key
+    async_scraper._set_time_windows((time(8, 0), time(12, 0)), None)
+    assert async_scraper.cache_key != key
+    handshake = ["", "", 'r.handleCallback("0","0","test_token")', ""]
+    responses = handshake + ["//#DWR-REPLY\nr.handleBatchException(...)"] + handshake + [
+        TRAIN_LIST_RESPONSE]
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, side_effect=responses):
+        trains = asyncio.run(async_scraper.get_trainrides())
+    assert len(trains) == 1
+    # The search without time windows worked, so they are not sent anymore
+    assert async_scraper.departure_hours is None
+    assert async_scraper.cache_key == key
+    assert async_scraper.stats.handshakes == 2
+
+def test_time_windows_kept_when_renfe_fails(async_scraper):
+    async_scraper._set_time_windows((time(8, 0), time(12, 0)), None)
+    key = async_scraper.cache_key
+    handshake = ["", "", 'r.handleCallback("0","0","test_token")', ""]
+    expired = "//#DWR-REPLY\nr.handleBatchException(...)"
+    responses = handshake + [expired] + handshake + [expired]
+    with patch.object(AsyncScraper, "_post", new_callable=AsyncMock, side_effect=responses):
+        with pytest.raises(SessionExpired):
+            asyncio.run(async_scraper.get_trainrides())
+    # Renfe failed without the time windows too, so the next poll tries them again
+    assert async_scraper.departure_hours == (time(8, 0), time(12, 0))
+    assert async_scraper.cache_key == key
+    assert async_scraper.dwr_token is None
+
+
+def test_split_rate_limits(monkeypatch):
+    import src.scraper as scraper_module
+    monkeypatch.setattr(scraper_module, "rate_limiter", scraper_module.rate_limiter)
+    scraper_module.split_rate_limits(4)
+    bucket = scraper_module.rate_limiter.bucket(scraper_module.TRAIN_LIST_URL)
+    assert (bucket.rate, bucket.capacity) == (0.5, 2.5)
+    bucket = scraper_module.rate_limiter.bucket(scraper_module.SEARCH_URL)
+    assert (bucket.rate, bucket.capacity) == (0.125, 1.25)
+    assert scraper_module.rate_limiter.bucket("other").rate == 0.125
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+import pytest
+from models import StationRecord
+from states import SQLiteStateStorage
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "states.db"
+
+
+def test_conversation_round_trip(path):
+    async def run():
+        storage = SQLiteStateStorage(path)
+        assert await storage.get_state(1, 2) is None
+        await storage.set_state(1, 2, "SearchStates:origin")
+        await storage.set_data(1, 2, "origin", StationRecord(name="Madrid", code="MADRI"))
+        async with storage.get_interactive_data(1, 2) as data:
+            data["departure_date"] = datetime(2025, 1, 30, 8, 0)
+        return storage
+
+    storage = asyncio.run(run())
+    storage.close()
+
+    reopened = SQLiteStateStorage(path)
+    assert asyncio.run(reopened.get_state(1, 2)) == "SearchStates:origin"
+    assert asyncio.run(reopened.get_data(1, 2)) == {
+        "origin": StationRecord(name="Madrid", code="MADRI"),
+        "departure_date": datetime(2025, 1, 30, 8, 0),
+    }
+    assert reopened.stats.misses == 1
+    assert asyncio.run(reopened.get_state(3, 2)) is None
+    reopened.close()
+
+
+def test_writes_are_batched(path):
+    async def run():
+        storage = SQLiteStateStorage(path, flush_interval=0.01)
+        for idx in range(10):
+            await storage.set_state(idx, idx, "SearchStates:origin")
+            await storage.set_state(idx, idx, "SearchStates:destination")
+        pending = len(storage.pending)
+        await asyncio.sleep(0.05)
+        return storage, pending
+
+    storage, pending = asyncio.run(run())
+    assert pending == 10
+    assert storage.stats.flushes == 1
+    assert storage.stats.writes == 10
+    storage.close()
+
+
+def test_delete_and_memory_limit(path):
+    async def run():
+        storage = SQLiteStateStorage(path, hot_size=2, max_pending=1)
+        for idx in range(5):
+            await storage.set_state(idx, idx, "SearchStates:origin")
+        assert len(storage.hot) == 2
+        assert await storage.delete_state(0, 0)
+        assert not await storage.delete_state(0, 0)
+        with pytest.raises(RuntimeError):
+            await storage.set_data(0, 0, "origin", None)
+        return storage
+
+    storage = asyncio.run(run())
+    assert storage.db.execute("SELECT COUNT(*) FROM states").fetchone()[0] == 4
+    storage.close()
+
+
+def test_processes_sharing_the_file(path):
+    async def run():
+        writer = SQLiteStateStorage(path, hot_size=0, flush_interval=0)
+        reader = SQLiteStateStorage(path, hot_size=0, flush_interval=0)
+        await writer.set_state(1, 1, "SearchStates:origin")
+        state = await reader.get_state(1, 1)
+        writer.close()
+        reader.close()
+        return state
+
+    assert asyncio.run(run()) == "SearchStates:origin"
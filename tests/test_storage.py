@@ -1,18 +1,28 @@
 import json
 import pytest
 from unittest.mock import patch, mock_open
-from thefuzz import process
+from thefuzz import fuzz
 from errors import StationNotFound
-from storage import StationsStorage, load_json, STATIONS_PATH
+from storage import (IndexedStation, StationSearchIndex, StationsStorage, load_json,
+                     load_stations, normalize_station_name, read_stations_index, STATIONS_PATH)
 
 
 # Sample data for testing
 mock_stations_data = {
-    "Madrid": {"desgEstacion": "Madrid", "clave": "1234"},
-    "Barcelona": {"desgEstacion": "Barcelona", "clave": "5678"},
-    "Sevilla": {"desgEstacion": "Sevilla", "clave": "91011"}
+    "Madrid": {"desgEstacion": "Madrid", "clave": "1234", "nmroPrioridad": 1},
+    "Barcelona": {"desgEstacion": "Barcelona", "clave": "5678", "nmroPrioridad": 2},
+    "Sevilla": {"desgEstacion": "Sevilla", "clave": "91011", "nmroPrioridad": 3}
 }
 
+
+@pytest.fixture(autouse=True)
+def stations_index(tmp_path):
+    # Build the index from the mocked JSON instead of reading the one in assets
+    with patch("storage.STATIONS_INDEX_PATH", tmp_path / "stations.idx"):
+        StationsStorage.stations = None
+        yield tmp_path / "stations.idx"
+    StationsStorage.stations = None
+
 # Test for the load_json function
 def test_load_json():
     with patch("storage.open", mock_open(read_data='{"Madrid": {"desgEstacion": "Madrid", "clave": "1234"}}')):
@@ -38,11 +48,9 @@ def test_get_station_not_found():
 
 # Test for find_station with fuzzy matching
 def test_find_station():
-    # Patch load_json and extractBests to simulate fuzzy matching
     with patch("storage.load_json", return_value=mock_stations_data):
-        with patch.object(process, 'extractBests', return_value=[("Madrid", 95)]):
-            result = StationsStorage.find_station("Madird")
-            assert result == ["Madrid"]
+        result = StationsStorage.find_station("Madrd")
+        assert result == ["Madrid"]
 
 
 # Test for get_all_stations
@@ -70,3 +78,92 @@ def test_load_json_invalid():
         with pytest.raises(json.JSONDecodeError):
             load_json(STATIONS_PATH)
 
+
+
+def test_normalize_station_name():
+    assert normalize_station_name("MÁLAGA MARÍA ZAMBRANO") == "malaga maria zambrano"
+    assert normalize_station_name("  L'HOSPITALET DE L'INFANT ") == "l hospitalet de l infant"
+
+
+def test_load_stations_builds_index(stations_index):
+    with patch("storage.load_json", return_value=mock_stations_data) as mock_load_json:
+        stations = load_stations(STATIONS_PATH, stations_index)
+        assert load_stations(STATIONS_PATH, stations_index) == stations
+    mock_load_json.assert_called_once()
+    assert read_stations_index(stations_index) == stations
+    assert stations["Barcelona"].code == "5678"
+    assert stations["Barcelona"].priority == 2
+    assert stations["Barcelona"].key == "barcelona"
+
+
+def test_load_stations_rebuilds_invalid_index(stations_index):
+    stations_index.write_text("something else\n", encoding="utf-8")
+    with patch("storage.load_json", return_value=mock_stations_data):
+        stations = load_stations(STATIONS_PATH, stations_index)
+    assert list(stations) == ["Madrid", "Barcelona", "Sevilla"]
+    assert read_stations_index(stations_index) == stations
+
+
+def test_stations_index_matches_json(tmp_path):
+    stations = load_stations(STATIONS_PATH, tmp_path / "stations.idx")
+    raw_stations = load_json(STATIONS_PATH)
+    assert list(stations) == list(raw_stations)
+    assert all(station.code == raw_stations[name]["clave"] for name, station in stations.items())
+
+
+def test_search_index_ignores_case_and_accents():
+    index = StationSearchIndex([
+        IndexedStation("MÁLAGA MARÍA ZAMBRANO", "1", 16, "malaga maria zambrano"),
+        IndexedStation("LEÓN", "2", 29, "leon"),
+    ])
+    assert [station.name for station, _ in index.search("malaga maria zambrano")] == [
+        "MÁLAGA MARÍA ZAMBRANO"
+    ]
+    assert [station.name for station, _ in index.search("Leon")] == ["LEÓN"]
+    assert index.search("le") == []
+
+
+def test_search_index_ranks_by_score_and_priority():
+    index = StationSearchIndex([
+        IndexedStation("BARCELONA-SANTS", "1", 4, "barcelona sants"),
+        IndexedStation("BARCELONA (TODAS)", "2", 3, "barcelona todas"),
+        IndexedStation("BARCELONA", "3", 10, "barcelona"),
+    ])
+    results = index.search("barcelona")
+    assert [station.code for station, _ in results] == ["3", "2", "1"]
+    assert index.search("barcelona", limit=1) == results[:1]
+
+
+def test_search_index_matches_full_scan(tmp_path):
+    stations = load_stations(STATIONS_PATH, tmp_path / "stations.idx")
+    index = StationSearchIndex(stations.values())
+    for name in ["Barcelona", "santiago compostela", "Valencia nord", "Zaragoza delicias",
+                 "Pamplona", "Ciudad rel", "Cordoba"]:
+        key = normalize_station_name(name)
+        full_scan = sorted(
+            ((station, fuzz.WRatio(key, station.key)) for station in stations.values()),
+            key=lambda result: (-result[1], result[0].priority),
+        )
+        assert index.search(name) == [result for result in full_scan if result[1] >= 90][:5]
+
+
+def test_search_index_completes_any_word():
+    index = StationSearchIndex([
+        IndexedStation("MADRID PTA. ATOCHA - ALMUDENA GRANDES", "1", 2,
+                       "madrid pta atocha almudena grandes"),
+        IndexedStation("MADRID (TODAS)", "2", 1, "madrid todas"),
+        IndexedStation("ALICANTE/ALACANT", "3", 18, "alicante alacant"),
+        IndexedStation("MADRID - ATOCHA CERCANÍAS", "4", 23, "madrid atocha cercanias"),
+    ])
+    assert [station.code for station in index.complete("Madrid")] == ["2", "1", "4"]
+    assert [station.code for station in index.complete("atocha")] == ["1", "4"]
+    assert [station.code for station in index.complete("ALACANT")] == ["3"]
+    assert [station.code for station in index.complete("madrid a")] == ["4"]
+    assert [station.code for station in index.complete("", limit=2)] == ["2", "1"]
+    assert index.complete("xyz") == []
+
+
+def test_complete_station():
+    with patch("storage.load_json", return_value=mock_stations_data):
+        assert StationsStorage.complete_station("bar") == ["Barcelona"]
+        assert StationsStorage.complete_station("", limit=2) == ["Madrid", "Barcelona"]
@@ -1,7 +1,7 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, time
 from dataclasses import dataclass
-from validators import validate_station, validate_date, validate_float
+from validators import validate_station, validate_date, validate_float, validate_time_window
 from errors import StationNotFound
 from models import StationRecord
 from storage import StationsStorage
@@ -96,3 +96,15 @@ def test_validate_float_no_text(mock_message):
     assert not result.is_valid
     assert result.number is None
     assert result.error_message == msg["wrong_number"]
+
+def test_validate_time_window():
+    assert validate_time_window("08:00-14:30").window == (time(8, 0), time(14, 30))
+    assert validate_time_window(" 8 - 14 ").window == (time(8, 0), time(14, 0))
+    zero = validate_time_window("0")
+    assert zero.is_valid and zero.window is None
+
+def test_validate_time_window_invalid():
+    for text in (None, "", "mañana", "14:00-08:00", "25:00-26:00", "08:75-09:00"):
+        result = validate_time_window(text)
+        assert not result.is_valid
+        assert result.error_message == msg["wrong_time_window"]
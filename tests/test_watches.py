@@ -0,0 +1,325 @@
+import asyncio
+import pytest
+from datetime import datetime, time
+from unittest.mock import patch, AsyncMock
+from batch import TrainRideBatch
+from errors import InvalidDWRToken, InvalidTrainRideFilter
+from filtering import RideIndex
+from models import StationRecord, TrainRideFilter, TrainRideRecord
+from watches import UserSearches, Watch, WatchKey, WatchRegistry
+
+origin = StationRecord(name="Madrid", code="MAD")
+destination = StationRecord(name="Barcelona", code="BCN")
+
+
+def make_rides(*rides):
+    return TrainRideBatch.from_records(rides)
+
+
+def make_ride(hour, available=True):
+    return TrainRideRecord(
+        origin="Madrid",
+        destination="Barcelona",
+        departure_time=datetime(2025, 1, 30, hour, 0),
+        arrival_time=datetime(2025, 1, 30, hour + 3, 0),
+        duration=180,
+        price=50.0,
+        available=available,
+        train_type="AVE"
+    )
+
+
+def make_filter(hour=0):
+    return TrainRideFilter(origin="Madrid", destination="Barcelona",
+                           departure_date=datetime(2025, 1, 30, hour, 0))
+
+
+@pytest.fixture
+def scraper_mock():
+    with patch("watches.AsyncScraper") as scraper_cls, \
+         patch("watches.poll_interval", return_value=0):
+        scraper_cls.return_value.close = AsyncMock()
+        yield scraper_cls
+
+
+def test_watch_key_ignores_hours():
+    key_1 = WatchKey.create(origin, destination, datetime(2025, 1, 30, 8, 0))
+    key_2 = WatchKey.create(origin, destination, datetime(2025, 1, 30, 17, 0))
+    assert key_1 == key_2
+    assert key_1.origin == "MAD"
+
+
+def test_watches_share_route(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=make_rides(make_ride(8), make_ride(12))
+    )
+    notified = []
+
+    async def on_rides(ride_filter, rides):
+        notified.append(len(rides))
+
+    async def run():
+        registry = WatchRegistry()
+        await asyncio.gather(
+            registry.watch(Watch([make_filter()], on_rides), origin, destination,
+                           datetime(2025, 1, 30, 0, 0)),
+            registry.watch(Watch([make_filter(10)], on_rides), origin, destination,
+                           datetime(2025, 1, 30, 10, 0)),
+        )
+        await asyncio.sleep(0)
+        return registry
+
+    registry = asyncio.run(run())
+    assert scraper_mock.call_count == 1
+    assert scraper_mock.return_value.get_trainrides.await_count == 1
+    assert sorted(notified) == [1, 2]
+    assert registry.routes == {}
+    scraper_mock.return_value.close.assert_awaited_once()
+
+
+def test_joining_watch_gets_the_last_rides(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=make_rides(make_ride(8, available=False), make_ride(14))
+    )
+    morning = make_filter(8).model_copy(update={"max_departure_hour": time(9, 0)})
+    on_rides = AsyncMock()
+
+    async def run():
+        registry = WatchRegistry()
+        with patch("watches.poll_interval", return_value=3600):
+            first = asyncio.create_task(registry.watch(Watch([morning], AsyncMock()), origin,
+                                                       destination, datetime(2025, 1, 30)))
+            await asyncio.sleep(0.01)
+            # The route won't poll again for an hour, the new watch uses the last poll
+            await asyncio.wait_for(registry.watch(Watch([make_filter(10)], on_rides), origin,
+                                                  destination, datetime(2025, 1, 30)), 1)
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+
+    asyncio.run(run())
+    assert scraper_mock.return_value.get_trainrides.await_count == 1
+    on_rides.assert_awaited_once()
+
+
+def test_filters_of_a_route_run_together(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=make_rides(make_ride(8), make_ride(12))
+    )
+    on_rides = AsyncMock()
+
+    async def run():
+        registry = WatchRegistry()
+        with patch.object(RideIndex, "filter_many", autospec=True,
+                          side_effect=RideIndex.filter_many) as filter_many:
+            await asyncio.gather(*(
+                registry.watch(Watch([make_filter(hour)], on_rides), origin, destination,
+                               datetime(2025, 1, 30))
+                for hour in (0, 10, 11)
+            ))
+        return filter_many
+
+    filter_many = asyncio.run(run())
+    # A single poll, and all the filters of its watches in a single call
+    filter_many.assert_called_once()
+    assert len(filter_many.call_args.args[1]) == 3
+    assert on_rides.await_count == 3
+
+
+def test_watch_polls_until_available(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        side_effect=[make_rides(make_ride(8, available=False)), make_rides(make_ride(8))]
+    )
+    on_rides = AsyncMock()
+
+    async def run():
+        registry = WatchRegistry()
+        await registry.watch(Watch([make_filter()], on_rides), origin, destination,
+                             datetime(2025, 1, 30))
+
+    asyncio.run(run())
+    assert scraper_mock.return_value.get_trainrides.await_count == 2
+    on_rides.assert_awaited_once()
+
+
+def test_watch_is_told_about_every_poll(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        side_effect=[make_rides(make_ride(8, available=False)), make_rides(make_ride(8))]
+    )
+    polls = []
+
+    async def run():
+        registry = WatchRegistry()
+        await registry.watch(Watch([make_filter()], AsyncMock(), on_poll=lambda: polls.append(1)),
+                             origin, destination, datetime(2025, 1, 30), delay=0.01)
+
+    asyncio.run(run())
+    assert len(polls) == 2
+
+
+def test_watch_invalid_filter(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(return_value=make_rides(make_ride(8)))
+
+    async def run():
+        registry = WatchRegistry()
+        await registry.watch(Watch([make_filter(20)], AsyncMock()), origin, destination,
+                             datetime(2025, 1, 30, 20, 0))
+
+    with pytest.raises(InvalidTrainRideFilter):
+        asyncio.run(run())
+
+
+def test_route_error_fails_all_watches(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(side_effect=InvalidDWRToken)
+
+    async def run():
+        registry = WatchRegistry()
+        return await asyncio.gather(
+            registry.watch(Watch([make_filter()], AsyncMock()), origin, destination,
+                           datetime(2025, 1, 30)),
+            registry.watch(Watch([make_filter()], AsyncMock()), origin, destination,
+                           datetime(2025, 1, 30)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, InvalidDWRToken) for result in results)
+
+
+def test_unchanged_rides_are_not_filtered_again(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(side_effect=[
+        make_rides(make_ride(8, available=False)),
+        make_rides(make_ride(8, available=False)),
+        make_rides(make_ride(8)),
+    ])
+    on_rides = AsyncMock()
+
+    async def run():
+        registry = WatchRegistry()
+        ride_filter = make_filter()
+        with patch.object(RideIndex, "filter_rides", autospec=True,
+                          side_effect=RideIndex.filter_rides) as filter_rides:
+            await registry.watch(Watch([ride_filter], on_rides), origin, destination,
+                                 datetime(2025, 1, 30))
+        return registry, filter_rides.call_count
+
+    registry, filter_calls = asyncio.run(run())
+    assert filter_calls == 2
+    assert registry.stats.polls == 3
+    assert registry.stats.unchanged_polls == 1
+    assert registry.stats.skipped_feeds == 1
+    on_rides.assert_awaited_once()
+
+
+def test_cancelled_watch_stops_its_route(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=make_rides(make_ride(8, available=False))
+    )
+
+    async def run():
+        registry = WatchRegistry()
+        search = asyncio.create_task(registry.watch(Watch([make_filter()], AsyncMock()), origin,
+                                                    destination, datetime(2025, 1, 30)))
+        await asyncio.sleep(0.01)
+        route_task = next(iter(registry.routes.values())).task
+        search.cancel()
+        await asyncio.gather(search, route_task, return_exceptions=True)
+        return registry
+
+    registry = asyncio.run(run())
+    assert registry.routes == {}
+    assert registry.stats.cancelled_routes == 1
+    scraper_mock.return_value.close.assert_awaited_once()
+
+
+def test_finished_watch_lets_its_route_close(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(return_value=make_rides(make_ride(8)))
+    closed = []
+
+    async def close():
+        await asyncio.sleep(0.01)
+        closed.append(True)
+
+    scraper_mock.return_value.close = AsyncMock(side_effect=close)
+
+    async def run():
+        registry = WatchRegistry()
+        search = asyncio.create_task(registry.watch(Watch([make_filter()], AsyncMock()), origin,
+                                                    destination, datetime(2025, 1, 30)))
+        await asyncio.sleep(0)
+        route_task = next(iter(registry.routes.values())).task
+        await search
+        await route_task
+        return registry, route_task
+
+    registry, route_task = asyncio.run(run())
+    assert not route_task.cancelled()
+    assert closed == [True]
+    assert registry.stats.cancelled_routes == 0
+
+
+def test_route_left_by_a_finished_watch_is_not_counted_as_cancelled(scraper_mock):
+    scraper_mock.return_value.get_trainrides = AsyncMock(
+        return_value=make_rides(make_ride(8, available=False))
+    )
+
+    async def run():
+        registry = WatchRegistry()
+        watch = Watch([make_filter()], AsyncMock())
+        with patch("watches.poll_interval", return_value=3600):
+            search = asyncio.create_task(registry.watch(watch, origin, destination,
+                                                        datetime(2025, 1, 30)))
+            await asyncio.sleep(0.01)
+            route_task = next(iter(registry.routes.values())).task
+            # The watch finishes while its route waits for the next poll
+            watch.done.set_result(None)
+            await search
+            await asyncio.gather(route_task, return_exceptions=True)
+        return registry, route_task
+
+    registry, route_task = asyncio.run(run())
+    # The route stops, as nobody is watching it, but no watch was cancelled
+    assert route_task.cancelled()
+    assert registry.routes == {}
+    assert registry.stats.cancelled_routes == 0
+    scraper_mock.return_value.close.assert_awaited_once()
+
+
+def test_concurrent_polls_are_limited(scraper_mock):
+    registry = WatchRegistry(max_concurrent_polls=2)
+    active = []
+
+    async def get_trainrides(bypass_cache):
+        active.append(registry.stats.active_polls)
+        await asyncio.sleep(0.01)
+        return make_rides(make_ride(8))
+
+    scraper_mock.return_value.get_trainrides = get_trainrides
+
+    async def run():
+        await asyncio.gather(*(
+            registry.watch(Watch([make_filter()], AsyncMock()), origin, destination,
+                           datetime(2025, 1, 30), departure_hours=(time(hour), time(23)))
+            for hour in range(5)
+        ))
+
+    asyncio.run(run())
+    assert len(active) == 5
+    assert max(active) == 2
+    assert registry.stats.active_polls == 0
+
+
+def test_user_searches_cancel():
+    async def run():
+        searches = UserSearches()
+        first = searches.start(1, asyncio.sleep(10))
+        second = searches.start(1, asyncio.sleep(10))
+        await asyncio.sleep(0)
+        assert first.cancelled() and 1 in searches
+        assert searches.cancel(1)
+        assert not searches.cancel(1)
+        await asyncio.gather(second, return_exceptions=True)
+        return searches, second
+
+    searches, second = asyncio.run(run())
+    assert second.cancelled()
+    assert len(searches) == 0
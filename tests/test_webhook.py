@@ -0,0 +1,158 @@
+import asyncio
+from unittest.mock import patch
+from urllib.parse import parse_qsl
+from aiohttp import ClientSession, web
+from telebot import async_telebot
+from telebot.types import Update
+from webhook import SECRET_HEADER, ChatDispatcher, WebhookServer, update_chat_id
+
+TOKEN = "123456789:TEST"
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+class FakeTelegram:
+    """Stand-in for the Bot API that records the calls made to it"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        # The Bot API client sends the parameters as a form, even in GET requests
+        params = dict(parse_qsl(await request.text()))
+        self.calls.append((method, params))
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            result = {"message_id": len(self.calls), "date": 0, "text": params["text"],
+                      "chat": {"id": chat_id, "type": "private"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def sent(self, chat_id):
+        return [params["text"] for method, params in self.calls
+                if method == "sendMessage" and int(params["chat_id"]) == chat_id]
+
+
+async def start_fake_telegram(fake):
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner, runner.addresses[0][1]
+
+
+def make_echo_bot():
+    """Bot that answers every message after a delay set by the message, "<text> <seconds>\""""
+    bot = async_telebot.AsyncTeleBot(TOKEN)
+
+    @bot.message_handler(func=lambda message: True)
+    async def echo(message):
+        text, delay = message.text.split()
+        await asyncio.sleep(float(delay))
+        await bot.send_message(message.chat.id, text)
+
+    return bot
+
+
+def run_with_webhook(bot, test):
+    """Run a test coroutine with the bot behind a webhook server and the fake Telegram"""
+    fake = FakeTelegram()
+
+    async def run():
+        runner, port = await start_fake_telegram(fake)
+        server = WebhookServer(bot, "https://example.org/telegram", listen="127.0.0.1", port=0,
+                               secret="s3cret")
+        with patch("telebot.asyncio_helper.API_URL", f"http://127.0.0.1:{port}/bot{{0}}/{{1}}"):
+            try:
+                await server.start()
+                async with ClientSession(f"http://127.0.0.1:{server.port}") as session:
+                    await test(session, server)
+            finally:
+                await server.stop()
+                await bot.close_session()
+                await runner.cleanup()
+
+    asyncio.run(run())
+    return fake
+
+
+def test_update_chat_id():
+    assert update_chat_id(Update.de_json(make_update(1, 42, "hola"))) == 42
+    inline = Update.de_json({"update_id": 2, "inline_query": {
+        "id": "1", "query": "ato", "offset": "",
+        "from": {"id": 7, "is_bot": False, "first_name": "Test"},
+    }})
+    assert update_chat_id(inline) == 7
+    assert update_chat_id(Update.de_json({"update_id": 3})) is None
+
+
+def test_dispatcher_keeps_the_order_of_each_chat():
+    processed = []
+
+    async def process(updates):
+        [update] = updates
+        chat_id, text = update.message.chat.id, update.message.text
+        await asyncio.sleep(0.05 if text == "first" else 0)
+        processed.append((chat_id, text))
+
+    async def run():
+        dispatcher = ChatDispatcher(process)
+        dispatcher.submit(Update.de_json(make_update(1, 1, "first")))
+        dispatcher.submit(Update.de_json(make_update(2, 1, "second")))
+        dispatcher.submit(Update.de_json(make_update(3, 2, "other")))
+        await dispatcher.join()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert processed == [(2, "other"), (1, "first"), (1, "second")]
+    assert dispatcher.stats.processed == 3
+    assert dispatcher.stats.max_queued == 2
+    assert dispatcher.queues == {}
+
+
+def test_webhook_dispatches_updates():
+    async def test(session, server):
+        updates = [make_update(1, 1, "a 0.1"), make_update(2, 1, "b 0"), make_update(3, 1, "c 0"),
+                   make_update(4, 2, "x 0")]
+        for update in updates:
+            async with session.post("/telegram", json=update,
+                                    headers={SECRET_HEADER: "s3cret"}) as response:
+                assert response.status == 200
+        await server.dispatcher.join()
+
+    fake = run_with_webhook(make_echo_bot(), test)
+    assert fake.calls[0] == ("setWebhook", {"url": "https://example.org/telegram",
+                                            "secret_token": "s3cret"})
+    assert fake.sent(1) == ["a", "b", "c"]
+    assert fake.sent(2) == ["x"]
+    # The other chat didn't wait for the slow message
+    sent = [params["text"] for method, params in fake.calls if method == "sendMessage"]
+    assert sent.index("x") < sent.index("a")
+
+
+def test_webhook_rejects_wrong_secret():
+    async def test(session, server):
+        async with session.post("/telegram", json=make_update(1, 1, "a 0"),
+                                headers={SECRET_HEADER: "wrong"}) as response:
+            assert response.status == 403
+        async with session.post("/telegram", data="not json",
+                                headers={SECRET_HEADER: "s3cret"}) as response:
+            assert response.status == 400
+        await server.dispatcher.join()
+
+    fake = run_with_webhook(make_echo_bot(), test)
+    assert fake.sent(1) == []